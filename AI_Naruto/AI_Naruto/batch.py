@@ -0,0 +1,290 @@
+"""
+Batched generation of legal actions for many states at once (e.g. for
+simulation or training code), with NumPy. This module needs NumPy, which the
+player itself does not (nothing in the player imports this module): it is an
+optional dependency (see requirements-optional.txt), and tests/test_batch.py
+checks this module against State (skipped without NumPy).
+
+A batch of N states is an N x 64 array of signed stack heights, with the
+same convention as State.tokens (> 0 for white, < 0 for black), and squares
+numbered x + 8*y as in AI_Naruto.distance (see encode). Legal actions come
+back in structure-of-arrays form: flat arrays of moves (source square,
+target square, number of tokens) and of BOOMs (square), with offsets giving
+each state's slice:
+
+    batch = legal_actions(heights, colors)
+    i's moves are batch.source[batch.offsets[i]:batch.offsets[i+1]], etc.
+
+Every (source, target) pair a move could ever make is precomputed, walking
+out from each square in each direction to the edge of the board, so the
+legal moves are found by masking those pairs for all states at once: a pair
+is legal if the source holds at least as many of the player's tokens as the
+distance, and the target holds none of the other player's tokens.
+
+BOOMs are given for every stack (State.actions gives one per blast
+component instead, which needs a connectivity search for each state).
+
+evaluate() evaluates a batch of states at once, exactly as the player does
+one State at a time, for batching leaves across many games (see
+AI_Naruto.selfplay), from the evaluation features of each state (features(),
+also used to tune the weights, see AI_Naruto.tune).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from AI_Naruto.distance import SQUARES, SQUARE_INDEX, MAX_STEP, \
+    MAX_HEIGHT, UNREACHABLE, ATTACK_DISTANCES
+from AI_Naruto.player import MATERIAL_WEIGHT, INFINITY
+
+SIGNS = {"white": 1, "black": -1}
+
+_STEP_DIRECTIONS = [(-1, +0), (+1, +0), (+0, -1), (+0, +1)]
+
+
+def _rays():
+    """Every (source, target, distance) a move could make, as arrays."""
+    sources, targets, distances = [], [], []
+    for i, (x, y) in enumerate(SQUARES):
+        for dx, dy in _STEP_DIRECTIONS:
+            for d in range(1, MAX_STEP + 1):
+                qr = (x + d*dx, y + d*dy)
+                if qr not in SQUARE_INDEX:
+                    break
+                sources.append(i)
+                targets.append(SQUARE_INDEX[qr])
+                distances.append(d)
+    return (np.array(sources, dtype=np.intp),
+            np.array(targets, dtype=np.intp),
+            np.array(distances, dtype=np.int16))
+
+RAY_SOURCES, RAY_TARGETS, RAY_DISTANCES = _rays()
+
+# ATTACK_TABLE[n, i, j]: moves for a stack of height n on square i to get
+# next to square j (see AI_Naruto.distance), UNREACHABLE for no stack (n = 0)
+# or no square (i or j = NO_SQUARE, for padding)
+NO_SQUARE = 64
+ATTACK_TABLE = np.full((MAX_HEIGHT + 1, 65, 65), UNREACHABLE, dtype=np.uint8)
+for _n in range(1, MAX_HEIGHT + 1):
+    ATTACK_TABLE[_n, :64, :64] = [list(row) for row in ATTACK_DISTANCES[_n]]
+_ATTACK_FLAT = ATTACK_TABLE.ravel()
+
+EVALUATE_CHUNK = 1 << 12 # states per attack distance step
+_NO_LABEL = 127          # label of empty squares while finding components
+# squares in a 10 x 10 board with a border of empty squares (so that each
+# square's neighbours are at fixed offsets in a flat array: see
+# _best_boom_gains)
+_PADDED = np.array([(y + 1) * 10 + x + 1 for x, y in SQUARES])
+
+
+BatchActions = namedtuple("BatchActions", [
+    "offsets",      # (N+1,) state i's moves are [offsets[i]:offsets[i+1]]
+    "source",       # square moved from
+    "target",       # square moved to
+    "count",        # number of tokens moved
+    "boom_offsets", # (N+1,) state i's BOOMs are [boom_offsets[i]:...[i+1]]
+    "boom_square",  # square of each BOOM
+])
+
+
+def encode(states):
+    """An N x 64 array of signed stack heights for a sequence of States."""
+    return np.array([[state.tokens[qr] for qr in SQUARES]
+                     for state in states], dtype=np.int8)
+
+def legal_actions(heights, colors):
+    """
+    All legal actions in a batch of states: `heights` is an N x 64 array of
+    signed stack heights (see encode), and `colors` is the player to move:
+    "white" or "black" for every state, or an array of N signs (1 for white,
+    -1 for black). Return a BatchActions.
+    """
+    heights = np.asarray(heights)
+    if heights.ndim != 2 or heights.shape[1] != len(SQUARES):
+        raise ValueError(f"expected an N x {len(SQUARES)} array of heights, "
+                         f"not shape {heights.shape}")
+    n_states = heights.shape[0]
+    signs = SIGNS[colors] if isinstance(colors, str) else \
+        np.asarray(colors).reshape(-1, 1)
+    # the player's stacks > 0, the other player's < 0
+    own = heights.astype(np.int16) * signs
+
+    # mask the possible moves of every state at once
+    source_heights = own[:, RAY_SOURCES]
+    legal = (source_heights >= RAY_DISTANCES) & (own[:, RAY_TARGETS] >= 0)
+    rows, rays = np.nonzero(legal)
+    # each legal (source, target) gives a move for each number of tokens
+    counts = source_heights[rows, rays].astype(np.intp)
+    offsets = _offsets(rows, n_states, counts)
+    group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    count = np.arange(offsets[-1]) - group_starts + 1
+
+    boom_rows, boom_square = np.nonzero(own > 0)
+    return BatchActions(
+        offsets=offsets,
+        source=np.repeat(RAY_SOURCES[rays], counts),
+        target=np.repeat(RAY_TARGETS[rays], counts),
+        count=count,
+        boom_offsets=_offsets(boom_rows, n_states),
+        boom_square=boom_square,
+    )
+
+def _offsets(rows, n_states, counts=None):
+    """Offsets of each state's slice of items, given the state of each group
+    of items (`rows`, in order) and how many items are in each group
+    (`counts`, or 1 each)."""
+    offsets = np.zeros(n_states + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum(np.bincount(rows, weights=counts,
+                                        minlength=n_states))
+    return offsets
+
+def actions(batch, i):
+    """State i's actions from a BatchActions, as action tuples (moves, then
+    BOOMs)."""
+    start, end = batch.offsets[i], batch.offsets[i + 1]
+    moves = [("MOVE", int(n), SQUARES[source], SQUARES[target])
+             for n, source, target in zip(batch.count[start:end],
+                                          batch.source[start:end],
+                                          batch.target[start:end])]
+    start, end = batch.boom_offsets[i], batch.boom_offsets[i + 1]
+    return moves + [("BOOM", SQUARES[square])
+                    for square in batch.boom_square[start:end]]
+
+
+def features(heights, signs):
+    """
+    The evaluation features (see AI_Naruto.player.FEATURES) of a batch of
+    states, for the player to move in each: `heights` is an N x 64 array of
+    signed stack heights, and `signs` is 1 (white to move) or -1 (black)
+    for every state, or an array of N of them. Return an N x 4 float array
+    (meaningless for states where either player has no tokens).
+    """
+    heights = np.asarray(heights)
+    n_states = heights.shape[0]
+    signs = np.broadcast_to(np.asarray(signs, dtype=np.int16).reshape(-1, 1),
+                            (n_states, 1))
+    own = heights.astype(np.int16) * signs
+    mine = np.maximum(own, 0)
+    theirs = np.maximum(-own, 0)
+
+    limit = MATERIAL_WEIGHT - 1
+    result = np.empty((n_states, 4))
+    result[:, 0] = mine.sum(axis=1) - theirs.sum(axis=1)
+    result[:, 1] = np.maximum(_best_boom_gains(heights != 0, own), 0)
+    for start in range(0, n_states, EVALUATE_CHUNK):
+        end = start + EVALUATE_CHUNK
+        my_stacks = _stacks(mine[start:end])
+        their_stacks = _stacks(theirs[start:end])
+        result[start:end, 2] = np.minimum(
+            _attack_distances(their_stacks, my_stacks), limit)
+        result[start:end, 3] = np.minimum(
+            _attack_distances(my_stacks, their_stacks), limit)
+    return result
+
+def outcomes(heights, signs):
+    """
+    For each state (as for features), 1 if the player to move has won (the
+    other player has no tokens), -1 if they have lost, 0 if neither player
+    has any tokens, and None (as NaN) if the game isn't over.
+    """
+    own = np.asarray(heights).astype(np.int16) * \
+        np.asarray(signs, dtype=np.int16).reshape(-1, 1)
+    have_mine = (own > 0).any(axis=1)
+    have_theirs = (own < 0).any(axis=1)
+    result = np.full(own.shape[0], np.nan)
+    result[~have_mine] = -1
+    result[~have_theirs & have_mine] = 1
+    result[~have_theirs & ~have_mine] = 0
+    return result
+
+def evaluate(heights, signs, weights):
+    """
+    Evaluate a batch of states (as for features) for the player to move in
+    each, with `weights` (see AI_Naruto.player.load_weights), as
+    AI_NarutoPlayer.evaluate does one State at a time. Return an array of N
+    values.
+    """
+    values = np.round(features(heights, signs) @ np.asarray(weights,
+                                                            dtype=float))
+    values = values.astype(np.int64)
+    # the game is over if either player has no tokens
+    over = outcomes(heights, signs)
+    ended = ~np.isnan(over)
+    values[ended] = over[ended].astype(np.int64) * INFINITY
+    return values
+
+def _stacks(heights):
+    """
+    The stacks in each state (heights, N x 64, of one player's stacks), as
+    (squares, heights): two N x K arrays, for K the most stacks in any of the
+    states (at most MAX_HEIGHT), padded with stacks of height 0 on NO_SQUARE.
+    """
+    occupied = heights > 0
+    rows, squares = np.nonzero(occupied)
+    # each stack's place among its state's stacks (in order of square)
+    places = (np.cumsum(occupied, axis=1) - 1)[rows, squares]
+    k = max(int(places.max(initial=0)) + 1, 1)
+    stack_squares = np.full((heights.shape[0], k), NO_SQUARE, dtype=np.intp)
+    stack_heights = np.zeros((heights.shape[0], k), dtype=np.intp)
+    stack_squares[rows, places] = squares
+    stack_heights[rows, places] = np.minimum(heights[rows, squares],
+                                             MAX_HEIGHT)
+    return stack_squares, stack_heights
+
+def _attack_distances(stacks, targets):
+    """The fewest moves for any of the stacks to get next to any of the
+    targets (both as given by _stacks) in each state. Only occupied squares
+    are looked up (at most 12 by 12 per state, rather than 64 by 64)."""
+    squares, heights = stacks
+    target_squares, _ = targets
+    # (indices into the flattened ATTACK_TABLE, N x K x K')
+    index = (heights * 65 + squares)[:, :, np.newaxis] * 65 + \
+        target_squares[:, np.newaxis, :]
+    table = _ATTACK_FLAT.take(index.reshape(index.shape[0], -1))
+    return table.min(axis=1).astype(np.int64)
+
+def _best_boom_gains(occupied, own):
+    """
+    For each state, the most tokens the player to move can gain with a
+    BOOM: the other player's tokens minus theirs in the best blast component
+    with one of their stacks. Components are found by giving each occupied
+    square its own label, then repeatedly taking the lowest label around
+    each occupied square, until nothing changes (in each state: states
+    which have settled are set aside, as most settle in a few steps). The
+    squares are laid out flat with a border (see _PADDED), so the lowest
+    label in each 3 x 3 block is the lowest of each row of 3 (neighbours 1
+    apart), then of each column of 3 of those (10 apart), over contiguous
+    slices of every state at once.
+    """
+    n_states = occupied.shape[0]
+    padded = np.zeros((n_states, 100), dtype=bool)
+    padded[:, _PADDED] = occupied
+    labels = np.full((n_states, 100), _NO_LABEL, dtype=np.int8)
+    labels[:, _PADDED] = np.where(occupied, np.arange(64, dtype=np.int8),
+                                  _NO_LABEL)
+    result = labels
+    active = np.arange(n_states)
+    while len(active):
+        rows = np.full_like(labels, _NO_LABEL)
+        lowest = np.full_like(labels, _NO_LABEL)
+        np.minimum(labels[:, :-2], labels[:, 1:-1], out=rows[:, 1:-1])
+        np.minimum(rows[:, 1:-1], labels[:, 2:], out=rows[:, 1:-1])
+        np.minimum(rows[:, :-20], rows[:, 10:-10], out=lowest[:, 10:-10])
+        np.minimum(lowest[:, 10:-10], rows[:, 20:], out=lowest[:, 10:-10])
+        lowest = np.where(padded, lowest, np.int8(_NO_LABEL))
+        changed = (lowest != labels).any(axis=1)
+        result[active] = lowest
+        active = active[changed]
+        labels = lowest[changed]
+        padded = padded[changed]
+
+    # total tokens (signed for the player to move) in each component
+    keys = (np.arange(n_states).reshape(-1, 1) * 65 +
+            np.where(occupied, result[:, _PADDED], 64))
+    totals = np.bincount(keys.ravel(), weights=own.ravel(),
+                         minlength=n_states * 65).reshape(n_states, 65)
+    has_mine = np.bincount(keys.ravel(), weights=(own > 0).ravel(),
+                           minlength=n_states * 65).reshape(n_states, 65) > 0
+    gains = np.where(has_mine, -totals, -np.inf).max(axis=1)
+    return np.where(np.isfinite(gains), gains, 0).astype(np.int64)
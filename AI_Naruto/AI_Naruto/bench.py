@@ -0,0 +1,430 @@
+"""
+Benchmarks for the parts of our player where speed matters. Run with:
+
+    python -m AI_Naruto.bench <benchmark> [-n REPEATS] [-d DEPTH]
+
+Benchmarks:
+    pq      shortest paths over the board (for each stack height, from
+            every square, around random blocked squares) using
+            util.PriorityQueue, against the original linear-scan version
+    actions generating the legal actions in positions after random moves,
+            with State.actions against the original list-building version
+    batch   generating white's legal actions in many states at once with
+            AI_Naruto.batch (needs NumPy), against State.actions
+    search  iterative deepening to a fixed depth (-d) from fixed positions
+            (the initial position and -n positions after random moves), with
+            plain alpha-beta (with and without move ordering) against
+            principal variation search, with and without aspiration windows,
+            and with each selective search technique (see SEARCHES), and
+            without the evaluation cache, giving the states searched and the
+            leaves evaluated, the effective branching factor (nodes in the
+            last iteration over nodes in the one before), the evaluation
+            cache hit rate, and how often the best action and its value are
+            those found by full-width alpha-beta (selective search can change
+            them; the others can only through repetitions and the
+            transposition table)
+    tables  starting up (importing the player and constructing one), each in
+            a new process: building the distance tables, building them and
+            writing the cache file, and mapping the cache file (see
+            AI_Naruto.tablecache), giving the time and resident memory
+"""
+import os
+import sys
+import time
+import heapq
+import random
+import itertools
+import argparse
+import tempfile
+import subprocess
+
+from AI_Naruto.util import PriorityQueue
+from AI_Naruto.player import STEP_DIRECTIONS, ALL_SQUARES, AI_NarutoPlayer
+
+
+class LinearPriorityQueue:
+    """
+    The original util.PriorityQueue (update scans the heap, then heapifies),
+    for comparison.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.count = 0
+
+    def push(self, item, priority):
+        entry = (priority, self.count, item)
+        heapq.heappush(self.heap, entry)
+        self.count += 1
+
+    def pop(self):
+        (_, _, item) = heapq.heappop(self.heap)
+        return item
+
+    def isEmpty(self):
+        return len(self.heap) == 0
+
+    def update(self, item, priority):
+        for index, (p, c, i) in enumerate(self.heap):
+            if i == item:
+                if p <= priority:
+                    break
+                del self.heap[index]
+                self.heap.append((priority, c, item))
+                heapq.heapify(self.heap)
+                break
+        else:
+            self.push(item, priority)
+
+
+def shortest_paths(Queue, source, height, blocked):
+    """
+    Dijkstra's algorithm: the number of moves for a stack of `height` tokens
+    to reach each square from `source`, avoiding `blocked` squares. Moves
+    cost 1 (for a realistic number of relaxations, they are weighted by
+    distance to break ties).
+    """
+    distances = {source: 0}
+    done = set()
+    queue = Queue()
+    queue.push(source, 0)
+    while not queue.isEmpty():
+        qr = queue.pop()
+        if qr in done:
+            continue
+        done.add(qr)
+        x, y = qr
+        for dx, dy in STEP_DIRECTIONS:
+            for d in range(1, height + 1):
+                next_qr = (x + d*dx, y + d*dy)
+                if next_qr not in ALL_SQUARES or next_qr in blocked:
+                    continue
+                distance = distances[qr] + 1 + d / 100
+                if distance < distances.get(next_qr, distance + 1):
+                    distances[next_qr] = distance
+                    queue.update(next_qr, distance)
+    return distances
+
+
+class TracingQueue(PriorityQueue):
+    """
+    A PriorityQueue recording the operations made on it (in `trace`, with
+    a number for each queue).
+    """
+    trace = []
+    numbers = itertools.count()
+
+    def __init__(self):
+        super().__init__()
+        self.number = next(self.numbers)
+
+    def push(self, item, priority):
+        self.trace.append((self.number, "push", item, priority))
+        super().push(item, priority)
+
+    def update(self, item, priority):
+        self.trace.append((self.number, "update", item, priority))
+        super().update(item, priority)
+
+    def pop(self):
+        self.trace.append((self.number, "pop"))
+        return super().pop()
+
+    def isEmpty(self):
+        self.trace.append((self.number, "isEmpty"))
+        return super().isEmpty()
+
+
+def replay(Queue, trace):
+    """Make the operations of a trace (see TracingQueue) on new queues."""
+    queues = {}
+    for number, op, *args in trace:
+        queue = queues.get(number)
+        if queue is None:
+            queue = queues[number] = Queue()
+        getattr(queue, op)(*args)
+
+
+def bench_pq(repeats, **options):
+    rng = random.Random("AI_Naruto")
+    workloads = []
+    for _ in range(repeats):
+        blocked = set(rng.sample(sorted(ALL_SQUARES), 12))
+        for height in range(1, 13):
+            for source in sorted(ALL_SQUARES - blocked):
+                workloads.append((source, height, blocked))
+    print(f"{len(workloads)} shortest path searches on the 64-square board")
+    results = {}
+    for Queue in [LinearPriorityQueue, PriorityQueue]:
+        start = time.perf_counter()
+        results[Queue] = [shortest_paths(Queue, *workload)
+                          for workload in workloads]
+        elapsed = time.perf_counter() - start
+        print(f"{Queue.__name__:>20}: {elapsed:7.3f}s "
+              f"({elapsed / len(workloads) * 1e6:6.1f}us per search)")
+    if results[LinearPriorityQueue] != results[PriorityQueue]:
+        print("error: the queues found different distances!")
+        return 1
+
+    # and just the queue operations of those searches
+    TracingQueue.trace = trace = []
+    for workload in workloads:
+        shortest_paths(TracingQueue, *workload)
+    print(f"{len(trace)} queue operations, replayed")
+    for Queue in [LinearPriorityQueue, PriorityQueue]:
+        start = time.perf_counter()
+        replay(Queue, trace)
+        elapsed = time.perf_counter() - start
+        print(f"{Queue.__name__:>20}: {elapsed:7.3f}s "
+              f"({elapsed / len(trace) * 1e9:6.0f}ns per operation)")
+    return 0
+
+
+def copying_legal_actions(state, color):
+    """
+    The original State.get_legal_actions (copying the stacks, trying every
+    distance in every direction, with a BOOM for every stack), for
+    comparison.
+    """
+    if color == "white":
+        enemy_color = "black"
+        my_tokens = state.white_tokens.copy()
+    else:
+        enemy_color = "white"
+        my_tokens = state.black_tokens.copy()
+
+    legal_actions = []
+    for qr in my_tokens:
+        p = my_tokens.get(qr)
+        q, r = qr
+        for step_directions_q, step_directions_r in STEP_DIRECTIONS:
+            for i in range(1, p + 1):
+                q_next = q + step_directions_q * i
+                r_next = r + step_directions_r * i
+                qr_next = q_next, r_next
+                if qr_next in state.board:
+                    if not state.enemy_occupied(qr_next, enemy_color):
+                        for n in range(1, p + 1):
+                            legal_actions.append(("MOVE", n, qr, qr_next))
+        legal_actions.append(("BOOM", qr))
+    return legal_actions
+
+
+def random_states(count):
+    """States after up to 40 random actions (fixed, for repeatable runs)."""
+    rng = random.Random("AI_Naruto")
+    states = []
+    for _ in range(count):
+        player = AI_NarutoPlayer("white")
+        for turn in range(rng.randrange(40)):
+            colour = ("white", "black")[turn % 2]
+            actions = player.state.get_legal_actions(colour)
+            if not player.state.white_tokens or \
+                    not player.state.black_tokens:
+                break
+            player.update(colour, rng.choice(actions))
+        states.append(player.state)
+    return states
+
+
+def bench_actions(repeats, **options):
+    states = random_states(repeats * 200)
+    print(f"generating actions for both players in {len(states)} states")
+    tests = [
+        ("copying", copying_legal_actions),
+        ("State.actions", lambda state, color: list(state.actions(color))),
+        ("skip symmetric",
+            lambda state, color: list(state.actions(color, True))),
+        # as when the first few actions searched cause a cutoff
+        ("first 4 only",
+            lambda state, color: list(itertools.islice(
+                state.actions(color), 4))),
+    ]
+    for name, generate in tests:
+        count = 0
+        start = time.perf_counter()
+        for state in states:
+            for color in ("white", "black"):
+                count += len(generate(state, color))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>15}: {elapsed:7.3f}s "
+              f"({elapsed / len(states) / 2 * 1e6:6.1f}us per state), "
+              f"{count / len(states) / 2:5.1f} actions per state")
+    return 0
+
+
+def bench_batch(repeats, **options):
+    try:
+        from AI_Naruto import batch
+    except ImportError:
+        print("error: the batch benchmark needs NumPy")
+        return 1
+    states = random_states(repeats * 200)
+    print(f"generating white's actions in {len(states)} states")
+    start = time.perf_counter()
+    singly = [state.get_legal_actions("white") for state in states]
+    elapsed = time.perf_counter() - start
+    print(f"{'State.actions':>15}: {elapsed:7.3f}s "
+          f"({elapsed / len(states) * 1e6:6.1f}us per state)")
+    start = time.perf_counter()
+    heights = batch.encode(states)
+    encoded = time.perf_counter()
+    batched = batch.legal_actions(heights, "white")
+    elapsed = time.perf_counter() - start
+    print(f"{'batch':>15}: {elapsed:7.3f}s "
+          f"({elapsed / len(states) * 1e6:6.1f}us per state, of which "
+          f"{(encoded - start) / len(states) * 1e6:.1f}us encoding)")
+    # (the batch gives a BOOM for every stack, not every blast component)
+    for i, actions in enumerate(singly):
+        moves = {action for action in actions if action[0] == "MOVE"}
+        if moves != {action for action in batch.actions(batched, i)
+                     if action[0] == "MOVE"}:
+            print(f"error: the batch found different moves in state {i}!")
+            return 1
+    return 0
+
+
+def positions(count):
+    """
+    The initial position, and `count` positions after random moves (and no
+    BOOMs), each as a list of (colour, action) from the initial position.
+    """
+    rng = random.Random("AI_Naruto")
+    games = [[]]
+    for i in range(count):
+        player = AI_NarutoPlayer("white")
+        game = []
+        for turn in range(10 + 4*i):
+            colour = ("white", "black")[turn % 2]
+            action = rng.choice([action for action in
+                                 player.state.get_legal_actions(colour)
+                                 if action[0] == "MOVE"])
+            player.update(colour, action)
+            game.append((colour, action))
+        games.append(game)
+    return games
+
+FULL_WIDTH = {"pvs": False, "aspiration": 0,
+              "lmr": False, "futility": False, "null_move": False}
+PVS = {**FULL_WIDTH, "pvs": True, "aspiration": AI_NarutoPlayer.aspiration}
+SEARCHES = [
+    ("alpha-beta", FULL_WIDTH),
+    ("unordered", {**FULL_WIDTH, "ordering": False}),
+    ("pvs", {**FULL_WIDTH, "pvs": True}),
+    ("pvs+aspiration", PVS),
+    ("+lmr", {**PVS, "lmr": True}),
+    ("+futility", {**PVS, "futility": True}),
+    ("+null move", {**PVS, "null_move": True}),
+    ("selective", {**PVS, "lmr": True, "futility": True, "null_move": True}),
+    ("no eval cache", {**PVS, "lmr": True, "futility": True,
+                       "null_move": True, "eval_cache": None}),
+]
+
+def bench_search(repeats, depth):
+    games = positions(repeats)
+    print(f"iterative deepening to depth {depth} from {len(games)} positions")
+    values = {}
+    actions = {}
+    for name, settings in SEARCHES:
+        nodes = leaves = elapsed = last = before = probes = hits = 0
+        values[name] = []
+        actions[name] = []
+        for game in games:
+            colour = ("white", "black")[len(game) % 2]
+            player = AI_NarutoPlayer(colour)
+            for attr, value in settings.items():
+                setattr(player, attr, value)
+            for actor, action in game:
+                player.update(actor, action)
+            start = time.process_time()
+            action = player.deepen(1, depth)
+            elapsed += time.process_time() - start
+            nodes += player.nodes
+            leaves += player.leaves
+            if player.eval_cache is not None:
+                probes += player.eval_cache.probes
+                hits += player.eval_cache.hits
+            values[name].append(player.iterations[-1]["value"])
+            actions[name].append(action)
+            if depth >= 2:
+                last += player.iterations[-1]["nodes"]
+                before += player.iterations[-2]["nodes"]
+        same_actions = sum(action == full for action, full in
+                           zip(actions[name], actions["alpha-beta"]))
+        same_values = sum(value == full for value, full in
+                          zip(values[name], values["alpha-beta"]))
+        branching = f"{last / before:5.2f}" if before else "    -"
+        hit_rate = f"{hits / probes:4.0%}" if probes else "   -"
+        print(f"{name:>15}: {nodes:7d} nodes {leaves:7d} leaves "
+              f"{elapsed:7.3f}s "
+              f"({nodes / elapsed if elapsed else 0:5.0f} nodes/s) "
+              f"EBF {branching}, eval hits {hit_rate}, "
+              f"same action {same_actions}/{len(games)}, "
+              f"same value {same_values}/{len(games)}")
+    return 0
+
+
+# run in a new process: time the player's start-up and measure its memory
+STARTUP_SCRIPT = """
+import time, resource
+start = time.perf_counter()
+from AI_Naruto.player import AI_NarutoPlayer
+imported = time.perf_counter()
+AI_NarutoPlayer("white")
+end = time.perf_counter()
+with open("/proc/self/statm") as f:
+    pages = [int(field) for field in f.read().split()]
+page = resource.getpagesize() / 1024 / 1024
+print(imported - start, end - imported, pages[1] * page, pages[2] * page)
+"""
+
+def bench_tables(repeats, **options):
+    path = os.path.join(tempfile.mkdtemp(), "tables.bin")
+    modes = [
+        ("no cache", "", None),
+        ("cold cache", path, lambda: os.path.exists(path) and os.unlink(path)),
+        ("warm cache", path, None),
+    ]
+    print(f"starting up the player in new processes, {repeats} times each")
+    for name, tables_file, prepare in modes:
+        runs = []
+        for _ in range(repeats):
+            if prepare is not None:
+                prepare()
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT],
+                env={**os.environ, "AI_NARUTO_TABLES": tables_file},
+                capture_output=True, text=True, check=True).stdout
+            runs.append([float(field) for field in output.split()])
+        # (the median run)
+        imported, constructed, resident, shared = \
+            sorted(runs)[len(runs) // 2]
+        print(f"{name:>15}: import {imported * 1e3:6.1f}ms, construct "
+              f"{constructed * 1e3:5.1f}ms, resident {resident:5.1f}MB "
+              f"({shared:4.1f}MB shared)")
+    os.unlink(path)
+    os.rmdir(os.path.dirname(path))
+    return 0
+
+
+BENCHMARKS = {
+    "pq": bench_pq,
+    "actions": bench_actions,
+    "batch": bench_batch,
+    "search": bench_search,
+    "tables": bench_tables,
+}
+
+def main():
+    parser = argparse.ArgumentParser(prog="AI_Naruto.bench",
+        description="benchmark parts of the AI_Naruto player.")
+    parser.add_argument('benchmark', choices=BENCHMARKS)
+    parser.add_argument('-n', '--repeats', type=int, default=5,
+        help="how many times to repeat the workload, or for search, how "
+            "many random positions to search (default: 5).")
+    parser.add_argument('-d', '--depth', type=int, default=4,
+        help="for search, the depth to search to (default: 4).")
+    args = parser.parse_args()
+    return BENCHMARKS[args.benchmark](args.repeats, depth=args.depth)
+
+if __name__ == '__main__':
+    sys.exit(main())
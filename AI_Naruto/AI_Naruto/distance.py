@@ -0,0 +1,178 @@
+"""
+Precomputed tables of the minimum number of moves for a stack to travel
+between squares of the board, for each stack height, so that evaluation can
+look distances up in O(1) time rather than searching (e.g. with A* through
+util.PriorityQueue) at every leaf.
+
+A stack of height n moves 1..n squares in one of STEP_DIRECTIONS (jumping
+over anything in between). On an 8x8 board no move is longer than 7 squares,
+so the tables for heights 7 to 12 are all the same table.
+
+Squares are numbered x + 8*y (see SQUARE_INDEX), and each table is a list of
+rows, one row of bytes for each source square, indexed by target square:
+
+    DISTANCES[n][SQUARE_INDEX[a]][SQUARE_INDEX[b]]
+
+is the number of moves for a stack of height n to get from a to b, on an
+otherwise empty board. ATTACK_DISTANCES[n][SQUARE_INDEX[a]][SQUARE_INDEX[b]]
+is the number of moves to get next to b (from where a BOOM would hit b).
+For finding the nearest of many targets at once, ATTACK_MASKS[n][i][d] is a
+bitmask (see SQUARE_BIT) of the squares a stack of height n on square i can
+get next to in at most d moves (for every d < MASK_DEPTHS).
+
+The tables are built once and kept in a cache file (TABLES_FILE, see
+AI_Naruto.tablecache), from which later imports map them into memory, until
+this module changes. The rows of distances are memoryviews of the mapped
+file; the rows of ATTACK_MASKS are tuples made from it (which evaluation
+indexes faster than a memoryview of 64-bit numbers).
+
+The distances are for an empty board: a stack can't land on an enemy stack,
+but evaluation doesn't account for that (it would change the distances at
+every move of the search).
+"""
+
+import os
+import zlib
+from array import array
+from collections import deque
+
+from AI_Naruto import tablecache
+
+MAX_HEIGHT = 12         # of a stack (all of a player's tokens)
+MAX_STEP = 7            # the longest move on the board
+UNREACHABLE = 255       # distance to a square a stack can't reach
+MASK_DEPTHS = 16        # ATTACK_MASKS for distances 0..15 (all squares by 14)
+
+# (the environment variable AI_NARUTO_TABLES can name another cache file, or
+# be empty to build the tables at every import, without a cache)
+TABLES_FILE = os.environ.get("AI_NARUTO_TABLES", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tables.bin")) or None
+
+SQUARES = [(x, y) for y in range(8) for x in range(8)]
+SQUARE_INDEX = {qr: i for i, qr in enumerate(SQUARES)}
+SQUARE_BIT = {qr: 1 << i for i, qr in enumerate(SQUARES)}
+
+_STEP_DIRECTIONS = [(-1, +0), (+1, +0), (+0, -1), (+0, +1)]
+
+
+def _moves(step):
+    """For each square (index), the squares a stack can move to in one move
+    of up to `step` squares."""
+    moves = []
+    for x, y in SQUARES:
+        targets = []
+        for dx, dy in _STEP_DIRECTIONS:
+            for d in range(1, step + 1):
+                tx, ty = x + d*dx, y + d*dy
+                if 0 <= tx < 8 and 0 <= ty < 8:
+                    targets.append(tx + 8*ty)
+        moves.append(targets)
+    return moves
+
+def _near(i):
+    x, y = SQUARES[i]
+    return [SQUARE_INDEX[(x + dx, y + dy)]
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            if (dx or dy) and (x + dx, y + dy) in SQUARE_INDEX]
+
+MOVES = [None] + [_moves(step) for step in range(1, MAX_STEP + 1)]
+NEAR = [_near(i) for i in range(64)]
+
+
+def _distances(moves, source):
+    """Breadth-first search from `source`: a bytearray of the distance to
+    each square."""
+    row = bytearray([UNREACHABLE]) * 64
+    row[source] = 0
+    queue = deque([source])
+    while queue:
+        i = queue.popleft()
+        d = row[i] + 1
+        for j in moves[i]:
+            if row[j] == UNREACHABLE:
+                row[j] = d
+                queue.append(j)
+    return row
+
+def _attack_row(row):
+    """Distances to the squares next to each square, from distances `row`."""
+    return bytes(min(row[j] for j in NEAR[i]) for i in range(64))
+
+def _masks(row):
+    """Bitmasks of the squares within each distance (up to MASK_DEPTHS - 1),
+    from distances `row`."""
+    masks = []
+    mask = 0
+    for d in range(MASK_DEPTHS):
+        for i in range(64):
+            if row[i] == d:
+                mask |= 1 << i
+        masks.append(mask)
+    return masks
+
+def _build():
+    """The tables for each step (1..MAX_STEP), as flat arrays."""
+    distances = array('B')
+    attack_distances = array('B')
+    attack_masks = array('Q')
+    for step in range(1, MAX_STEP + 1):
+        for i in range(64):
+            row = _distances(MOVES[step], i)
+            attack_row = _attack_row(row)
+            distances.extend(row)
+            attack_distances.extend(attack_row)
+            attack_masks.extend(_masks(attack_row))
+    return {"distances": distances, "attack_distances": attack_distances,
+            "attack_masks": attack_masks}
+
+def _source_version():
+    """The version of the tables: a checksum of this module's source."""
+    with open(__file__, "rb") as f:
+        return f"{zlib.crc32(f.read()):08x}"
+
+def _tables():
+    flat = tablecache.load(TABLES_FILE, _source_version(), _build)
+    tables = []
+    for name, size, row_type in (("distances", 64, memoryview),
+                                 ("attack_distances", 64, memoryview),
+                                 ("attack_masks", MASK_DEPTHS, tuple)):
+        rows = flat[name]
+        table = [None]
+        for step in range(MAX_STEP):
+            start = step * 64 * size
+            table.append([row_type(rows[start + i*size:start + (i + 1)*size])
+                          for i in range(64)])
+        # taller stacks move like stacks of height MAX_STEP
+        for height in range(MAX_STEP + 1, MAX_HEIGHT + 1):
+            table.append(table[MAX_STEP])
+        tables.append(table)
+    return tables
+
+DISTANCES, ATTACK_DISTANCES, ATTACK_MASKS = _tables()
+
+
+def square_mask(squares):
+    """The bitmask (see SQUARE_BIT) of some squares."""
+    mask = 0
+    for qr in squares:
+        mask |= SQUARE_BIT[qr]
+    return mask
+
+def attack_distance(stacks, target_mask, limit=UNREACHABLE):
+    """
+    The fewest moves for any of `stacks` (a dictionary from squares to
+    heights) to get next to any of the squares in `target_mask` (a bitmask,
+    see square_mask), on an empty board, or `limit` if that is fewer.
+    """
+    for qr, n in stacks.items():
+        if not limit:
+            break
+        masks = ATTACK_MASKS[n][SQUARE_INDEX[qr]]
+        # (only look for the distance if it's less than the best so far)
+        if masks[min(limit, len(masks)) - 1] & target_mask:
+            d = 0
+            while not masks[d] & target_mask:
+                d += 1
+            limit = d
+    return limit
+
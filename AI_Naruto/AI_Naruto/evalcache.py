@@ -0,0 +1,58 @@
+"""
+A fixed-size cache of evaluations, keyed by the hash of the state evaluated
+(see State.key), so that a state reached again (by another order of moves, or
+in the next iteration of a deepening search) costs one lookup rather than a
+full evaluation.
+
+The cache is direct-mapped: the low bits of a key pick its slot, and storing
+a value replaces whatever was there. Each slot is one packed 64-bit entry in
+an array: the high 32 bits of the key (to check it is the right state), and
+the value, offset by VALUE_BIAS to fit the low 32 bits. Two states which
+share a slot and the high 32 bits of their keys would be confused, but with
+random 64-bit keys that is too rare to matter (as is a state whose key's high
+bits are 0 seeming to be in an empty slot).
+"""
+
+from array import array
+
+ENTRY_SIZE = 8          # bytes per entry (packed into one unsigned 64 bits)
+VALUE_BIAS = 1 << 31    # added to values (within +/-2**31) to store them
+VALUE_MASK = (1 << 32) - 1
+
+
+class EvalCache:
+    """
+    A direct-mapped cache from state keys (64-bit hashes) to values, in (at
+    most) `size` bytes, rounded down to a power of two number of entries.
+    Counts lookups and hits, for reporting the hit rate.
+    """
+
+    def __init__(self, size):
+        slots = max(size // ENTRY_SIZE, 1)
+        slots = 1 << (slots.bit_length() - 1)
+        self.mask = slots - 1
+        self.entries = array('Q', [0]) * slots
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        """The value stored for `key`, or None."""
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry >> 32 == key >> 32:
+            self.hits += 1
+            return (entry & VALUE_MASK) - VALUE_BIAS
+        return None
+
+    def put(self, key, value):
+        """Store the value for `key` (replacing the slot's old entry)."""
+        self.entries[key & self.mask] = \
+            (key >> 32) << 32 | (value + VALUE_BIAS)
+
+    def hit_rate(self):
+        """The fraction of lookups which found a value (None before any)."""
+        return self.hits / self.probes if self.probes else None
+
+    def clear(self):
+        """Forget all values (keeping the counts)."""
+        self.entries = array('Q', [0]) * (self.mask + 1)
@@ -1,10 +1,15 @@
+import os
 import sys
 import json
-import queue
+import math
+import random
 import time
+import multiprocessing
 
 from collections import Counter
 from AI_Naruto.util import print_move, print_boom, print_board, PriorityQueue
+from AI_Naruto.distance import attack_distance, square_mask, SQUARE_BIT
+from AI_Naruto.evalcache import EvalCache
 
 STEP_DIRECTIONS = [(-1, +0), (+1, +0), (+0, -1), (+0, +1)]
 BOOM_DIRECTIONS = [(-1, +0), (+1, +0), (+0, -1), (+0, +1), (-1, +1), (+1, +1), (+1, -1), (-1, -1)]
@@ -16,8 +21,100 @@ BLACK_INITIAL_SQUARES = [(0, 7), (1, 7), (3, 7), (4, 7), (6, 7), (7, 7),
 WHITE_INITIAL_SQUARES = [(0, 1), (1, 1), (3, 1), (4, 1), (6, 1), (7, 1),
                          (0,0), (1,0), (3,0), (4,0), (6,0), (7,0)]
 
-MAX_DEPTH = 5  # the maximum depth that minimax algorithm explores
+MAX_DEPTH = 20  # the maximum depth (plies) that minimax algorithm explores
 INFINITY = 2147438647
+MATERIAL_WEIGHT = 16  # per token: more than any positional difference
+
+# Evaluation weights, for each feature of a state (for the player to move):
+# tokens ahead, tokens their best BOOM would gain (if any), and the fewest
+# moves for the other player's stacks to get next to theirs, and for theirs
+# to get next to the other player's (each up to MATERIAL_WEIGHT - 1). These
+# can be tuned (see AI_Naruto.tune), which writes WEIGHTS_FILE.
+DEFAULT_WEIGHTS = {
+    "material": MATERIAL_WEIGHT,
+    "boom_gain": MATERIAL_WEIGHT,
+    "their_distance": 1,
+    "my_distance": -1,
+}
+FEATURES = tuple(DEFAULT_WEIGHTS)
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "weights.json")
+
+TIME_LIMIT = 60.0   # CPU seconds for the whole game (see the specification)
+TIME_RESERVE = 5.0  # never plan to use these last seconds (for overruns)
+TIME_SHARE = 30     # spend at most 1/TIME_SHARE of the remaining time per move
+CHECK_NODES = 1024  # check the clock (and ponder requests) this often
+TT_SIZE = 1 << 17   # clear the transposition table when it grows beyond this
+EVAL_CACHE_SIZE = 1 << 20   # bytes for cached evaluations (0 for no cache)
+
+# transposition table entry flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Principal variation search: search each action after the first with a null
+# window, to prove it no better, re-searching it with the full window only if
+# it is. Aspiration windows: search each iteration with a window of this
+# size around the previous iteration's value (0 for no window), widening it
+# if the value falls outside.
+PVS = True
+ASPIRATION_WINDOW = MATERIAL_WEIGHT
+
+# Move ordering (PVS only saves nodes if the first action is usually the
+# best): the transposition table's best action (on the principal variation,
+# the previous iteration's), then BOOMs that gain tokens (most first), then
+# the KILLERS MOVEs which most recently caused a beta cutoff at the same ply,
+# then the other MOVEs by history score (the sum of depth squared over the
+# cutoffs each has caused, anywhere in the search, halved at every action so
+# that old cutoffs count for less), then BOOMs that don't gain tokens.
+ORDERING = True
+KILLERS = 2
+
+# Selective search (each can be switched off per player, for comparison):
+# Late move reductions: search MOVEs late in the order (after LMR_MIN_MOVES
+# others) LMR_REDUCTION plies shallower, at first, if at least LMR_MIN_DEPTH
+# plies are left; search them fully only if they turn out better than alpha.
+LMR = True
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 4
+LMR_REDUCTION = 1
+# Futility pruning: one ply from the horizon, skip MOVEs if the state's value
+# plus a margin is no better than alpha, where the margin is the most a MOVE
+# can change the evaluation with the player's weights (see futility_margin).
+FUTILITY = True
+# Null-move pruning: if the player to move would still be at least beta
+# after passing (searched NULL_REDUCTION plies shallower), assume some
+# action would be too. Passing isn't allowed, and with few stacks moving can
+# hurt (zugzwang), so only with at least NULL_MIN_STACKS stacks, and at
+# least NULL_MIN_DEPTH plies left, and never twice in a row.
+NULL_MOVE = True
+NULL_MIN_DEPTH = 3
+NULL_MIN_STACKS = 3
+NULL_REDUCTION = 2
+
+# Pondering: search the position after our opponent's expected reply while
+# they are thinking. This runs in a child process, so the referee (which
+# measures each player's CPU time and memory in its own process) charges it
+# to neither player. The child stops after the same share of the remaining
+# time as a move gets, and its CPU time is counted in our own budget
+# (time_used), so that the player's CPU time with the child's stays within
+# TIME_LIMIT, but its memory (up to a transposition table of TT_SIZE) isn't
+# limited: only enable pondering where the rules allow that.
+PONDER = False
+PONDER_MAX_DEPTH = 8
+
+# When a state is the same after reflecting the board left to right (as the
+# initial state is), leave out the reflections of actions from the right half
+# of the board, which lead to reflections of the states of the others
+SKIP_SYMMETRIC = True
+
+MAX_TURNS = 250     # per player, after which the referee declares a draw
+DRAW_REPEATS = 4    # a position occurring this many times is a draw
+
+# Zobrist keys: one random 64-bit key per (square, signed stack height), and
+# one for black being the player to move
+_ZOBRIST_RANDOM = random.Random("AI_Naruto")
+ZOBRIST_KEYS = {(qr, n): _ZOBRIST_RANDOM.getrandbits(64)
+                for qr in sorted(ALL_SQUARES) for n in range(-12, 13) if n}
+ZOBRIST_BLACK_TO_MOVE = _ZOBRIST_RANDOM.getrandbits(64)
 
 def _NEAR_SQUARES(square):
     x, y = square
@@ -25,6 +122,170 @@ def _NEAR_SQUARES(square):
             (x-1,y),          (x+1,y),
             (x-1,y-1),(x,y-1),(x+1,y-1)} & ALL_SQUARES
 
+NEAR_SQUARES = {qr: tuple(sorted(_NEAR_SQUARES(qr))) for qr in ALL_SQUARES}
+
+def _RAYS(square):
+    x, y = square
+    rays = []
+    for dx, dy in STEP_DIRECTIONS:
+        ray = []
+        qr = (x + dx, y + dy)
+        while qr in ALL_SQUARES:
+            ray.append(qr)
+            qr = (qr[0] + dx, qr[1] + dy)
+        rays.append(tuple(ray))
+    return tuple(rays)
+
+# for each square, the squares in each direction (nearest first) to the edge
+RAYS = {qr: _RAYS(qr) for qr in ALL_SQUARES}
+
+# The squares around a square, one bit each, and for each pattern of occupied
+# squares around a square, whether they are all connected to each other
+# without going through the square in the middle
+_RING = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+RING_SQUARES = {(x, y): tuple((1 << i, (x + dx, y + dy))
+                              for i, (dx, dy) in enumerate(_RING)
+                              if (x + dx, y + dy) in ALL_SQUARES)
+                for x, y in ALL_SQUARES}
+
+def _ring_connected(pattern):
+    bits = [i for i in range(len(_RING)) if pattern >> i & 1]
+    if not bits:
+        return True
+    seen = {bits[0]}
+    stack = [bits[0]]
+    while stack:
+        (ax, ay) = _RING[stack.pop()]
+        for i in bits:
+            bx, by = _RING[i]
+            if i not in seen and abs(ax - bx) <= 1 and abs(ay - by) <= 1:
+                seen.add(i)
+                stack.append(i)
+    return len(seen) == len(bits)
+
+RING_CONNECTED = [_ring_connected(pattern) for pattern in range(256)]
+
+
+def load_weights(path=WEIGHTS_FILE):
+    """
+    The evaluation weights (in the order of FEATURES) from a weights file
+    written by AI_Naruto.tune, or the default weights for any missing from
+    it (or all of them, if there is no such file).
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    try:
+        with open(path) as f:
+            weights.update(json.load(f)["weights"])
+    except FileNotFoundError:
+        pass
+    return tuple(weights[feature] for feature in FEATURES)
+
+
+# Positions as text, in the notation of referee.position: the rows from y = 7
+# down to 0 (separated by '/'), with a letter for each stack (A, B, ... for
+# white stacks of height 1, 2, ...; a, b, ... for black) and a digit (1 to 8)
+# for each run of empty squares, then 'w' or 'b' for the colour to move, and
+# the number of turns played (white moves when it is even). The player can't
+# import the referee, so this parser is a copy of referee.position's: it
+# accepts exactly the same strings (see tests/test_position.py).
+_POSITION_STACKS = {}
+for _n in range(1, 13):
+    _POSITION_STACKS[chr(ord('A') + _n - 1)] = _n
+    _POSITION_STACKS[chr(ord('a') + _n - 1)] = -_n
+_POSITION_CHARS = {n: char for char, n in _POSITION_STACKS.items()}
+_POSITION_EMPTY = {str(k): k for k in range(1, 9)}
+_POSITION_COLORS = {"w": "white", "b": "black"}
+MAX_TOKENS = 12     # per player
+
+
+class PositionError(ValueError):
+    """For a string which is not a valid position."""
+
+
+def parse_position(position):
+    """
+    Parse a position string (see above): return (white_tokens, black_tokens,
+    color to move, turns), or raise a PositionError if it isn't valid.
+    """
+    if not isinstance(position, str):
+        raise PositionError(f"expected a position string: {position!r}")
+    try:
+        board, to_move, turns = position.split(" ")
+        color = _POSITION_COLORS[to_move]
+        turns = int(turns)
+    except (ValueError, KeyError):
+        raise PositionError(f"expected '<board> <w|b> <turns>': {position!r}")
+    if turns < 0 or ("white", "black")[turns % 2] != color:
+        raise PositionError(f"{color} can't be to move after {turns} turns")
+    rows = board.split("/")
+    if len(rows) != 8:
+        raise PositionError(f"expected 8 rows of 8 squares: {board!r}")
+    white_tokens, black_tokens = {}, {}
+    for y, row in zip(range(7, -1, -1), rows):
+        x = 0
+        for char in row:
+            if x >= 8:
+                break
+            if char in _POSITION_EMPTY:
+                x += _POSITION_EMPTY[char]
+            elif char in _POSITION_STACKS:
+                n = _POSITION_STACKS[char]
+                if n > 0:
+                    white_tokens[x, y] = n
+                else:
+                    black_tokens[x, y] = -n
+                x += 1
+            else:
+                break
+        else:
+            if x == 8:
+                continue
+        raise PositionError(f"expected a row of 8 squares: {row!r}")
+    for color, tokens in (("white", white_tokens), ("black", black_tokens)):
+        if sum(tokens.values()) > MAX_TOKENS:
+            raise PositionError(f"more than {MAX_TOKENS} {color} tokens")
+    return white_tokens, black_tokens, _POSITION_COLORS[to_move], turns
+
+
+class Blast:
+    """
+    A blast component: a group of occupied squares connected through
+    neighbouring squares (including diagonally). A BOOM on any of these
+    squares sets off all of the others, removing every token in the group.
+    """
+    __slots__ = ("squares", "white", "black")
+
+    def __init__(self):
+        self.squares = set()
+        self.white = 0 # number of white tokens in the group
+        self.black = 0
+
+    def add(self, qr, n):
+        """Add a square with n tokens (signed: n > 0 for white)."""
+        self.squares.add(qr)
+        self.count(n)
+
+    def count(self, n):
+        """Count n more tokens (signed: n > 0 for white)."""
+        if n > 0:
+            self.white += n
+        else:
+            self.black -= n
+
+    def uncount(self, n):
+        """Count n fewer tokens (signed: n > 0 for white)."""
+        if n > 0:
+            self.white -= n
+        else:
+            self.black += n
+
+    def gain(self, color):
+        """Tokens of the other color minus tokens of `color` removed by a BOOM
+        in this group."""
+        if color == "white":
+            return self.black - self.white
+        return self.white - self.black
+
 
 class Board:
 
@@ -32,7 +293,7 @@ class Board:
 
         # from part A
         edge = range(0, 8)
-        self.blocks = sorted({(q, r) for q in edge for r in edge})
+        self.blocks = frozenset((q, r) for q in edge for r in edge)
 
 
     def __contains__(self, qr):
@@ -49,6 +310,10 @@ class State:
     black_tokens = None
     white_tokens = None
     tokens = None # current stack, >0 means white, <0 means black
+    hash = 0 # Zobrist hash of the tokens (not including the player to move)
+    blasts = None # occupied square -> its Blast (kept up to date with tokens)
+    white_mask = 0 # bitmask of the squares with white tokens (see SQUARE_BIT)
+    black_mask = 0
     actioned_color = None       # actioned color
     next_action_color = None        # color which will action
 
@@ -64,6 +329,20 @@ class State:
         for qr in self.white_tokens:
             self.tokens[qr] = self.white_tokens[qr]
 
+        self.hash = 0
+        for qr, n in self.tokens.items():
+            if n:
+                self.hash ^= ZOBRIST_KEYS[qr, n]
+
+        self.white_mask = square_mask(self.white_tokens)
+        self.black_mask = square_mask(self.black_tokens)
+
+        self.blasts = {}
+        occupied = {qr for qr, n in self.tokens.items() if n}
+        for qr in sorted(occupied):
+            if qr not in self.blasts:
+                self._flood(qr, occupied)
+
     # def __init__(self, board, white_tokens, black_tokens, actioned_color):
     #
     #     self.board = board
@@ -82,119 +361,389 @@ class State:
     #     for qr in self.white_tokens:
     #         self.tokens[qr] = self.white_tokens[qr]
 
+    @classmethod
+    def from_position(cls, position):
+        """
+        The state at a position string (see parse_position, which also gives
+        the color to move and the number of turns played).
+        """
+        white_tokens, black_tokens, _, _ = parse_position(position)
+        return cls(Board(None), white_tokens, black_tokens)
+
+    def position(self, color, turns):
+        """This state as a position string, with `color` to move after
+        `turns` turns."""
+        rows = []
+        for y in range(7, -1, -1):
+            row = ""
+            empty = 0
+            for x in range(8):
+                n = self.tokens[x, y]
+                if not n:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += _POSITION_CHARS[n]
+            rows.append(row + str(empty) if empty else row)
+        return f"{'/'.join(rows)} {color[0]} {turns}"
+
+    def key(self, color):
+        """
+        Hash of this state with `color` as the player to move (for detecting
+        repeated states).
+        """
+        if color == "black":
+            return self.hash ^ ZOBRIST_BLACK_TO_MOVE
+        return self.hash
+
     def enemy_occupied(self, qr, enemy_color):
         if enemy_color == 'black':
             return qr in self.black_tokens
         else: #"black"
             return qr in self.white_tokens
 
+    def best_boom(self, color):
+        """
+        The most tokens `color` can gain with a BOOM (tokens of the other
+        color removed, minus its own), and the square to BOOM to gain them.
+        """
+        my_tokens = self.white_tokens if color == "white" else \
+            self.black_tokens
+        best_gain, best_qr = None, None
+        for qr in my_tokens:
+            gain = self.blasts[qr].gain(color)
+            if best_gain is None or gain > best_gain:
+                best_gain, best_qr = gain, qr
+        return best_gain, best_qr
+
     def get_legal_actions(self, color):
         """
-        Get all legal next actions a white token can do.
+        Get all legal next actions a white token can do (as a list, see
+        actions).
+        """
+        return list(self.actions(color))
+
+    def actions(self, color, skip_symmetric=False):
+        """
+        Generate the legal actions for `color`, lazily. A BOOM on any stack
+        of a blast component leads to the same state, so only one BOOM is
+        given for each component (on its lowest square). BOOMs that gain
+        tokens come first (most gained first), and the rest come last.
+
+        Moves are found by walking out from each stack in each direction
+        only as far as the stack can move and the board goes, skipping
+        squares held by the other color. If `skip_symmetric` is true, and the
+        state is its own reflection (left to right), moves from the right
+        half of the board are left out (see SKIP_SYMMETRIC).
+
+        The stacks and BOOMs are found when this is called (so their order
+        is that of the state as it is now), and the actions are generated
+        from them lazily. The state may change between actions generated
+        (e.g. as a search applies and undoes them), as long as it is
+        restored each time.
         """
         if color == "white":
-            enemy_color = "black"
-            my_tokens = self.white_tokens.copy()
+            my_tokens, enemy_tokens = self.white_tokens, self.black_tokens
         else:
-            enemy_color = "white"
-            my_tokens = self.black_tokens.copy()
+            my_tokens, enemy_tokens = self.black_tokens, self.white_tokens
+        stacks = list(my_tokens.items())
 
-        legal_actions = []
-        for qr in my_tokens:
-            for step_directions_q, step_directions_r in STEP_DIRECTIONS:
-                p = my_tokens.get(qr)
-                q, r = qr
-                for i in range(1, p + 1):
-                    q_next = q + step_directions_q * i
-                    r_next = r + step_directions_r * i
-                    qr_next = q_next, r_next
-                    if qr_next in self.board:
-                        if not self.enemy_occupied(qr_next, enemy_color):
-                            # move i tokens from qr to qr_next, the remaining number of token in (q, r) will be p-i
-                            legal_actions.append(("MOVE", (i, qr, qr_next)))
-            legal_actions.append(("BOOM", qr))
-        return legal_actions
+        booms = {} # blast -> lowest square with one of my stacks
+        for qr, _ in stacks:
+            blast = self.blasts[qr]
+            if blast not in booms or qr < booms[blast]:
+                booms[blast] = qr
+        gains = sorted(((blast.gain(color), qr) for blast, qr in
+                        booms.items()), key=lambda boom: (-boom[0], boom[1]))
+        symmetric = skip_symmetric and self.symmetric()
+        return self._actions(stacks, enemy_tokens, gains, symmetric)
+
+    def _actions(self, stacks, enemy_tokens, gains, symmetric):
+        for gain, qr in gains:
+            if gain > 0:
+                yield ("BOOM", qr)
+        for qr, p in stacks:
+            if symmetric and qr[0] >= 4:
+                continue
+            for ray in RAYS[qr]:
+                for qr_next in ray[:p]:
+                    if qr_next not in enemy_tokens:
+                        # move n tokens from qr to qr_next, leaving p-n
+                        for n in range(1, p + 1):
+                            yield ("MOVE", n, qr, qr_next)
+        for gain, qr in gains:
+            if gain <= 0:
+                yield ("BOOM", qr)
+
+    def is_legal(self, action, color):
+        """Whether `action` is legal for `color`."""
+        my_tokens = self.white_tokens if color == "white" else \
+            self.black_tokens
+        if action[0] == "BOOM":
+            return action[1] in my_tokens
+        _, n, (x, y), (x_next, y_next) = action
+        p = my_tokens.get((x, y), 0)
+        return 1 <= n <= p and (x_next, y_next) in ALL_SQUARES and \
+            self.tokens[x_next, y_next] * self.tokens[x, y] >= 0 and \
+            (x == x_next) != (y == y_next) and \
+            abs(x - x_next) + abs(y - y_next) <= p
+
+    def symmetric(self):
+        """Whether this state is its own reflection (left to right)."""
+        tokens = self.tokens
+        for (x, y), n in self.white_tokens.items():
+            if tokens[7 - x, y] != n:
+                return False
+        for (x, y), n in self.black_tokens.items():
+            if tokens[7 - x, y] != -n:
+                return False
+        return True
+
+    def _set(self, qr, n):
+        """
+        Set the (signed) number of tokens at qr, keeping the token dicts, the
+        hash and the blast components in step.
+        """
+        old = self._set_tokens(qr, n)
+        if old and n:
+            blast = self.blasts[qr]
+            blast.uncount(old)
+            blast.count(n)
+        elif n:
+            self._join_blasts(qr, n)
+        elif old:
+            self._split_blast(qr, old)
+
+    def _set_tokens(self, qr, n):
+        """
+        Set the (signed) number of tokens at qr, keeping the token dicts, the
+        masks and the hash in step (but not the blast components). Return the
+        old number.
+        """
+        old = self.tokens[qr]
+        if old > 0:
+            del self.white_tokens[qr]
+            self.white_mask ^= SQUARE_BIT[qr]
+        elif old < 0:
+            del self.black_tokens[qr]
+            self.black_mask ^= SQUARE_BIT[qr]
+        if old:
+            self.hash ^= ZOBRIST_KEYS[qr, old]
+        self.tokens[qr] = n
+        if n > 0:
+            self.white_tokens[qr] = n
+            self.white_mask ^= SQUARE_BIT[qr]
+        elif n < 0:
+            self.black_tokens[qr] = -n
+            self.black_mask ^= SQUARE_BIT[qr]
+        if n:
+            self.hash ^= ZOBRIST_KEYS[qr, n]
+        return old
+
+    def _join_blasts(self, qr, n):
+        """Add a newly occupied square to the blast components, joining the
+        components around it."""
+        blasts = self.blasts
+        joined = None
+        for near in NEAR_SQUARES[qr]:
+            blast = blasts.get(near)
+            if blast is None or blast is joined:
+                continue
+            if joined is None:
+                joined = blast
+            else:
+                if len(blast.squares) > len(joined.squares):
+                    joined, blast = blast, joined
+                for square in blast.squares:
+                    blasts[square] = joined
+                joined.squares |= blast.squares
+                joined.white += blast.white
+                joined.black += blast.black
+        if joined is None:
+            joined = Blast()
+        joined.add(qr, n)
+        blasts[qr] = joined
+
+    def _split_blast(self, qr, old):
+        """Remove a newly emptied square from the blast components, splitting
+        its component if that disconnects it."""
+        blast = self.blasts.pop(qr)
+        squares = blast.squares
+        squares.discard(qr)
+        blast.uncount(old)
+        # usually the squares around qr are connected to each other anyway
+        pattern = 0
+        for bit, near in RING_SQUARES[qr]:
+            if near in squares:
+                pattern |= bit
+        if RING_CONNECTED[pattern]:
+            return
+        nears = [near for near in NEAR_SQUARES[qr] if near in squares]
+        # every path through qr went through its neighbours: if they are
+        # still connected to each other, so is the whole component
+        unreached = set(nears)
+        unreached.discard(nears[0])
+        seen = {nears[0]}
+        stack = [nears[0]]
+        while stack and unreached:
+            for near in NEAR_SQUARES[stack.pop()]:
+                if near in squares and near not in seen:
+                    seen.add(near)
+                    unreached.discard(near)
+                    stack.append(near)
+        if unreached:
+            # it's split: the search found the whole part with nears[0],
+            # which keeps this component, and the rest get new ones
+            rest = squares - seen
+            blast.squares = seen
+            for square in rest:
+                if self.blasts[square] is blast:
+                    part = self._flood(square, rest)
+                    blast.white -= part.white
+                    blast.black -= part.black
+
+    def _flood(self, qr, squares):
+        """Make a new blast component of the squares connected to qr among
+        `squares` (occupied squares)."""
+        blast = Blast()
+        self.blasts[qr] = blast
+        blast.add(qr, self.tokens[qr])
+        stack = [qr]
+        while stack:
+            for near in NEAR_SQUARES[stack.pop()]:
+                if near in squares and self.blasts.get(near) is not blast:
+                    self.blasts[near] = blast
+                    blast.add(near, self.tokens[near])
+                    stack.append(near)
+        return blast
+
+    def apply(self, action):
+        """
+        Apply an action to this state in place. Return a record which undo()
+        can use to restore the state as it was.
+        """
+        atype, *aargs = action
+        if atype == "MOVE":
+            n, qr, qr_next = aargs
+            if self.tokens[qr] < 0: # black moves
+                n = -n
+            self._set(qr, self.tokens[qr] - n)
+            self._set(qr_next, self.tokens[qr_next] + n)
+            return action
+
+        # atype == "BOOM": the whole blast component goes
+        qr, = aargs
+        blast = self.blasts[qr]
+        boomed = [(qr_boom, self._set_tokens(qr_boom, 0))
+                  for qr_boom in blast.squares]
+        for qr_boom, _ in boomed:
+            del self.blasts[qr_boom]
+        return ("BOOM", boomed, blast)
+
+    def undo(self, record):
+        """
+        Undo an action previously applied with apply().
+        """
+        atype, *aargs = record
+        if atype == "MOVE":
+            n, qr, qr_next = aargs
+            if self.tokens[qr_next] < 0: # black moved
+                n = -n
+            self._set(qr_next, self.tokens[qr_next] - n)
+            self._set(qr, self.tokens[qr] + n)
+        else: # atype == "BOOM": restore the whole blast component
+            boomed, blast = aargs
+            for qr, n in boomed:
+                self._set_tokens(qr, n)
+                self.blasts[qr] = blast
 
     def successor_state(self, action):
         """
         Get the resulting state given the action
         """
-        atype, aargs = action
-        new_state = State(self.board, self.white_tokens.copy(), self.black_tokens.copy())
-        if atype == 'MOVE':
-            i, qr, qr_next = aargs
-            if self.tokens[qr] > 0: # white moves
-                if new_state.white_tokens.get(qr) == i:
-                    del new_state.white_tokens[qr]
-                    self.tokens = 0
+        new_state = State(self.board, self.white_tokens, self.black_tokens)
+        new_state.apply(action)
+        return new_state
 
-                else:
-                    new_state.white_tokens[qr] -= i
-                    self.tokens[qr] -= i
-                if new_state.white_tokens.get(qr_next) is None:
-                    new_state.white_tokens[qr_next] = i
-                    self.tokens[qr_next] = i
-                else:
-                    new_state.white_tokens[qr_next] += i
-                    self.tokens[qr_next] += i
 
-            else: # black moves
-                if new_state.black_tokens.get(qr) == i:
-                    del new_state.black_tokens[qr]
-                    self.tokens[qr] = 0
+def evaluate_state(state, color, weights, threats=True):
+    """
+    Evaluate a state for `color`, the player to move: the weighted sum (with
+    `weights`, see load_weights) of the difference between the number of
+    their tokens and the number of their opponent's tokens, the tokens their
+    best BOOM would gain (if it gains any, since they could take them before
+    anything else happens, and if `threats` is true), and (to break ties)
+    how many moves their opponent needs to get a stack next to one of their
+    tokens and how many they need to get next to their opponent's.
+    """
+    if color == "white":
+        mine, theirs = state.white_tokens, state.black_tokens
+        my_mask, their_mask = state.white_mask, state.black_mask
+    else:
+        mine, theirs = state.black_tokens, state.white_tokens
+        my_mask, their_mask = state.black_mask, state.white_mask
+    if not theirs:
+        return INFINITY if mine else 0
+    if not mine:
+        return -INFINITY
+    material_weight, gain_weight, their_weight, my_weight = weights
+    value = material_weight * (sum(mine.values()) - sum(theirs.values())) + \
+        their_weight * attack_distance(theirs, my_mask, MATERIAL_WEIGHT - 1) + \
+        my_weight * attack_distance(mine, their_mask, MATERIAL_WEIGHT - 1)
+    if threats:
+        gain, _ = state.best_boom(color)
+        if gain > 0:
+            value += gain_weight * gain
+    return round(value)
+
+def futility_margin(weights):
+    """
+    The most a MOVE can raise the value of a state for the player making it,
+    from its evaluation (see evaluate_state) before the MOVE to the
+    evaluation after it (for the other player, negated). A MOVE gains no
+    tokens; each distance term (up to MATERIAL_WEIGHT - 1 moves, counted
+    once before and once after, from the other side) can gain as much as its
+    weight allows, and the BOOM threat terms can only gain with a negative
+    weight (of up to 12 tokens, before and after). Plus 1 for rounding.
+    """
+    _, gain_weight, their_weight, my_weight = weights
+    distance_weight = max(-their_weight, 0) + max(-my_weight, 0)
+    return math.ceil(2 * (MATERIAL_WEIGHT - 1) * distance_weight +
+                     2 * 12 * max(-gain_weight, 0)) + 1
 
-                else:
-                    new_state.black_tokens[qr] -= i
-                    self.tokens[qr] += i
 
-                if new_state.black_tokens.get(qr_next) is None:
-                    new_state.black_tokens[qr_next] = i
-                    self.tokens[qr_next] = -i
-                else:
-                    new_state.white_tokens[qr_next] += i
-                    self.tokens[qr_next] -= i
-
-
-        if atype == "BOOM":
-            qr = aargs
-            new_state = State(self.board, self.white_tokens.copy(), self.black_tokens.copy())
-            board_tokens = new_state.white_tokens.copy()
-            board_tokens.update(new_state.black_tokens)
-            boom_queue = queue.Queue()
-            boom_list = []
-            if self.tokens[qr] > 0:
-                boom_queue.put((qr, 'white'))
-                boom_list.append((qr, 'white'))
-            else:  # black
-                boom_queue.put((qr, 'black'))
-                boom_list.append((qr, 'black'))
-            while not boom_queue.empty():
-                boom_token = boom_queue.get()
-                q, r = boom_token[0]
-                for boom_directions_q, boom_directions_r in BOOM_DIRECTIONS:
-                    q_next_boom = q + boom_directions_q
-                    r_next_boom = r + boom_directions_r
-                    qr_next_boom = q_next_boom, r_next_boom
-                    if qr_next_boom in board_tokens and \
-                            (qr_next_boom, 'white') not in boom_list and \
-                            (qr_next_boom, 'black') not in boom_list:
-                        if qr_next_boom in new_state.white_tokens:
-                            boom_queue.put((qr_next_boom, 'white'))
-                            boom_list.append((qr_next_boom, 'white'))
-                        else:
-                            boom_queue.put((qr_next_boom, 'black'))
-                            boom_list.append((qr_next_boom, 'black'))
-            for token in boom_list:
-                qr, colour = token
-                new_state.tokens[qr] = 0
-                if colour == 'white':
-                    del new_state.white_tokens[qr]
-                else:
-                    del new_state.black_tokens[qr]
+class History:
+    """
+    Occurrence counts of the states (as hashes, see State.key) seen since the
+    last irreversible action. A BOOM removes tokens for good, so no state from
+    before a BOOM can ever occur again; forgetting them keeps this small.
+    """
 
-        return new_state
+    def __init__(self, key):
+        self.counts = Counter({key: 1})
+        self.hidden = [] # counts put aside by irreversible actions in search
+
+    def reset(self, key):
+        """Forget all states (after an irreversible action in the game)."""
+        self.counts = Counter({key: 1})
 
+    def push(self, key, irreversible=False):
+        """Record a state reached during search."""
+        if irreversible:
+            self.hidden.append(self.counts)
+            self.counts = Counter()
+        self.counts[key] += 1
 
+    def pop(self, key, irreversible=False):
+        """Forget a state recorded by push() (when undoing its action)."""
+        self.counts[key] -= 1
+        if irreversible:
+            self.counts = self.hidden.pop()
+
+    def is_draw(self, key):
+        return self.counts[key] >= DRAW_REPEATS
 
 
 
@@ -207,56 +756,126 @@ class AI_NarutoPlayer:
     opponent_color = None
     board = None
     state = None
+    history = None
+    ponder = PONDER
+    pvs = PVS
+    aspiration = ASPIRATION_WINDOW
+    ordering = ORDERING
+    lmr = LMR
+    futility = FUTILITY
+    null_move = NULL_MOVE
+    skip_symmetric = SKIP_SYMMETRIC
+    weights = None # (loaded once by preload, or by each player)
 
 
     def __init__(self, colour):
         """
         This method is called once at the beginning of the game to initialise
         your player. You should use this opportunity to set up your own internal
-        representation of the game state, and any other information about the 
+        representation of the game state, and any other information about the
         game state you would like to maintain for the duration of the game.
 
-        The parameter colour will be a string representing the player your 
-        program will play as (White or Black). The value will be one of the 
+        The parameter colour will be a string representing the player your
+        program will play as (White or Black). The value will be one of the
         strings "white" or "black" correspondingly.
         """
-        # TODO: Set up state representation.
-
         self.color = colour
         self.board = Board(self.color)
         if(self.color == 'white'):
             self.opponent_color = 'black'
-            self.init_my_tokens = self.board.curent_white_dict.copy()
-            self.init_opponent_tokens = self.board.curent_black_dict.copy()
         else:
             self.opponent_color = 'white'
-            self.init_my_tokens = self.board.curent_black_dict.copy()
-            self.init_opponent_tokens = self.board.curent_white_dict.copy()
 
         # initialise state
-        self.state = State(self.board, self.init_my_tokens, self.init_opponent_tokens)
+        self.state = State(self.board,
+                           {qr: 1 for qr in WHITE_INITIAL_SQUARES},
+                           {qr: 1 for qr in BLACK_INITIAL_SQUARES})
+        self.history = History(self.state.key("white"))
+
+        if self.weights is None:
+            self.weights = load_weights()
+        self.futility_margin = futility_margin(self.weights)
+
+        # search state
+        self.tt = {} # state key -> (depth, heuristic, flag, best action)
+        # state key (with the player to move) -> heuristic
+        self.eval_cache = EvalCache(EVAL_CACHE_SIZE) if EVAL_CACHE_SIZE \
+            else None
+        self.depth = 0
+        self.nodes = 0 # states searched (not counting the leaves)
+        self.leaves = 0 # states evaluated at the end of the search
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.researches = 0 # null-window searches which failed high
+        self.reductions = 0 # late moves searched to a reduced depth
+        self.futile = 0 # moves skipped by futility pruning
+        self.null_cutoffs = 0 # states cut off by null-move pruning
+        self.pv_table = [()] * (MAX_DEPTH + 2) # ply -> principal variation
+        self.killers = [()] * (MAX_DEPTH + 2) # ply -> killer MOVEs
+        # color -> MOVE -> history score
+        self.history_scores = {"white": {}, "black": {}}
+        self.pv = () # from the root, found by the last completed iteration
+        self.iterations = [] # statistics for each iteration (see deepen)
+        self.stats = None
+        self.deadline = INFINITY
+        self.time_used = 0.0
+        self.pondering = None # (process, connection, expected reply)
+        self.ponder_hit = False
+        self.ponder_conn = None
+
+    @classmethod
+    def preload(cls):
+        """
+        Load what every player can share, once (called by a fork server
+        before it forks a process for each game, see referee.forkserver):
+        the evaluation weights. The precomputed tables are built on import.
+        """
+        cls.weights = load_weights()
 
 
 
 
     def action(self):
         """
-        This method is called at the beginning of each of your turns to request 
+        This method is called at the beginning of each of your turns to request
         a choice of action from your program.
 
-        Based on the current state of the game, your player should select and 
+        Based on the current state of the game, your player should select and
         return an allowed action to play on this turn. The action must be
         represented based on the spec's instructions for representing actions.
         """
-        # TODO: Decide what action to take, and return it
-        return ("BOOM", (0, 0))
+        start = time.process_time()
+        # continue from the work done while pondering, if it was on this state
+        # (and count its time before budgeting this move)
+        first_depth = self.stop_pondering() + 1
+        self.deadline = start + max(
+            TIME_LIMIT - TIME_RESERVE - self.time_used, 0) / TIME_SHARE
+
+        nodes, probes, hits = self.nodes, self.tt_probes, self.tt_hits
+        cache = self.eval_cache
+        if cache is not None:
+            eval_probes, eval_hits = cache.probes, cache.hits
+        best_action = self.deepen(first_depth, MAX_DEPTH)
+        if best_action is None:
+            best_action = self.state.get_legal_actions(self.color)[0]
+
+        elapsed = time.process_time() - start
+        self.record_stats(elapsed, self.nodes - nodes, self.tt_probes - probes,
+                          self.tt_hits - hits, first_depth - 1)
+        if cache is not None and cache.probes > eval_probes:
+            self.stats["eval_hit_rate"] = round(
+                (cache.hits - eval_hits) / (cache.probes - eval_probes), 4)
+        if self.ponder:
+            self.start_pondering(best_action)
+        self.time_used += time.process_time() - start
+        return best_action
 
 
     def update(self, colour, action):
         """
-        This method is called at the end of every turn (including your player’s 
-        turns) to inform your player about the most recent action. You should 
-        use this opportunity to maintain your internal representation of the 
+        This method is called at the end of every turn (including your player’s
+        turns) to inform your player about the most recent action. You should
+        use this opportunity to maintain your internal representation of the
         game state and any other information about the game you are storing.
 
         The parameter colour will be a string representing the player whose turn
@@ -266,85 +885,502 @@ class AI_NarutoPlayer:
         The parameter action is a representation of the most recent action
         conforming to the spec's instructions for representing actions.
 
-        You may assume that action will always correspond to an allowed action 
+        You may assume that action will always correspond to an allowed action
         for the player colour (your method does not need to validate the action
         against the game rules).
         """
-        # TODO: Update state representation in response to action.
-
-        self.board.update(colour, action)
-
-    def get_possible_moves(self, token):
-        possible_moves = []
-        for step_directions_q, step_directions_r in STEP_DIRECTIONS:
-            p = self.my_tokens.get(token)
-            q, r = token
-            for i in range(1, p + 1):
-                q_next = q + step_directions_q * i
-                r_next = r + step_directions_r * i
-                qr_next = q_next, r_next
-                if qr_next in self.board:
-                    if not self.enemy_occupied(qr_next):
-                        # move i tokens from qr to qr_next, the remaining number of token in (q, r) will be p-i
-                        possible_moves.append(("MOVE", (i, token, qr_next)))
-        # possible_moves.append(("BOOM", token))
-
-        return possible_moves
-
-    def alphabeta(self, pos, current_depth, alpha, beta):
-        # increase depth
-        current_depth += 1
-
-        # if max depth is reached
-        if current_depth == MAX_DEPTH:
-            # apply evaluation function
-            return self.get_heuristic()
-
-        if current_depth % 2 == 0:
-            # min player's turn
-            # loop all enemy pieces of our player
-            remaining_pieces = self.enemies
-            for token in remaining_pieces:
-                posible_actions = self.get_possible_moves(token)
-                #check if the piece can move
-                if len(posible_actions) == 0:
-                    continue
+        start = time.process_time()
+        if self.pondering is not None and colour == self.opponent_color:
+            if action == self.pondering[2]:
+                self.ponder_hit = True
+            else:
+                self.stop_pondering()
+
+        self.turns += 1
+        self.state.apply(action)
+        key = self.state.key(self.other(colour))
+        if action[0] == "BOOM":
+            self.history.reset(key)
+        else:
+            self.history.push(key)
+        self.time_used += time.process_time() - start
+
+    def metrics(self):
+        """
+        Search statistics for our last action (reported by the referee's
+        telemetry, see referee.telemetry).
+        """
+        return self.stats
+
+    def record_stats(self, elapsed, nodes, probes, hits, first_depth):
+        """
+        Record search statistics for an action: nodes searched (and per
+        second), the depth of the last completed iteration, the rate of
+        transposition table hits, the effective branching factor (the
+        growth in nodes between the last two completed iterations), and the
+        statistics of each iteration (see deepen).
+        """
+        iterations = self.iterations
+        branching = None
+        if len(iterations) >= 2 and iterations[-2]["nodes"]:
+            branching = round(iterations[-1]["nodes"] /
+                              iterations[-2]["nodes"], 3)
+        self.stats = {
+            "nodes": nodes,
+            "nps": round(nodes / elapsed) if elapsed else None,
+            "depth": first_depth + len(iterations),
+            "tt_hit_rate": round(hits / probes, 4) if probes else None,
+            "branching": branching,
+            "iterations": iterations,
+        }
+
+    def other(self, color):
+        if color == self.color:
+            return self.opponent_color
+        return self.color
+
+    def get_heuristic(self, state, to_move=None):
+        """
+        Evaluate a state from our point of view (see evaluate_state): for
+        the player to move, `to_move`, then negated if that is our opponent.
+        If `to_move` isn't given, evaluate it for us, without crediting the
+        tokens our best BOOM would gain.
+        """
+        if to_move is None:
+            return evaluate_state(state, self.color, self.weights, False)
+        value = evaluate_state(state, to_move, self.weights)
+        return value if to_move == self.color else -value
+
+    def deepen(self, first_depth, max_depth):
+        """
+        Iterative deepening: search the current state to `first_depth`
+        plies, then one ply deeper each time, up to `max_depth` plies, until
+        the result is certain or we run out of time. Return the best action
+        found by the last completed iteration (or stored for this state, if
+        none completed), and keep statistics for each iteration (depth,
+        nodes and leaves, CPU time, value, aspiration and null-window re-searches,
+        selective search counts, and the principal variation) in
+        self.iterations.
+        """
+        key = self.state.key(self.color)
+        entry = self.tt.get(key)
+        best_action = self.tt_action(key)
+        value = entry[1] if entry is not None and entry[2] == EXACT else None
+        self.iterations = []
+        self.killers = [()] * (MAX_DEPTH + 2)
+        for scores in self.history_scores.values():
+            for action, score in list(scores.items()):
+                if score > 1:
+                    scores[action] = score >> 1
                 else:
-                    for new_pos in posible_actions:
-                        old_pos = token.pos
-                        #alpha beta pruning
-                        if alpha < beta:
-                            # move the piece into the aim square
-                            eliminated_pieces = token.makemove(new_pos)
-                            current_heuristic = self.alphabeta(new_pos, current_depth, alpha, beta)
-                            # undo move
-                            token.undomove(old_pos, eliminated_pieces)
-                            #update beta
-                            if beta > current_heuristic:
-                                beta = current_heuristic
-            return beta
+                    del scores[action]
+        for depth in range(first_depth, max_depth + 1):
+            start = time.process_time()
+            nodes, leaves = self.nodes, self.leaves
+            researches = self.researches
+            reductions, futile, null_cutoffs = \
+                self.reductions, self.futile, self.null_cutoffs
+            try:
+                value, best_action, fails = self.aspiration_search(depth,
+                                                                   value)
+            except SearchTimeout:
+                break
+            self.pv = self.pv_table[0]
+            self.iterations.append({
+                "depth": depth,
+                "nodes": self.nodes - nodes,
+                "leaves": self.leaves - leaves,
+                "time": round(time.process_time() - start, 4),
+                "value": value,
+                "fails": fails,
+                "researches": self.researches - researches,
+                "reductions": self.reductions - reductions,
+                "futile": self.futile - futile,
+                "null_cutoffs": self.null_cutoffs - null_cutoffs,
+                "pv": self.pv,
+            })
+            if abs(value) == INFINITY or time.process_time() > self.deadline:
+                break
+        return best_action
+
+    def aspiration_search(self, depth, guess=None):
+        """
+        Search the current state to `depth` plies with a window around
+        `guess` (the previous iteration's value), opening the window on the
+        side the value falls outside it and searching again, until it falls
+        inside. Return the value, the best action, and how many searches
+        failed.
+        """
+        if guess is None or not self.aspiration or abs(guess) == INFINITY:
+            alpha, beta = -INFINITY, INFINITY
         else:
-            #max player's turn
-            #loop all friend pieces of our player
-            remaing_pieces = [p for p in self.friend_pieces() if p.alive]
-            for token in remaing_pieces:
-                possible_moves = token.moves()
-                #check if this piece can move
-                if len(possible_moves) == 0:
+            alpha, beta = guess - self.aspiration, guess + self.aspiration
+        fails = 0
+        while True:
+            value, best_action = self.search_root(depth, alpha, beta)
+            if value <= alpha and alpha > -INFINITY:
+                alpha = -INFINITY
+            elif value >= beta and beta < INFINITY:
+                beta = INFINITY
+            else:
+                return value, best_action, fails
+            fails += 1
+
+    def search_root(self, depth, alpha=-INFINITY, beta=INFINITY):
+        """
+        Search the current state to `depth` plies, returning the best
+        heuristic value and the action achieving it (if the value is outside
+        the window (alpha, beta), it is only a bound, as in negamax).
+        """
+        self.depth = depth
+        key = self.state.key(self.color)
+        best_action = None
+        best_value = -INFINITY
+        alpha_orig = alpha
+        self.pv_table[0] = ()
+        for action in self.ordered_actions(self.color, 0,
+                                           self.tt_action(key)):
+            value = self.search_child(action, self.color, depth, alpha, beta,
+                                      0, best_action is None)
+            if best_action is None or value > best_value:
+                best_value, best_action = value, action
+                if value > alpha:
+                    alpha = value
+                    self.pv_table[0] = (action,) + self.pv_table[1]
+                    if alpha >= beta:
+                        break
+        flag = UPPER if best_value <= alpha_orig else \
+            LOWER if best_value >= beta else EXACT
+        self.tt[key] = (depth, best_value, flag, best_action)
+        return best_value, best_action
+
+    def search_child(self, action, color, depth, alpha, beta, ply, first,
+                     reduction=0):
+        """
+        Value of `action` for `color` (from a state `ply` plies from the root,
+        searched to `depth` plies): the first action is searched with the
+        window (alpha, beta), and each of the others with a null window just
+        above alpha, then again with the full window if it turns out better
+        than alpha. With
+        a `reduction`, the action is first searched that many plies
+        shallower, and only searched fully if it turns out better than alpha.
+        """
+        if reduction:
+            self.reductions += 1
+            value = self.search_action(action, color, depth - 1 - reduction,
+                                       alpha, alpha + 1, ply + 1)
+            if value <= alpha:
+                return value
+        if first or not self.pvs:
+            return self.search_action(action, color, depth - 1, alpha, beta,
+                                      ply + 1)
+        value = self.search_action(action, color, depth - 1, alpha, alpha + 1,
+                                   ply + 1)
+        if alpha < value < beta:
+            self.researches += 1
+            value = self.search_action(action, color, depth - 1, alpha, beta,
+                                       ply + 1)
+        return value
+
+    def search_action(self, action, color, depth, alpha, beta, ply):
+        """
+        Apply `color`'s action to the state, then search the resulting state
+        (`ply` plies from the root) to `depth` plies, returning its value for
+        `color` (a repeated state or too many turns counts as a draw).
+        """
+        self.pv_table[ply] = ()
+        irreversible = action[0] == "BOOM"
+        record = self.state.apply(action)
+        opponent = self.other(color)
+        key = self.state.key(opponent)
+        self.history.push(key, irreversible)
+        try:
+            if self.history.is_draw(key) or \
+                    self.turns + ply >= MAX_TURNS * 2:
+                value = 0
+            else:
+                value = -self.negamax(key, opponent, depth, -beta, -alpha,
+                                      ply)
+        finally:
+            self.history.pop(key, irreversible)
+            self.state.undo(record)
+        return value
+
+    def evaluate(self, color):
+        """
+        Evaluate the current state for `color`, the player to move (see
+        evaluate_state), looking in the evaluation cache first.
+        """
+        cache = self.eval_cache
+        if cache is None:
+            return evaluate_state(self.state, color, self.weights)
+        key = self.state.key(color)
+        value = cache.get(key)
+        if value is None:
+            value = evaluate_state(self.state, color, self.weights)
+            cache.put(key, value)
+        return value
+
+    def negamax(self, key, color, depth, alpha, beta, ply, null_move=True):
+        """
+        Principal variation search of the current state (with hash `key`,
+        `ply` plies from the root, which reductions don't change) to `depth`
+        plies, with `color` to move: return its value for `color`,
+        exact if inside the window (alpha, beta), else a bound (fail-soft).
+        Values in the transposition table are for the player to move. With
+        `null_move` False, don't try null-move pruning here (e.g. right after
+        a null move).
+        """
+        # if max depth is reached, or the game is over
+        if depth <= 0 or \
+                not self.state.white_tokens or not self.state.black_tokens:
+            # apply evaluation function
+            self.leaves += 1
+            return self.evaluate(color)
+
+        self.nodes += 1
+        if self.nodes % CHECK_NODES == 0:
+            self.check_time()
+
+        # look up previous searches of this state
+        entry = self.tt.get(key)
+        best_action = None
+        self.tt_probes += 1
+        if entry is not None:
+            self.tt_hits += 1
+            entry_depth, entry_value, flag, best_action = entry
+            if entry_depth >= depth:
+                if flag == EXACT or \
+                        (flag == LOWER and entry_value >= beta) or \
+                        (flag == UPPER and entry_value <= alpha):
+                    return entry_value
+        alpha_orig = alpha
+
+        # selective search, away from the principal variation
+        futile = False
+        if beta - alpha == 1 and (depth == 1 and self.futility or
+                                  depth >= NULL_MIN_DEPTH and self.null_move):
+            static = self.evaluate(color)
+            if depth == 1 and self.futility:
+                futile = static + self.futility_margin <= alpha
+            elif null_move and static >= beta and \
+                    self.null_search(color, depth, beta, ply) >= beta:
+                self.null_cutoffs += 1
+                return beta
+
+        best_value = -INFINITY
+        first = True
+        for i, action in enumerate(self.ordered_actions(color, ply,
+                                                        best_action)):
+            reduction = 0
+            if not first and action[0] == "MOVE":
+                if futile:
+                    self.futile += 1
+                    best_value = max(best_value,
+                                     static + self.futility_margin)
                     continue
-                else:
-                    for new_pos in possible_moves:
-                        #record old_pos for undo
-                        old_pos = token.pos
-                        #do alpha beta pruning
-                        if alpha < beta:
-                            #move the piece into the aim square
-                            eliminated_pieces = token.makemove(new_pos)
-                            current_heuristic = self.alphabeta(new_pos, current_depth, alpha, beta)
-                            #undo move
-                            token.undomove(old_pos, eliminated_pieces)
-                            #update alpha
-                            if alpha < current_heuristic:
-                                alpha = current_heuristic
-            return alpha
+                if self.lmr and depth >= LMR_MIN_DEPTH and \
+                        i >= LMR_MIN_MOVES:
+                    reduction = LMR_REDUCTION
+            value = self.search_child(action, color, depth, alpha, beta, ply,
+                                      first, reduction)
+            if first or value > best_value:
+                best_value, best_action = value, action
+                if value > alpha:
+                    alpha = value
+                    self.pv_table[ply] = (action,) + self.pv_table[ply + 1]
+                    if alpha >= beta:
+                        if action[0] == "MOVE":
+                            self.record_cutoff(action, color, depth, ply)
+                        break
+            first = False
+
+        flag = UPPER if best_value <= alpha_orig else \
+            LOWER if best_value >= beta else EXACT
+        if len(self.tt) >= TT_SIZE:
+            self.tt.clear()
+        self.tt[key] = (depth, best_value, flag, best_action)
+        return best_value
+
+    def null_search(self, color, depth, beta, ply):
+        """
+        Let `color` pass (if they have enough stacks to be safe from
+        zugzwang), at `ply` plies from the root, and search the resulting
+        state with a null window at beta, NULL_REDUCTION plies shallower.
+        Return its value for `color` (-INFINITY if they may not pass).
+        """
+        my_tokens = self.state.white_tokens if color == "white" else \
+            self.state.black_tokens
+        if len(my_tokens) < NULL_MIN_STACKS:
+            return -INFINITY
+        opponent = self.other(color)
+        key = self.state.key(opponent)
+        # (no state before a pass can repeat within the search after it)
+        self.history.push(key, irreversible=True)
+        try:
+            return -self.negamax(key, opponent, depth - 1 - NULL_REDUCTION,
+                                 -beta, -beta + 1, ply + 1, null_move=False)
+        finally:
+            self.history.pop(key, irreversible=True)
+
+    def ordered_actions(self, color, ply, first_action=None):
+        """
+        Generate the legal actions for `color` (at `ply` plies from the
+        root), trying `first_action` (e.g. the best action found by a
+        previous search) first, if it is legal, and the rest in the order
+        described at ORDERING (or as State.actions gives them, if ordering
+        is off). The MOVEs are only listed and sorted once the actions
+        before them fail to cut the search off.
+        """
+        actions = self.state.actions(color, self.skip_symmetric)
+        if first_action is not None and \
+                self.state.is_legal(first_action, color):
+            yield first_action
+        if not self.ordering:
+            for action in actions:
+                if action != first_action:
+                    yield action
+            return
+        # the BOOMs gaining tokens come first (see State.actions)
+        for action in actions:
+            if action[0] == "MOVE":
+                break
+            if action != first_action:
+                yield action
+        else:
+            return
+        moves = [action]
+        booms = [] # (that don't gain tokens, last)
+        for action in actions:
+            (moves if action[0] == "MOVE" else booms).append(action)
+        done = {first_action}
+        for killer in self.killers[ply]:
+            if killer not in done and self.state.is_legal(killer, color):
+                done.add(killer)
+                yield killer
+        scores = self.history_scores[color]
+        if scores:
+            moves.sort(key=lambda move: scores.get(move, 0), reverse=True)
+        for action in moves:
+            if action not in done:
+                yield action
+        for action in booms:
+            if action != first_action:
+                yield action
+
+    def record_cutoff(self, action, color, depth, ply):
+        """Remember a MOVE which caused a beta cutoff, searched to `depth`
+        plies at `ply` plies from the root, for ordering (see ORDERING)."""
+        killers = self.killers[ply]
+        if action not in killers:
+            self.killers[ply] = (action,) + killers[:KILLERS - 1]
+        scores = self.history_scores[color]
+        scores[action] = scores.get(action, 0) + depth * depth
+
+    def tt_action(self, key):
+        """The best action stored in the transposition table for a state."""
+        entry = self.tt.get(key)
+        if entry is not None:
+            return entry[3]
+        return None
+
+    def principal_variation(self, action):
+        """
+        The sequence of actions expected to follow `action`: the principal
+        variation of the last search if it starts with `action`, else found
+        by following best actions through the transposition table.
+        """
+        if len(self.pv) >= 2 and self.pv[0] == action:
+            return list(self.pv)
+        records = []
+        pv = [action]
+        color = self.color
+        while action is not None and len(pv) <= self.depth:
+            records.append(self.state.apply(action))
+            color = self.other(color)
+            action = self.tt_action(self.state.key(color))
+            if action is not None:
+                pv.append(action)
+        for record in reversed(records):
+            self.state.undo(record)
+        return pv
+
+    def check_time(self):
+        """Abort the search if out of time (or asked to stop pondering)."""
+        if self.ponder_conn is not None and self.ponder_conn.poll():
+            raise SearchTimeout()
+        if time.process_time() > self.deadline:
+            raise SearchTimeout()
+
+    def start_pondering(self, action):
+        """
+        Start searching, in a child process, the state expected after we play
+        `action` and our opponent plays their best reply.
+        """
+        pv = self.principal_variation(action)
+        if len(pv) < 2:
+            return
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            return # no fork() on this platform: no pondering
+        conn, child_conn = context.Pipe()
+        budget = max(TIME_LIMIT - TIME_RESERVE - self.time_used, 0) / \
+            TIME_SHARE
+        process = context.Process(target=self.ponder_process,
+                                  args=(child_conn, action, pv[1], budget),
+                                  daemon=True)
+        process.start()
+        child_conn.close()
+        self.pondering = (process, conn, pv[1])
+        self.ponder_hit = False
+
+    def ponder_process(self, conn, action, reply, budget):
+        """
+        Body of the pondering process: deepen the search of the expected
+        state until asked to stop (or out of `budget` CPU seconds), then send
+        back the CPU time used and, after a ponder hit, the completed depth
+        and the transposition table.
+        """
+        self.ponder = False
+        self.ponder_conn = conn
+        self.update(self.color, action)
+        self.update(self.opponent_color, reply)
+        # (a forked process starts with no CPU time used)
+        self.deadline = time.process_time() + budget
+        self.deepen(1, PONDER_MAX_DEPTH)
+        if conn.recv() == "hit":
+            conn.send((time.process_time(), len(self.iterations), self.tt))
+        else:
+            conn.send((time.process_time(), 0, None))
+        conn.close()
+
+    def stop_pondering(self):
+        """
+        Stop the pondering process, counting its CPU time as ours. After a
+        ponder hit, take over its transposition table and return the depth
+        it completed, else return 0.
+        """
+        if self.pondering is None:
+            return 0
+        process, conn, _ = self.pondering
+        self.pondering = None
+        hit, self.ponder_hit = self.ponder_hit, False
+        completed = 0
+        try:
+            conn.send("hit" if hit else "miss")
+            elapsed, depth, tt = conn.recv()
+        except (EOFError, OSError):
+            pass
+        else:
+            self.time_used += elapsed
+            if hit:
+                completed, self.tt = depth, tt
+        process.terminate()
+        process.join()
+        conn.close()
+        return completed
+
 
+class SearchTimeout(Exception):
+    """Raised to abort a search which has run out of time."""
@@ -0,0 +1,116 @@
+"""
+A binary cache file of precomputed tables (flat arrays of numbers), so that
+they are built once and then loaded, at every later start-up, by mapping the
+file into memory (with mmap): nothing is parsed or copied, each table is a
+memoryview of the mapped file, and processes loading the same file share its
+pages.
+
+The file is (with the header and directory in little-endian order, and the
+tables in the machine's own, which the version records):
+
+    header      MAGIC, FORMAT_VERSION (4 bytes), the version of the tables
+                (VERSION_SIZE bytes, e.g. a hash of the code building them),
+                the CRC-32 of everything after the header (4 bytes), and the
+                number of tables (4 bytes)
+    directory   for each table: its name (NAME_SIZE bytes), its array
+                typecode (1 byte, padded to 8) and its offset and length
+                (8 bytes each, in items)
+    data        each table's items, starting at a multiple of 8 bytes
+
+A file with the wrong magic, format or version, or whose checksum doesn't
+match, is stale (or corrupt): the tables are rebuilt, and the file replaced
+(atomically, so that a process loading it never sees half a file). If the
+file can't be written, the tables built are used from memory instead.
+"""
+
+import os
+import sys
+import mmap
+import zlib
+import struct
+
+MAGIC = b"AINTABLE"
+FORMAT_VERSION = 1
+VERSION_SIZE = 16
+NAME_SIZE = 32
+ALIGN = 8
+
+_HEADER = struct.Struct(f"<8sI{VERSION_SIZE}sII")
+_ENTRY = struct.Struct(f"<{NAME_SIZE}sc7xQQ")
+
+
+def load(path, version, build):
+    """
+    The tables cached at `path` for `version` (bytes or str, of fewer than
+    VERSION_SIZE bytes), as a dictionary from names to memoryviews, after
+    building them with `build()` (returning a dictionary from names to
+    arrays, see the array module) and caching them, if they weren't already
+    (or building them every time, if `path` is None).
+    """
+    if isinstance(version, str):
+        version = version.encode()
+    version += sys.byteorder[0].encode()
+    tables = _map(path, version) if path is not None else None
+    if tables is None:
+        arrays = build()
+        try:
+            if path is not None:
+                _write(path, version, arrays)
+                tables = _map(path, version)
+        except OSError:
+            pass # (e.g. a read-only directory: do without the cache)
+        if tables is None:
+            tables = {name: memoryview(array)
+                      for name, array in arrays.items()}
+    return tables
+
+def _map(path, version):
+    """The tables in the file at `path`, or None if there is no such file,
+    or it isn't a valid cache of this version of the tables."""
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError): # (ValueError: an empty file)
+        return None
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        return None
+    magic, file_format, file_version, checksum, count = \
+        _HEADER.unpack_from(view)
+    if magic != MAGIC or file_format != FORMAT_VERSION or \
+            file_version != version.ljust(VERSION_SIZE, b"\0") or \
+            zlib.crc32(view[_HEADER.size:]) != checksum:
+        return None
+    tables = {}
+    for i in range(count):
+        name, typecode, offset, length = \
+            _ENTRY.unpack_from(view, _HEADER.size + i * _ENTRY.size)
+        typecode = typecode.decode()
+        size = struct.calcsize(typecode)
+        tables[name.rstrip(b"\0").decode()] = \
+            view[offset:offset + length * size].cast(typecode)
+    return tables
+
+def _write(path, version, arrays):
+    """Write a cache file of the arrays at `path` (replacing any file)."""
+    directory = bytearray()
+    data = bytearray()
+    offset = _HEADER.size + len(arrays) * _ENTRY.size
+    for name, array in arrays.items():
+        data += bytes(-(offset + len(data)) % ALIGN)
+        directory += _ENTRY.pack(name.encode(), array.typecode.encode(),
+                                 offset + len(data), len(array))
+        data += array.tobytes()
+    body = directory + data
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, version, zlib.crc32(body),
+                          len(arrays))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
@@ -0,0 +1,221 @@
+"""
+Texel-style tuning of the evaluation weights (see AI_Naruto.player.FEATURES)
+from logged games. Run with (from the directory containing referee; needs
+NumPy):
+
+    python -m AI_Naruto.tune LOGFILE [LOGFILE ...] [-o WEIGHTS] [-j JOBS]
+                             [-s STEPS] [-r RATE]
+
+Each log file is a game log written by the referee (its -l option). Every
+game is replayed, and each state before an action is kept, with the player
+to move and the result of the game for them (1 for a win, 0.5 for a draw, 0
+for a loss). A value v for the player to move predicts their result as
+sigmoid(K * v); K is fitted first, with the current weights, and then the
+weights are fitted by gradient descent (Adam) on the mean squared error of
+the predictions.
+
+The features of every state are computed once, in NumPy batches (see
+AI_Naruto.batch.features), so each step of the descent is a few matrix
+products. With JOBS > 1, the states are split into that many shards, each
+held by a worker process (forked, so the shards are never copied), which
+returns its share of the error and its gradient at each step.
+
+The weights are written to WEIGHTS (by default AI_Naruto.player.WEIGHTS_FILE,
+which AI_NarutoPlayer loads when it starts), with K and the final error.
+"""
+
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from referee import replay
+from AI_Naruto import batch
+from AI_Naruto.player import State, FEATURES, WEIGHTS_FILE, load_weights
+from AI_Naruto.selfplay import encode, SIGNS
+
+K_CANDIDATES = np.geomspace(1 / 256, 1, 65)    # scanned for the best K
+DECAY = (0.9, 0.999)    # Adam's moment decay rates
+EPSILON = 1e-8
+
+
+def read_games(path):
+    """
+    The finished games in a referee game log (see referee.replay.read_games):
+    a list of (position, actions, winner), where position is the position
+    the game started from (see referee.position), each action is a (colour,
+    action) pair and winner is "white", "black", or None for a draw.
+    """
+    return [(record.position, record.actions,
+             record.result[len("winner: "):]
+             if record.result.startswith("winner: ") else None)
+            for record in replay.read_games(path)
+            if record.result is not None]
+
+def positions(games):
+    """
+    The states before each action of the games: (heights, signs, results),
+    an N x 64 array of signed stack heights (see AI_Naruto.selfplay.encode),
+    the player to move in each, and the result of the game for them.
+    """
+    heights, signs, results = [], [], []
+    for position, actions, winner in games:
+        state = State.from_position(position)
+        for colour, action in actions:
+            heights.append(encode(state))
+            signs.append(SIGNS[colour])
+            results.append(0.5 if winner is None else float(winner == colour))
+            state.apply(action)
+    return (np.array(heights, dtype=np.int8).reshape(-1, 64),
+            np.array(signs, dtype=np.int8),
+            np.array(results))
+
+def training_data(heights, signs, results):
+    """
+    The features and results of the states which aren't over (where the
+    evaluation is a weighted sum of features), as float arrays.
+    """
+    keep = np.isnan(batch.outcomes(heights, signs))
+    return batch.features(heights[keep], signs[keep]), results[keep]
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def error(features, results, weights, k):
+    """The sum of squared errors of the predicted results, and its gradient
+    with respect to the weights."""
+    predicted = _sigmoid(k * (features @ weights))
+    residual = predicted - results
+    gradient = features.T @ (2 * k * residual * predicted * (1 - predicted))
+    return float(residual @ residual), gradient
+
+def fit_k(features, results, weights):
+    """The scale K (of K_CANDIDATES) which best predicts the results with
+    these weights."""
+    values = features @ weights
+    errors = [np.sum((_sigmoid(k * values) - results) ** 2)
+              for k in K_CANDIDATES]
+    return float(K_CANDIDATES[int(np.argmin(errors))])
+
+
+# each worker's shards of the data (set before forking, so inherited)
+_SHARDS = []
+
+def _shard_error(job):
+    i, weights, k = job
+    features, results = _SHARDS[i]
+    return error(features, results, weights, k)
+
+class Tuner:
+    """
+    Gradient descent on the weights over the data, split into `jobs` shards,
+    each given to a worker process (if more than one).
+    """
+
+    def __init__(self, features, results, jobs=1):
+        global _SHARDS
+        self.count = len(results)
+        _SHARDS = list(zip(np.array_split(features, jobs),
+                           np.array_split(results, jobs)))
+        self.pool = None
+        if jobs > 1:
+            self.pool = multiprocessing.get_context("fork").Pool(jobs)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def error(self, weights, k):
+        """The mean squared error and its gradient, over all of the shards."""
+        jobs = [(i, weights, k) for i in range(len(_SHARDS))]
+        shard_errors = self.pool.map(_shard_error, jobs) if self.pool else \
+            [_shard_error(job) for job in jobs]
+        total = sum(e for e, _ in shard_errors)
+        gradient = sum(g for _, g in shard_errors)
+        return total / self.count, gradient / self.count
+
+    def descend(self, weights, k, steps, rate, report=None):
+        """Adam from `weights`, for `steps` steps of size about `rate`.
+        Return the best weights seen and their error."""
+        weights = np.array(weights, dtype=float)
+        m = np.zeros_like(weights)
+        v = np.zeros_like(weights)
+        best = (np.inf, weights)
+        for step in range(1, steps + 1):
+            loss, gradient = self.error(weights, k)
+            if loss < best[0]:
+                best = (loss, weights.copy())
+            if report is not None:
+                report(step, loss, weights)
+            m = DECAY[0] * m + (1 - DECAY[0]) * gradient
+            v = DECAY[1] * v + (1 - DECAY[1]) * gradient ** 2
+            m_hat = m / (1 - DECAY[0] ** step)
+            v_hat = v / (1 - DECAY[1] ** step)
+            weights -= rate * m_hat / (np.sqrt(v_hat) + EPSILON)
+        loss, _ = self.error(weights, k)
+        if loss < best[0]:
+            best = (loss, weights.copy())
+        return best[1], best[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="AI_Naruto.tune",
+        description="fit the evaluation weights to the results of logged "
+            "games.")
+    parser.add_argument('logs', nargs='+', metavar='LOGFILE',
+        help="referee game logs to learn from.")
+    parser.add_argument('-o', '--output', default=WEIGHTS_FILE,
+        help="where to write the weights (default: the file the player "
+            "loads).")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help="worker processes to share the data between (default: 1).")
+    parser.add_argument('-s', '--steps', type=int, default=500,
+        help="steps of gradient descent (default: 500).")
+    parser.add_argument('-r', '--rate', type=float, default=0.1,
+        help="step size for gradient descent (default: 0.1).")
+    args = parser.parse_args()
+
+    games = []
+    for path in args.logs:
+        games.extend(read_games(path))
+    if not games:
+        print("error: no finished games found in the logs")
+        return 1
+    start = time.perf_counter()
+    features, results = training_data(*positions(games))
+    print(f"{len(games)} games, {len(results)} positions "
+          f"(features in {time.perf_counter() - start:.3f}s)")
+
+    initial = np.array(load_weights(), dtype=float)
+    k = fit_k(features, results, initial)
+    tuner = Tuner(features, results, max(args.jobs, 1))
+    try:
+        loss, _ = tuner.error(initial, k)
+        print(f"K = {k:.5f}, error {loss:.6f} with the current weights")
+
+        def report(step, loss, weights):
+            if step % 50 == 0:
+                print(f"step {step:5d}: error {loss:.6f}, weights "
+                      + ", ".join(f"{w:.3f}" for w in weights))
+        start = time.perf_counter()
+        weights, loss = tuner.descend(initial, k, args.steps, args.rate,
+                                      report)
+        print(f"error {loss:.6f} after {args.steps} steps "
+              f"in {time.perf_counter() - start:.3f}s")
+    finally:
+        tuner.close()
+
+    with open(args.output, "w") as f:
+        json.dump({"weights": dict(zip(FEATURES, weights.tolist())),
+                   "k": k, "games": len(games), "positions": len(results),
+                   "error": loss}, f, indent=4)
+    print(f"wrote {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,8 @@
 """
-This module contains some helper functions for printing actions and boards.
+This module contains some helper functions for printing actions and boards,
+and a priority queue for search algorithms.
 Feel free to use and/or modify them to help you develop your program.
 """
-import heapq
 
 
 def print_move(n, x_a, y_a, x_b, y_b, **kwargs):
@@ -21,7 +21,8 @@ def print_boom(x, y, **kwargs):
     print("BOOM at {}.".format((x, y)), **kwargs)
 
 
-def print_board(board_dict, message="", unicode=False, compact=True, **kwargs):
+def print_board(board_dict, message="", unicode=False, compact=True,
+                renderer=None, **kwargs):
     """
     For help with visualisation and debugging: output a board diagram with
     any information you like (tokens, heuristic values, distances, etc.).
@@ -42,12 +43,51 @@ def print_board(board_dict, message="", unicode=False, compact=True, **kwargs):
         coordinates along the edges of the board, False to use a bigger one
         with coordinates alongside the printable information in each square.
         Default True (small board).
+    renderer -- An object with a method render(template, message, cells)
+        to draw the board with instead of printing it, e.g. a
+        referee.render.DiffRenderer (to redraw a board in place, say while
+        watching a search). Default None (print the board).
 
     Any other keyword arguments are passed through to the print function.
     """
+    template = board_template(unicode, compact)
+    cells = board_cells(board_dict)
+    if renderer is not None:
+        renderer.render(template, message, cells)
+    else:
+        print(template.format(message, *cells), **kwargs)
+
+
+def board_template(unicode=False, compact=True):
+    """
+    The board diagram used by print_board: a format string with a
+    placeholder for the message, then one for each cell (see board_cells).
+    """
     if unicode:
         if compact:
-            template = """# {}
+            return _TEMPLATE_UNICODE_COMPACT
+        return _TEMPLATE_UNICODE_LARGE
+    if compact:
+        return _TEMPLATE_ASCII_COMPACT
+    return _TEMPLATE_ASCII_LARGE
+
+
+def board_cells(board_dict):
+    """
+    The cells of a board diagram (see print_board), from the top left: at
+    most the first 3 characters of the value for each (x, y) in board_dict.
+    """
+    cells = []
+    for y in range(7, -1, -1):
+        for x in range(8):
+            if (x, y) not in board_dict:
+                cells.append("   ")
+            else:
+                cells.append(str(board_dict[(x, y)])[:3].center(3))
+    return cells
+
+
+_TEMPLATE_UNICODE_COMPACT = """# {}
 #    ┌───┬───┬───┬───┬───┬───┬───┬───┐
 #  7 │{:}│{:}│{:}│{:}│{:}│{:}│{:}│{:}│
 #    ├───┼───┼───┼───┼───┼───┼───┼───┤
@@ -66,8 +106,7 @@ def print_board(board_dict, message="", unicode=False, compact=True, **kwargs):
 #  0 │{:}│{:}│{:}│{:}│{:}│{:}│{:}│{:}│
 #    └───┴───┴───┴───┴───┴───┴───┴───┘
 # y/x  0   1   2   3   4   5   6   7"""
-        else:
-            template = """# {}
+_TEMPLATE_UNICODE_LARGE = """# {}
 # ┌─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┐
 # │ {:} │ {:} │ {:} │ {:} │ {:} │ {:} │ {:} │ {:} │
 # │ 0,7 │ 1,7 │ 2,7 │ 3,7 │ 4,7 │ 5,7 │ 6,7 │ 7,7 │
@@ -93,9 +132,7 @@ def print_board(board_dict, message="", unicode=False, compact=True, **kwargs):
 # │ {:} │ {:} │ {:} │ {:} │ {:} │ {:} │ {:} │ {:} │
 # │ 0,0 │ 1,0 │ 2,0 │ 3,0 │ 4,0 │ 5,0 │ 6,0 │ 7,0 │
 # └─────┴─────┴─────┴─────┴─────┴─────┴─────┴─────┘"""
-    else:
-        if compact:
-            template = """# {}
+_TEMPLATE_ASCII_COMPACT = """# {}
 #    +---+---+---+---+---+---+---+---+
 #  7 |{:}|{:}|{:}|{:}|{:}|{:}|{:}|{:}|
 #    +---+---+---+---+---+---+---+---+
@@ -114,8 +151,7 @@ def print_board(board_dict, message="", unicode=False, compact=True, **kwargs):
 #  0 |{:}|{:}|{:}|{:}|{:}|{:}|{:}|{:}|
 #    +---+---+---+---+---+---+---+---+
 # y/x  0   1   2   3   4   5   6   7"""
-        else:
-            template = """# {}
+_TEMPLATE_ASCII_LARGE = """# {}
 # +-----+-----+-----+-----+-----+-----+-----+-----+
 # | {:} | {:} | {:} | {:} | {:} | {:} | {:} | {:} |
 # | 0,7 | 1,7 | 2,7 | 3,7 | 4,7 | 5,7 | 6,7 | 7,7 |
@@ -141,16 +177,6 @@ def print_board(board_dict, message="", unicode=False, compact=True, **kwargs):
 # | {:} | {:} | {:} | {:} | {:} | {:} | {:} | {:} |
 # | 0,0 | 1,0 | 2,0 | 3,0 | 4,0 | 5,0 | 6,0 | 7,0 |
 # +-----+-----+-----+-----+-----+-----+-----+-----+"""
-    # board the board string
-    coords = [(x, 7 - y) for y in range(8) for x in range(8)]
-    cells = []
-    for xy in coords:
-        if xy not in board_dict:
-            cells.append("   ")
-        else:
-            cells.append(str(board_dict[xy])[:3].center(3))
-    # print it
-    print(template.format(message, *cells), **kwargs)
 
 
 class PriorityQueue:
@@ -159,32 +185,150 @@ class PriorityQueue:
       is inspired by the Berkeley CS188 Pacman Project.
 
       It can be retrieved at: http://ai.berkeley.edu/
+
+      It is an indexed binary heap: each entry remembers its position in the
+      heap, and a map finds the entry for an item, so that `update` (and
+      `decrease_key`) take O(log n) time rather than scanning the heap.
+      Entries removed with `remove` are deleted lazily (skipped when they
+      reach the top of the heap).
+
+      Items must be hashable (unlike the original list-based queue's, which
+      could be anything comparable with ==), and each item is in the queue
+      at most once: pushing an item already in it just changes its priority.
     """
 
     def __init__(self):
         self.heap = []
         self.count = 0
+        self.entries = {} # item -> its (latest) live entry
+        self.size = 0     # number of live entries
 
     def push(self, item, priority):
-        entry = (priority, self.count, item)
-        heapq.heappush(self.heap, entry)
+        """
+        Add an item to the queue with priority `priority`. If it is already
+        in the queue, give it this priority instead (as if it was removed
+        and pushed again, so it comes after other items of equal priority).
+        """
+        entry = self.entries.get(item)
+        if entry is not None:
+            key = entry.key
+            entry.key = (priority, self.count)
+            self.count += 1
+            if entry.key < key:
+                self._sift_up(entry)
+            else:
+                self._sift_down(entry)
+            return
+        entry = _Entry(priority, self.count, item, len(self.heap))
+        self.heap.append(entry)
+        self._sift_up(entry)
+        self.entries[item] = entry
         self.count += 1
+        self.size += 1
 
     def pop(self):
-        (_, _, item) = heapq.heappop(self.heap)
-        return item
+        while True:
+            entry = self._pop_entry()
+            if not entry.removed:
+                break
+        if self.entries.get(entry.item) is entry:
+            del self.entries[entry.item]
+        self.size -= 1
+        return entry.item
 
     def isEmpty(self):
-        return len(self.heap) == 0
+        return self.size == 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return item in self.entries
 
     def update(self, item, priority):
-        for index, (p, c, i) in enumerate(self.heap):
-            if i == item:
-                if p <= priority:
-                    break
-                del self.heap[index]
-                self.heap.append((priority, c, item))
-                heapq.heapify(self.heap)
+        """
+        Lower the priority of an item to `priority`, or push it if it is not
+        in the queue (an item with a lower priority is left alone).
+        """
+        entry = self.entries.get(item)
+        if entry is None:
+            self.push(item, priority)
+        elif priority < entry.key[0]:
+            entry.key = (priority, entry.key[1])
+            self._sift_up(entry)
+
+    def decrease_key(self, item, priority):
+        """
+        Lower the priority of an item already in the queue to `priority`
+        (unless it is already lower).
+        """
+        entry = self.entries[item]
+        if priority < entry.key[0]:
+            entry.key = (priority, entry.key[1])
+            self._sift_up(entry)
+
+    def remove(self, item):
+        """Remove an item from the queue (lazily, in O(1) time)."""
+        entry = self.entries.pop(item)
+        entry.removed = True
+        self.size -= 1
+
+    def _pop_entry(self):
+        heap = self.heap
+        last = heap.pop()
+        if not heap:
+            return last
+        top = heap[0]
+        heap[0] = last
+        last.index = 0
+        self._sift_down(last)
+        return top
+
+    def _sift_up(self, entry):
+        heap = self.heap
+        key = entry.key
+        index = entry.index
+        while index:
+            parent_index = (index - 1) >> 1
+            parent = heap[parent_index]
+            if key >= parent.key:
                 break
-        else:
-            self.push(item, priority)
\ No newline at end of file
+            heap[index] = parent
+            parent.index = index
+            index = parent_index
+        heap[index] = entry
+        entry.index = index
+
+    def _sift_down(self, entry):
+        heap = self.heap
+        size = len(heap)
+        key = entry.key
+        index = entry.index
+        child_index = 2 * index + 1
+        while child_index < size:
+            child = heap[child_index]
+            if child_index + 1 < size and heap[child_index + 1].key < child.key:
+                child_index += 1
+                child = heap[child_index]
+            if key <= child.key:
+                break
+            heap[index] = child
+            child.index = index
+            index = child_index
+            child_index = 2 * index + 1
+        heap[index] = entry
+        entry.index = index
+
+
+class _Entry:
+    """
+    An entry in a PriorityQueue's heap, ordered by key: (priority, count),
+    so that items of equal priority come out first-in, first-out.
+    """
+    __slots__ = ("key", "item", "index", "removed")
+
+    def __init__(self, priority, count, item, index):
+        self.key = (priority, count)
+        self.item = item
+        self.index = index
+        self.removed = False
@@ -6,6 +6,9 @@ and begin a game between them.
 from referee.log import StarLog
 from referee.game import play, IllegalActionException
 from referee.player import PlayerWrapper, ResourceLimitException, set_space_line
+from referee.sandbox import SandboxPlayerWrapper, SandboxException
+from referee.telemetry import TelemetryWriter
+from referee.render import DiffRenderer
 from referee.options import get_options
 
 def main():
@@ -15,25 +18,39 @@ def main():
 
     # Create a star-log for controlling the format of output from within this
     # program
-    out = StarLog(level=options.verbosity, ansi=options.use_colour)
+    # (buffered in a background thread, unless waiting for user input; and
+    # not clearing the screen if the board is to be redrawn in place)
+    out = StarLog(level=options.verbosity,
+        ansi=options.use_colour and options.redraw is None,
+        buffered=options.buffered and options.delay >= 0)
+    renderer = None
+    if options.redraw is not None:
+        renderer = DiffRenderer(fps=options.redraw)
     out.comment("all messages printed by the referee after this begin with a *")
     out.comment("(any other lines of output must be from your Player classes).")
     out.comment()
 
+    telemetry = None
+    players = []
     try:
-        # Import player classes
-        p1 = PlayerWrapper('player 1', options.player1_loc,
+        # Import player classes (or start processes to import them)
+        if options.sandbox:
+            Wrapper = SandboxPlayerWrapper
+        else:
+            Wrapper = PlayerWrapper
+        for num, loc in [(1, options.player1_loc), (2, options.player2_loc)]:
+            players.append(Wrapper(f'player {num}', loc,
                 time_limit=options.time, space_limit=options.space,
-                logfn=out.comment)
-        p2 = PlayerWrapper('player 2', options.player2_loc,
-                time_limit=options.time, space_limit=options.space,
-                logfn=out.comment)
+                logfn=out.comment, gc_policy=options.gc))
+        p1, p2 = players
 
         # We'll start measuring space usage from now, after all
         # library imports should be finished:
-        set_space_line()
+        set_space_line(options.memory)
 
         # Play the game!
+        if options.telemetry is not None:
+            telemetry = TelemetryWriter(options.telemetry)
         result = play([p1, p2],
                 delay=options.delay,
                 logfilename=options.logfile,
@@ -41,26 +58,41 @@ def main():
                 print_state=(options.verbosity>1),
                 use_debugboard=(options.verbosity>2),
                 use_colour=options.use_colour,
-                use_unicode=options.use_unicode)
+                use_unicode=options.use_unicode,
+                telemetry=telemetry.record if telemetry else None,
+                renderer=renderer)
         # Display the final result of the game to the user.
-        out.comment("game over!", depth=-1)
+        out.comment("game over!", depth=-1, keep=True)
         out.print(result)
     
     # In case the game ends in an abnormal way, print a clean error
     # message for the user (rather than a trace).
     except KeyboardInterrupt:
         print() # (end the line)
-        out.comment("bye!")
+        out.comment("bye!", keep=True)
     except IllegalActionException as e:
-        out.comment("game error!", depth=-1)
+        out.comment("game error!", depth=-1, keep=True)
         out.print("error: invalid action!")
-        out.comment(e)
+        out.comment(e, keep=True)
     except ResourceLimitException as e:
-        out.comment("game error!", depth=-1)
+        out.comment("game error!", depth=-1, keep=True)
         out.print("error: resource limit exceeded!")
-        out.comment(e)
+        out.comment(e, keep=True)
+    except SandboxException as e:
+        out.comment("game error!", depth=-1, keep=True)
+        out.print("error: player process failed!")
+        out.comment(e, keep=True)
     # If it's another kind of error then it might be coming from the player
     # itself? Then, a traceback will be more helpful.
+    finally:
+        # (shutting down the players' processes, in sandbox mode)
+        for player in players:
+            player.close()
+        if telemetry is not None:
+            telemetry.close()
+        out.close()
+        if renderer is not None:
+            renderer.close()
 
 if __name__ == '__main__':
     main()
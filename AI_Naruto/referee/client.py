@@ -0,0 +1,47 @@
+"""
+Connect a Player class to a game server (see referee.server) and play the
+games it starts, until the server disconnects.
+
+usage: python -m referee.client [-h] [-n NAME] [-s SPACE] [-g POLICY]
+                                socket player
+"""
+
+import socket
+import argparse
+import importlib
+
+from referee.options import PackageSpecAction
+from referee.player import gc_policy
+from referee.sandbox import serve
+
+def main():
+    parser = argparse.ArgumentParser(prog="referee.client",
+        description="play games hosted by a game server.")
+    parser.add_argument('socket',
+        help="path of the server's unix socket.")
+    parser.add_argument('player', action=PackageSpecAction,
+        help="location of the Player class (e.g. package name, see "
+            "`python -m referee --help`).")
+    parser.add_argument('-n', '--name', default=None,
+        help="name to play under (default: the player location).")
+    parser.add_argument('-s', '--space', type=float, default=0,
+        help="limit on memory space (float, MB) for this player process.")
+    parser.add_argument('-g', '--gc', type=gc_policy, default="always",
+        help="when to collect garbage (off the clock) before each request "
+            "(see `python -m referee --help`).")
+    args = parser.parse_args()
+
+    player_pkg, player_cls = args.player
+    Player = getattr(importlib.import_module(player_pkg), player_cls)
+    name = args.name or f"{player_pkg}:{player_cls}"
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(args.socket)
+        inp, out = sock.makefile('r'), sock.makefile('w')
+        print(f"HELLO {name}", file=out, flush=True)
+        # (no time rlimit: this process plays many games, and the server
+        # enforces time limits per game)
+        serve(Player, inp, out, space_limit=args.space, gc_policy=args.gc)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Play games in fresh processes forked from one prepared process (a 'fork
+server'), rather than starting a new interpreter for each game: the referee
+and the Player classes are imported once, along with anything the players
+precompute, and each game then starts in a copy-on-write child in about a
+millisecond, sharing the memory of everything loaded (unless written to).
+
+A Player class may provide a class method to do its one-off preparation in
+the server, so that every game's players start with it done:
+
+    preload()   called once, after importing the class (e.g. to build or
+                load tables which don't depend on the colour played)
+
+The server's objects are frozen (see gc.freeze) before forking, so that
+collecting garbage in the children doesn't write to (and so copy) them.
+
+ForkServer is a concurrent.futures.Executor running each submitted call in
+its own child process (with at most `max_workers` at a time), e.g. to play
+games with referee.match.play_game. Run as a program, it plays a number of
+games between two Player classes, writing the result of each game as a line
+of JSON (as referee.server does):
+
+usage: python -m referee.forkserver [-h] [-g GAMES] [-j JOBS] [-t TIME]
+                                    [-s SPACE] white black
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import pickle
+import select
+import signal
+import argparse
+import threading
+import collections
+import concurrent.futures
+
+from referee.player import _load_player_class, set_space_line
+from referee.options import PackageSpecAction
+
+READ_SIZE = 1 << 16 # bytes to read from a child's pipe at once
+
+
+def preload(player_loc):
+    """Import a Player class (a package specification, see referee.options)
+    and let it do its one-off preparation, if any."""
+    Player = _load_player_class(*player_loc)
+    prepare = getattr(Player, "preload", None)
+    if prepare is not None:
+        prepare()
+    return Player
+
+
+class ForkServer(concurrent.futures.Executor):
+    """
+    An executor which runs each call in a child process forked from this
+    one, after preloading the Player classes at `player_locs` (see preload).
+    Each child calls `initializer` (if any) after it is forked, before the
+    call, as each worker of a ProcessPoolExecutor does: per-process state
+    (such as the space meter set with set_space_line, which reads
+    /proc/self/statm through an open file) must be set up in the child,
+    not inherited from this process. The result (or exception) of each call
+    is pickled back to this process through a pipe.
+
+    A dispatcher thread forks the children and collects their results. On
+    shutdown with `cancel_futures`, children still running are killed.
+    """
+    def __init__(self, max_workers=None, player_locs=(), initializer=None):
+        self.max_workers = max_workers or os.cpu_count()
+        for player_loc in player_locs:
+            preload(player_loc)
+        self.initializer = initializer
+        # (keep the children from copying our objects by collecting them)
+        gc.collect()
+        gc.freeze()
+
+        self._queue = collections.deque()   # (future, fn, args, kwargs)
+        self._running = {}  # pipe fd -> [pid, future, data]
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit calls after shutdown")
+            self._queue.append((future, fn, args, kwargs))
+        os.write(self._wake_w, b"x")
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft()[0].cancel()
+                for pid, _, _ in self._running.values():
+                    os.kill(pid, signal.SIGKILL)
+        os.write(self._wake_w, b"x")
+        if wait:
+            self._thread.join()
+
+    def _dispatch(self):
+        """Fork children for queued calls and collect their results, until
+        shut down (and every call has finished)."""
+        while True:
+            with self._lock:
+                while self._queue and len(self._running) < self.max_workers:
+                    future, fn, args, kwargs = self._queue.popleft()
+                    if future.set_running_or_notify_cancel():
+                        self._fork(future, fn, args, kwargs)
+                if self._shutdown and not self._queue and not self._running:
+                    break
+                fds = [self._wake_r, *self._running]
+            ready, _, _ = select.select(fds, [], [])
+            for fd in ready:
+                if fd == self._wake_r:
+                    os.read(fd, READ_SIZE)
+                    continue
+                chunk = os.read(fd, READ_SIZE)
+                with self._lock:
+                    if chunk:
+                        self._running[fd][2] += chunk
+                        continue
+                    pid, future, data = self._running.pop(fd)
+                os.close(fd)
+                _, status = os.waitpid(pid, 0)
+                self._finish(future, data, status)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _fork(self, future, fn, args, kwargs):
+        read_fd, write_fd = os.pipe()
+        # (don't let the child inherit our buffered output, to write twice)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            # the child: run the call, send back the result, and exit
+            os.close(read_fd)
+            status = 0
+            try:
+                try:
+                    if self.initializer is not None:
+                        self.initializer()
+                    result = (True, fn(*args, **kwargs))
+                except BaseException as e:
+                    result = (False, e)
+                try:
+                    data = pickle.dumps(result)
+                except Exception as e:
+                    data = pickle.dumps((False, RuntimeError(
+                        f"unpicklable result: {e}")))
+                with os.fdopen(write_fd, 'wb') as out:
+                    out.write(data)
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        self._running[read_fd] = [pid, future, bytearray()]
+
+    def _finish(self, future, data, status):
+        if future.done(): # (cancelled while running)
+            return
+        if not data:
+            future.set_exception(RuntimeError(
+                f"game process exited unexpectedly (status {status})"))
+            return
+        ok, result = pickle.loads(data)
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+
+def main():
+    from referee.match import play_game
+    parser = argparse.ArgumentParser(prog="referee.forkserver",
+        description="play many games between two Player classes, each in a "
+            "process forked from one which has already loaded them.")
+    parser.add_argument('white_loc', metavar='white', action=PackageSpecAction,
+        help="location of White's Player class (as for python -m referee).")
+    parser.add_argument('black_loc', metavar='black', action=PackageSpecAction,
+        help="location of Black's Player class.")
+    parser.add_argument('-g', '--games', type=int, default=1,
+        help="how many games to play (default: 1).")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help="games to play at once (default: one per CPU).")
+    parser.add_argument('-t', '--time', type=float, default=0,
+        help="limit on CPU time (float, seconds) for each player, per game.")
+    parser.add_argument('-s', '--space', type=float, default=0,
+        help="limit on memory space (float, MB) for each player.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = ForkServer(args.jobs, [args.white_loc, args.black_loc],
+                        initializer=set_space_line)
+    print(f"* loaded players in {time.perf_counter() - start:.3f}s",
+          file=sys.stderr)
+    start = time.perf_counter()
+    futures = [server.submit(play_game, args.white_loc, args.black_loc,
+                             time_limit=args.time, space_limit=args.space)
+               for _ in range(args.games)]
+    try:
+        for game_id, future in enumerate(futures, 1):
+            record = {"game": game_id, **future.result()}
+            print(json.dumps(record), flush=True)
+    except KeyboardInterrupt:
+        server.shutdown(wait=False, cancel_futures=True)
+        return 1
+    server.shutdown()
+    elapsed = time.perf_counter() - start
+    print(f"* played {args.games} games in {elapsed:.3f}s "
+          f"({args.games / elapsed:.1f} games/s)", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,7 +15,11 @@ structures for representing the state of a game.
 
 import sys
 import time
-from collections import Counter
+import random
+import inspect
+from collections import Counter, defaultdict
+
+from referee.position import parse_position, format_position
 
 
 
@@ -31,7 +35,8 @@ NUM_PLAYERS = 2
 
 def play(players,
          delay=0, logfilename=None, out_function=None, print_state=True,
-         use_debugboard=False, use_colour=False, use_unicode=False):
+         use_debugboard=False, use_colour=False, use_unicode=False,
+         telemetry=None, renderer=None):
     """
     Coordinate a game, return a string describing the result.
 
@@ -47,6 +52,12 @@ def play(players,
         state is also True).
     use_colour -- Use ANSI colour codes for output.
     use_unicode -- Use unicode symbols for output.
+    telemetry -- If not None, a function to call with the fields of a
+        telemetry record for each turn and for the result (e.g. the record
+        method of a referee.telemetry.TelemetryWriter).
+    renderer -- If not None (and print_state is True), draw the board with
+        this renderer (e.g. a referee.render.DiffRenderer) instead of
+        printing it.
     """
     # Configure behaviour of this function depending on parameters:
     out = out_function if out_function else (lambda *_, **__: None) # no-op
@@ -58,7 +69,10 @@ def play(players,
             input()
     else:
         def wait(): pass
-    if print_state:
+    if print_state and renderer is not None:
+        def display_state(game):
+            game.render(renderer)
+    elif print_state:
         def display_state(game):
             out("displaying game info:")
             out(game, depth=1)
@@ -84,27 +98,91 @@ def play(players,
     curr_player, next_player = players
     while not game.over():
         wait()
-        out(f"{curr_player.name}'s turn", depth=-1, clear=True)
+        _run_sync(play_turn(game, curr_player, players, out, display_state,
+            telemetry))
+
+        # Next player's turn!
+        curr_player, next_player = next_player, curr_player
+
+    # After that loop, the game has ended (one way or another!)
+    result = game.end()
+    if telemetry is not None:
+        telemetry(type="result", result=result, turns=game.nturns,
+            time={c: round(p.timer.clock, 6)
+                for c, p in zip(COLOURS, players)})
+    return result
 
-        # Ask the current player for their next action (calling their .action()
-        # method).
-        action = curr_player.action()
 
-        # Validate this action (or pass) and apply it to the game if it is
-        # allowed. Display the resulting game state.
-        game.update(curr_player.colour, action)
+async def play_turn(game, curr_player, players, out=None, display_state=None,
+        telemetry=None):
+    """
+    Play one turn of a game (a coroutine, so that many games can be played
+    concurrently by players who are awaited, see referee.server).
+
+    Arguments:
+    game -- The Game being played.
+    curr_player -- The Player wrapper whose turn it is.
+    players -- A list of all Player wrappers in the game. Their action and
+        update methods may return awaitables, to be awaited for the result.
+    out -- Function to use for printing commentary about the game.
+    display_state -- Function to use for displaying the game state.
+    telemetry -- If not None, a function to call with the fields of a
+        telemetry record for this turn (see referee.telemetry).
+    """
+    out = out if out else (lambda *_, **__: None) # no-op
+    out(f"{curr_player.name}'s turn", depth=-1, clear=True)
+
+    # Ask the current player for their next action (calling their .action()
+    # method).
+    action = await _result(curr_player.action())
+    if telemetry is not None:
+        # (measure the action, before the updates are measured)
+        record = {
+            "type": "turn",
+            "turn": game.nturns + 1,
+            "colour": curr_player.colour,
+            "player": curr_player.name,
+            "action": action,
+            "actions": game._count_actions(curr_player.colour),
+            "time": round(curr_player.timer.elapsed, 6),
+            "clock": round(curr_player.timer.clock, 6),
+            "space": round(curr_player.space.curr_usage, 3),
+            "peak": round(curr_player.space.peak_usage, 3),
+        }
+        metrics = await _result(curr_player.metrics())
+        if metrics:
+            record["metrics"] = metrics
+
+    # Validate this action (or pass) and apply it to the game if it is
+    # allowed. Display the resulting game state.
+    game.update(curr_player.colour, action)
+    if display_state is not None:
         display_state(game)
 
-        # Notify both players (including the current player) of the action
-        # (using their .update() methods).
-        for player in players:
-            player.update(curr_player.colour, action)
+    # Notify both players (including the current player) of the action
+    # (using their .update() methods).
+    for player in players:
+        await _result(player.update(curr_player.colour, action))
+    if telemetry is not None:
+        telemetry(**record)
 
-        # Next player's turn!
-        curr_player, next_player = next_player, curr_player
+async def _result(value):
+    """Await `value` if it is awaitable, else just return it."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
 
-    # After that loop, the game has ended (one way or another!)
-    return game.end()
+def _run_sync(coroutine):
+    """
+    Run a coroutine which never actually suspends (e.g. play_turn with
+    ordinary players) to completion, without an event loop.
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("coroutine suspended outside of an event loop")
 
 
 
@@ -131,28 +209,27 @@ def _NEAR_SQUARES(square):
             (x-1,y-1),(x,y-1),(x+1,y-1)} & _ALL_SQUARES
 
 _MAX_TURNS = 250 # per player
+
+# Zobrist keys for hashing positions (one random 64-bit key for each possible
+# stack of each colour on each square, and one for the player to move):
+_ZOBRIST_RANDOM = random.Random(GAME_NAME)
+_ZOBRIST_KEYS = {c: {xy: [0] + [_ZOBRIST_RANDOM.getrandbits(64)
+                                for n in range(1, 13)]
+                     for xy in sorted(_ALL_SQUARES)}
+                 for c in COLOURS}
+_ZOBRIST_TURN = _ZOBRIST_RANDOM.getrandbits(64)
  
 
 
 class Game:
     """
     Represent the evolving state of a game. Main useful methods
-    are __init__, update, over, end, and __str__.
+    are __init__, from_position, update, over, end, and __str__.
     """
     def __init__(self, logfilename=None, debugboard=False, unicodeboard=False,
             colourboard=False):
-        # initialise game board state:
-        self.board = Counter({xy: 0 for xy in _ALL_SQUARES})
-        for xy in _WHITE_START_SQUARES:
-            self.board[xy] = +1
-        for xy in _BLACK_START_SQUARES:
-            self.board[xy] = -1
-        # also keep track of some other state variables for win/draw
-        # detection (score, number of turns, state history)
-        self.score = {'white': 12, 'black': 12}
-        self.drawmsg = ""
-        self.nturns  = 0
-        self.history = Counter({self._snap(): 1})
+        self._set_position({xy: 1 for xy in _WHITE_START_SQUARES},
+                           {xy: 1 for xy in _BLACK_START_SQUARES}, 0)
 
         # when we print the board, should we show coordinates?
         if debugboard:
@@ -179,7 +256,48 @@ class Game:
             self._log("game", "Start game log at", time.asctime())
         else:
             self._logfile = None
-        
+
+    @classmethod
+    def from_position(cls, position, **kwargs):
+        """
+        Create a game continuing from a position (a string, see
+        referee.position) instead of the usual start, with the same options
+        as Game(). Raise a referee.position.PositionError if the position is
+        not valid. Repetitions are counted from this position on.
+        """
+        white, black, _, turns = parse_position(position)
+        game = cls(**kwargs)
+        game._set_position(white, black, turns)
+        game._log("game", "Position:", position)
+        return game
+
+    def _set_position(self, white, black, nturns):
+        # initialise game board state, indexed by colour (square -> height)
+        # plus the set of all occupied squares, so that the cost of each turn
+        # depends on the number of stacks rather than the size of the board:
+        self.stacks = {'white': white, 'black': black}
+        self.occupied = set(white) | set(black)
+        # Zobrist hash of the stacks, kept in step with the indexes above:
+        self.hash = 0
+        for c, stacks in self.stacks.items():
+            for xy, n in stacks.items():
+                self.hash ^= _ZOBRIST_KEYS[c][xy][n]
+        # also keep track of some other state variables for win/draw
+        # detection (score, number of turns, state history). The history
+        # counts position hashes, and only since the last BOOM: a BOOM
+        # removes tokens for good, so no earlier position can ever return.
+        self.score = {c: sum(stacks.values())
+                      for c, stacks in self.stacks.items()}
+        self.drawmsg = ""
+        self.nturns  = nturns
+        self.history = Counter({self._snap(): 1})
+
+    def position(self):
+        """The current position as a string (see referee.position)."""
+        return format_position(self.stacks['white'], self.stacks['black'],
+                               COLOURS[self.nturns % 2], self.nturns)
+
+
     def update(self, colour, action):
         """
         Submit an action to the game for validation and application.
@@ -187,8 +305,8 @@ class Game:
         a message describing allowed actions.
         Otherwise, apply the action to the game state.
         """
-        available_actions = self._available_actions(colour)
-        if action not in available_actions:
+        if not self.is_legal(colour, action):
+            available_actions = self._available_actions(colour)
             result = f"illegal action detected ({colour}): {action!r}."
             self._log("error", result)
             # NOTE: The game instance _could_ potentially be recovered, but:
@@ -204,44 +322,117 @@ class Game:
         atype, *aargs = action
         if atype == "MOVE":
             n, a, b = aargs
-            n = -n if self.board[a] < 0 else n
-            self.board[a] -= n
-            self.board[b] += n
+            stacks = self.stacks[colour]
+            keys = _ZOBRIST_KEYS[colour]
+            m = stacks[a]
+            self.hash ^= keys[a][m] ^ keys[a][m-n]
+            if m == n:
+                del stacks[a]
+                self.occupied.discard(a)
+            else:
+                stacks[a] -= n
+            m = stacks.get(b, 0)
+            self.hash ^= keys[b][m] ^ keys[b][m+n]
+            stacks[b] = m + n
+            self.occupied.add(b)
         else: # atype == "BOOM":
             start_square, = aargs
             to_boom = [start_square]
+            self.occupied.discard(start_square)
             for boom_square in to_boom:
-                n = self.board[boom_square]
-                self.score["white" if n > 0 else "black"] -= abs(n)
-                self.board[boom_square] = 0
+                for c, stacks in self.stacks.items():
+                    if boom_square in stacks:
+                        n = stacks.pop(boom_square)
+                        self.score[c] -= n
+                        self.hash ^= _ZOBRIST_KEYS[c][boom_square][n]
+                        break
                 for near_square in _NEAR_SQUARES(boom_square):
-                    if self.board[near_square] != 0:
+                    if near_square in self.occupied:
+                        self.occupied.discard(near_square)
                         to_boom.append(near_square)
-        self._log(colour, _FORMAT_ACTION(action))
+            # no earlier position can be repeated after a BOOM
+            self.history.clear()
+        if self._logfile is not None: # (don't format actions for nothing)
+            self._log(colour, _FORMAT_ACTION(action))
         self._turn_detect_draw()
         # TODO: return a sanitised version of the action?
 
+    def is_legal(self, colour, action):
+        """
+        True iff `action` is one of the currently-available actions for a
+        particular player (the same as `action in _available_actions(colour)`
+        but in constant time, without listing them).
+        """
+        if not isinstance(action, tuple) or not action:
+            return False
+        stacks = self.stacks[colour]
+        try:
+            if action[0] == "BOOM":
+                return len(action) == 2 and isinstance(action[1], tuple) \
+                    and action[1] in stacks
+            if action[0] != "MOVE" or len(action) != 4:
+                return False
+            _, m, a, b = action
+            if not isinstance(a, tuple) or not isinstance(b, tuple) or \
+                    a not in stacks or b not in _ALL_SQUARES:
+                return False
+            n = stacks[a]
+            if m not in range(1, n+1):
+                return False
+            # b must be 1..n squares from a in one of the step directions
+            (ax, ay), (bx, by) = a, b
+            d = abs(bx - ax) + abs(by - ay)
+            if (ax != bx and ay != by) or not 1 <= d <= n:
+                return False
+            return b in stacks or b not in self.occupied
+        except TypeError: # (e.g. unhashable or non-numeric parts)
+            return False
+
     def _available_actions(self, colour):
         """
         A list of currently-available actions for a particular player
         (assists validation).
         """
         available_actions = []
-        if colour == "white":
-            stacks = +self.board
-        else:
-            stacks = -self.board
+        stacks = self.stacks[colour]
         for square in stacks.keys():
             available_actions.append(("BOOM", square))
         for square, n in stacks.items():
             for d in range(1, n+1):
                 for next_square in _NEXT_SQUARES(square, d):
-                    if next_square in stacks or self.board[next_square] == 0:
+                    if next_square in stacks or next_square not in self.occupied:
                         for m in range(1, n+1):
                             move_action = ("MOVE", m, square, next_square)
                             available_actions.append(move_action)
         return available_actions
 
+    def _count_actions(self, colour):
+        """
+        The number of currently-available actions for a particular player
+        (`len(self._available_actions(colour))`, but counted from the stacks
+        without listing the actions): for each stack, a BOOM, plus n MOVEs
+        (of 1 to n tokens) to each square up to n squares away in a line, on
+        the board and not under an opponent's stack.
+        """
+        stacks = self.stacks[colour]
+        # the opponent's stacks in each column and row
+        columns, rows = defaultdict(list), defaultdict(list)
+        for x, y in self.occupied:
+            if (x, y) not in stacks:
+                columns[x].append(y)
+                rows[y].append(x)
+        count = 0
+        for (x, y), n in stacks.items():
+            squares = min(n, x) + min(n, 7 - x) + min(n, y) + min(n, 7 - y)
+            for oy in columns.get(x, ()):
+                if abs(oy - y) <= n:
+                    squares -= 1
+            for ox in rows.get(y, ()):
+                if abs(ox - x) <= n:
+                    squares -= 1
+            count += 1 + n * squares
+        return count
+
     def _turn_detect_draw(self):
         """
         Register that a turn has passed: Update turn counts and 
@@ -258,15 +449,13 @@ class Game:
 
     def _snap(self):
         """
-        Capture the current board state in a hashable way
+        Capture the current board state as a compact hash
         (for repeated-state checking)
         """
-        return (
-            # same colour tokens in the same positions
-            tuple((sq,n) for sq,n in self.board.items() if n),
-            # on the same player's turn
-            self.nturns % 2,
-        )
+        # same colour tokens in the same positions, on the same player's turn
+        if self.nturns % 2:
+            return self.hash ^ _ZOBRIST_TURN
+        return self.hash
 
 
     def over(self):
@@ -300,18 +489,21 @@ class Game:
 
     def __str__(self):
         """Create and return a representation of board for printing."""
-        coords = [(x,7-y) for y in range(8) for x in range(8)] # template order
-        cells = []
-        for square in coords:
-            n = self.board[square]
-            if n > 0:
-                cells.append(self.white_stack_template.format(n=n))
-            elif self.board[square] < 0:
-                cells.append(self.black_stack_template.format(n=-n))
-            else: # n == 0:
-                cells.append("   ")
-        score_str = "white: {white}, black: {black}".format(**self.score)
-        return self.board_template.format(score_str, *cells)
+        return self.board_template.format(self._score_str(), *self._cells())
+
+    def render(self, renderer):
+        """Draw the board with a renderer (see referee.render)."""
+        renderer.render(self.board_template, self._score_str(), self._cells())
+
+    def _cells(self):
+        cells = ["   "] * 64 # template order: (x, y) is at index x + 8*(7-y)
+        for (x, y), n in self.stacks['white'].items():
+            cells[x + 8*(7-y)] = self.white_stack_template.format(n=n)
+        for (x, y), n in self.stacks['black'].items():
+            cells[x + 8*(7-y)] = self.black_stack_template.format(n=n)
+        return cells
+    def _score_str(self):
+        return "white: {white}, black: {black}".format(**self.score)
 
     def _log(self, header, *messages):
         """Helper method to add a message to the logfile"""
@@ -4,29 +4,71 @@ with uniform formatting accross multiple parts of a program
 """
 
 import sys
+import queue
+import threading
+
+QUEUE_SIZE = 1 << 10 # messages to queue (in buffered mode) before dropping
+                     # commentary (other messages wait for room instead)
 
 class StarLog:
     def __init__(self, level=1, file=sys.stdout, timefn=None,
-                star='*', pad='  ', ansi=False):
-        self.level = level
+                star='*', pad='  ', ansi=False, buffered=False):
         self.timefn = timefn
         self.star = star
         self.pad = pad
+        self.file = file
         self.kwargs = {"file": file, "flush": True}
         if ansi:
             self.clear = "\033[H\033[2J" # ANSI code to clear the terminal
-        else:   
+        else:
             self.clear = ""
+        self.level = level
+
+        # in buffered mode, messages are written by a background thread
+        self.queue = None
+        if buffered:
+            self.queue = queue.Queue(QUEUE_SIZE)
+            self.dropped = 0 # (shared with the writer thread, under lock)
+            self.lock = threading.Lock()
+            self.thread = threading.Thread(target=self._write, daemon=True)
+            self.thread.start()
+
+    @property
+    def level(self):
+        return self._level
+    @level.setter
+    def level(self, level):
+        # replace shortcuts for messages that are too verbose with no-ops
+        self._level = level
+        for method, method_level in StarLog._SHORTCUTS.items():
+            if method_level > level:
+                setattr(self, method, _null)
+            else:
+                self.__dict__.pop(method, None)
 
     # log
-    def log(self, *args, level=None, depth=0, clear=False, **kwargs):
-        """Log a message if warranted by this log's verbosity level setting."""
+    def log(self, *args, level=None, depth=0, clear=False, keep=False,
+            **kwargs):
+        """
+        Log a message if warranted by this log's verbosity level setting.
+        Arguments which are functions (e.g. a `.status` method) are called to
+        produce the message, only if it will be logged. If the first argument
+        is a string containing '%' and there are others, they are formatted
+        into it %-style (also only if the message will be logged).
+        In buffered mode, commentary (level 1 and above) is dropped if the
+        queue is full, unless `keep` is set (e.g. for errors): other messages
+        wait for the writer to catch up.
+        """
         # skip messages that are too verbose
-        if level is not None and level > self.level:
+        if level is not None and level > self._level:
             return
         # combine the message components
         sep = kwargs.get('sep', ' ')
-        msg = sep.join(map(str, args))
+        args = [arg() if callable(arg) else arg for arg in args]
+        if len(args) > 1 and isinstance(args[0], str) and '%' in args[0]:
+            msg = args[0] % tuple(args[1:])
+        else:
+            msg = sep.join(map(str, args))
         # skip empty messages
         if not msg:
             return
@@ -39,8 +81,43 @@ class StarLog:
             start = self.clear + start
         if self.timefn is not None:
             start += sep + f"[{self.timefn()}]"
-        for line in msg.splitlines():
-            print(start, line, **kwargs, **self.kwargs)
+        end = kwargs.get('end', '\n')
+        text = "".join(start + sep + line + end for line in msg.splitlines())
+        if self.queue is None:
+            print(text, end="", **self.kwargs)
+        elif keep or level is None or level < 1:
+            self.queue.put(text)
+        else:
+            try:
+                self.queue.put_nowait(text)
+            except queue.Full:
+                # don't block the caller for commentary: drop the message
+                # (and say so)
+                with self.lock:
+                    self.dropped += 1
+
+    def close(self):
+        """In buffered mode, finish writing all queued messages."""
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+
+    def _write(self):
+        write = self.file.write
+        while True:
+            text = self.queue.get()
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                write(f"{self.star} ({dropped} messages dropped)\n")
+            if text is None:
+                break
+            write(text)
+            # flush whenever we catch up
+            if self.queue.empty():
+                self.file.flush()
+        self.file.flush()
 
     # shortcuts
     def print(self, *args, **kwargs):
@@ -54,3 +131,8 @@ class StarLog:
     def debug(self, *args, **kwargs):
         """Shortcut to log at level 2 (debug)."""
         self.log(*args, level=2, **kwargs)
+
+    _SHORTCUTS = {"print": 0, "comment": 1, "debug": 2}
+
+def _null(*args, **kwargs):
+    """A log shortcut for messages which are too verbose (costs nothing)."""
@@ -0,0 +1,415 @@
+"""
+Decide whether one player is stronger than another, in as few games as the
+evidence allows, with a sequential probability ratio test (SPRT).
+
+Games are played in pairs from the same opening, with each player taking
+each colour once. Each pair's opening is a few random MOVEs from the start
+(seeded by the pair's index, so a resumed match replays the same openings),
+so that pairs between near-deterministic players are different games, not
+the same game again, and each pair is a separate sample for the test. The
+position each pair starts from (see referee.position) is recorded with its
+results. Many games are played in parallel (each in a fresh process
+forked from one with both players already loaded, see referee.forkserver,
+with the usual time and space limits on each player). After each
+pair, the SPRT weighs the hypotheses that player A is elo0 Elo stronger than
+player B (H0, e.g. no better) or elo1 Elo stronger (H1, e.g. a worthwhile
+improvement): the match stops as soon as the log-likelihood ratio (LLR)
+crosses either bound given by the error rates alpha (of accepting H1 when H0
+is true) and beta (the reverse).
+
+The LLR uses the normal approximation for the score of each pair (0, 1/4,
+1/2, 3/4 or 1 for player A; paired scores vary less than single games, since
+each pair cancels out most of the advantage of playing first):
+
+    LLR = n (s1 - s0) (2 m - s0 - s1) / (2 v)
+
+where n is the number of pairs, m and v are the mean and variance of their
+scores (with half a pair added to each possible score, so that v is never
+0), and s0 and s1 are the expected scores for elo0 and elo1.
+
+Each finished pair is appended to the results file (JSON lines, after a line
+recording the players and test), so an interrupted match can be resumed by
+running the same command again: the pairs already played count, and play
+continues from there.
+
+usage: python -m referee.match [-h] [-j JOBS] [-t TIME] [-s SPACE]
+                               [-n PAIRS] [-p PLIES] [--elo0 ELO0]
+                               [--elo1 ELO1] [--alpha ALPHA] [--beta BETA]
+                               [-r RESULTS]
+                               A B
+"""
+
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import concurrent.futures
+
+from referee.game import Game, play_turn, _run_sync, COLOURS, \
+    IllegalActionException
+from referee.player import PlayerWrapper, ResourceLimitException, \
+    set_space_line
+from referee.options import PackageSpecAction
+from referee.forkserver import ForkServer
+
+PAIR_SCORES = (0, 0.25, 0.5, 0.75, 1)   # player A's score for a pair
+PRIOR = 0.5     # pairs added to each pair score (so the variance isn't 0)
+OPENING_PLIES = 4   # random MOVEs from the start before each pair's games
+
+
+# Openings:
+
+def opening(pair, plies=OPENING_PLIES):
+    """
+    The opening for a pair of games: `plies` random MOVEs (no BOOMs, so
+    neither player is ahead) from the start, chosen the same way for the
+    same pair every time. Return the actions, as (colour, action) pairs,
+    and the position they lead to.
+    """
+    rng = random.Random(f"referee.match:{pair}")
+    game = Game()
+    actions = []
+    for _ in range(plies):
+        colour = COLOURS[game.nturns % 2]
+        moves = sorted(action for action in game._available_actions(colour)
+                       if action[0] == "MOVE")
+        action = rng.choice(moves)
+        game.update(colour, action)
+        actions.append((colour, action))
+    return actions, game.position()
+
+
+# Playing games (in worker processes):
+
+class PlayerError(Exception):
+    """For when a player raises an error (other than running out of
+    resources), recording which player."""
+    def __init__(self, player, error):
+        super().__init__(f"{player.name} raised "
+                         f"{type(error).__name__}: {error}")
+        self.player = player
+
+class _MatchPlayerWrapper(PlayerWrapper):
+    """
+    A PlayerWrapper raising a PlayerError for any error the player raises,
+    so that it loses the game rather than stopping the match, and tagging
+    any ResourceLimitException with the player (as its `player` attribute),
+    since it may not be the player whose turn it is.
+    """
+    def init(self, colour):
+        return self._call(super().init, colour)
+
+    def action(self):
+        return self._call(super().action)
+
+    def update(self, colour, action):
+        return self._call(super().update, colour, action)
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except ResourceLimitException as e:
+            e.player = self
+            raise
+        except Exception as e:
+            raise PlayerError(self, e) from e
+
+def play_game(white_loc, black_loc, time_limit=0, space_limit=0,
+        gc_policy="always", opening=()):
+    """
+    Play a game between two Player classes, after the `opening` actions (as
+    (colour, action) pairs, given to both players as updates), returning a
+    dictionary with the result, the winning colour (None for a draw), the
+    number of turns, and each player's CPU time. A player who fails (with an
+    invalid action, by exceeding a resource limit, or by raising an error)
+    loses.
+    """
+    game = Game()
+    players = [_MatchPlayerWrapper(f"player {num}", loc,
+                                   time_limit=time_limit,
+                                   space_limit=space_limit,
+                                   gc_policy=gc_policy)
+               for num, loc in enumerate((white_loc, black_loc), 1)]
+    curr_player = players[0]
+    try:
+        for player, colour in zip(players, COLOURS):
+            curr_player = player
+            player.init(colour)
+        for colour, action in opening:
+            game.update(colour, action)
+            for player in players:
+                curr_player = player
+                player.update(colour, action)
+        curr_player, next_player = players
+        if game.nturns % 2:
+            curr_player, next_player = next_player, curr_player
+        while not game.over():
+            _run_sync(play_turn(game, curr_player, players))
+            curr_player, next_player = next_player, curr_player
+        result = game.end()
+        winner = result[len("winner: "):] \
+            if result.startswith("winner: ") else None
+    except IllegalActionException:
+        result = f"error: invalid action by {curr_player.name}"
+        winner = COLOURS[curr_player.colour == "white"]
+    except (ResourceLimitException, PlayerError) as e:
+        # (the player at fault may not be the current player, e.g. when
+        # updating the other player with the current player's action)
+        result = f"error: {e}"
+        winner = COLOURS[e.player.colour == "white"]
+    return {
+        "result": result,
+        "winner": winner,
+        "turns": game.nturns,
+        "time": {c: round(p.timer.clock, 6) for c, p in zip(COLOURS, players)},
+    }
+
+
+# The test:
+
+def elo_score(elo):
+    """The expected score of a player `elo` Elo stronger than another."""
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def score_elo(score):
+    """The Elo difference for an expected score (inverse of elo_score)."""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+class SPRT:
+    """
+    The sequential probability ratio test of H0 (A is elo0 Elo stronger than
+    B) against H1 (elo1 Elo stronger), on the counts of each pair score.
+    """
+    def __init__(self, elo0=0, elo1=10, alpha=0.05, beta=0.05):
+        self.elo0, self.elo1 = elo0, elo1
+        self.lower = math.log(beta / (1 - alpha))   # accept H0 below this
+        self.upper = math.log((1 - beta) / alpha)   # accept H1 above this
+        self.counts = [0] * len(PAIR_SCORES)
+
+    def add(self, pair_score):
+        self.counts[PAIR_SCORES.index(pair_score)] += 1
+
+    def pairs(self):
+        return sum(self.counts)
+
+    def _mean_variance(self):
+        counts = [count + PRIOR for count in self.counts]
+        n = sum(counts)
+        mean = sum(c * s for c, s in zip(counts, PAIR_SCORES)) / n
+        variance = sum(c * (s - mean) ** 2
+                       for c, s in zip(counts, PAIR_SCORES)) / n
+        return mean, variance
+
+    def score(self):
+        """A's mean score per game so far (None before any pairs)."""
+        if not self.pairs():
+            return None
+        return sum(c * s for c, s in zip(self.counts, PAIR_SCORES)) / \
+            self.pairs()
+
+    def llr(self):
+        mean, variance = self._mean_variance()
+        s0, s1 = elo_score(self.elo0), elo_score(self.elo1)
+        return self.pairs() * (s1 - s0) * (2 * mean - s0 - s1) / \
+            (2 * variance)
+
+    def decision(self):
+        """"H0" or "H1" once accepted, otherwise None."""
+        llr = self.llr()
+        if llr <= self.lower:
+            return "H0"
+        if llr >= self.upper:
+            return "H1"
+        return None
+
+
+# Running a match:
+
+class Match:
+    """
+    A match between players A and B (package specifications, see
+    referee.options), with its SPRT, recording each finished pair of games
+    (as a JSON line) in a results file, which it first reads to resume.
+    """
+    def __init__(self, a_loc, b_loc, sprt, path, plies=OPENING_PLIES,
+                 **limits):
+        self.locs = {"A": a_loc, "B": b_loc}
+        self.sprt = sprt
+        self.path = path
+        self.plies = plies
+        self.limits = limits
+        self.header = {
+            "type": "match",
+            "A": ":".join(a_loc),
+            "B": ":".join(b_loc),
+            "elo0": sprt.elo0, "elo1": sprt.elo1,
+            "opening_plies": plies,
+            "limits": limits,
+        }
+        self.done = set()   # indices of the finished pairs
+        self.games = {"A": 0, "draw": 0, "B": 0}
+        self._resume()
+
+    def _resume(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            with open(self.path, "w") as f:
+                print(json.dumps(self.header), file=f)
+            return
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        if json.loads(lines[0]) != self.header:
+            raise ValueError(f"{self.path} holds the results of a different "
+                "match (players, test, openings or limits)")
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # (a line cut short by an interruption)
+            self._count(record)
+
+    def _count(self, record):
+        self.done.add(record["pair"])
+        self.sprt.add(record["score"])
+        for game in record["games"]:
+            self.games[game["winner"] or "draw"] += 1
+
+    def record(self, pair, games, start):
+        """Record a finished pair of games (A as white, then as black), from
+        the position `start`."""
+        for game, (white, black) in zip(games, (("A", "B"), ("B", "A"))):
+            game["white"], game["black"] = white, black
+            game["winner"] = {"white": white, "black": black,
+                              None: None}[game["winner"]]
+        score = sum({"A": 1, None: 0.5, "B": 0}[game["winner"]]
+                    for game in games) / 2
+        record = {"pair": pair, "start": start, "score": score,
+                  "games": games}
+        with open(self.path, "a") as f:
+            print(json.dumps(record), file=f)
+        self._count(record)
+
+    def status(self):
+        score = self.sprt.score()
+        return (f"{self.sprt.pairs()} pairs, A +{self.games['A']} "
+                f"={self.games['draw']} -{self.games['B']}, score {score:.3f} "
+                f"(Elo {score_elo(score):+.1f}), LLR {self.sprt.llr():.3f} "
+                f"[{self.sprt.lower:.3f}, {self.sprt.upper:.3f}]")
+
+    def run(self, jobs, max_pairs=None, out=print):
+        """
+        Play pairs of games, `jobs` games at a time, until the SPRT decides
+        (or `max_pairs` pairs have been played). Return the decision (or
+        None).
+        """
+        decision = self.sprt.decision()
+        if decision is not None:
+            return decision
+        if hasattr(os, "fork"):
+            executor = ForkServer(jobs, self.locs.values(),
+                                  initializer=set_space_line)
+        else: # (no fork server on this platform: reuse worker processes)
+            executor = concurrent.futures.ProcessPoolExecutor(jobs,
+                initializer=set_space_line)
+        unplayed = (i for i in range(max_pairs or sys.maxsize)
+                    if i not in self.done)
+        pending = {}    # future -> (pair, 0 or 1)
+        finished = {}   # pair -> [game, game]
+        starts = {}     # pair -> its starting position
+        try:
+            while decision is None:
+                # keep every worker busy (both games of a pair at once)
+                while len(pending) < jobs:
+                    pair = next(unplayed, None)
+                    if pair is None:
+                        break
+                    actions, starts[pair] = opening(pair, self.plies)
+                    for i, (white, black) in enumerate((("A", "B"),
+                                                        ("B", "A"))):
+                        future = executor.submit(play_game, self.locs[white],
+                                                 self.locs[black],
+                                                 opening=actions,
+                                                 **self.limits)
+                        pending[future] = (pair, i)
+                if not pending:
+                    break
+                done, _ = concurrent.futures.wait(pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pair, i = pending.pop(future)
+                    games = finished.setdefault(pair, [None, None])
+                    games[i] = future.result()
+                    if None not in games:
+                        del finished[pair]
+                        self.record(pair, games, starts.pop(pair))
+                        out(f"pair {pair + 1}: {self.status()}")
+                        decision = self.sprt.decision()
+                        if decision is not None:
+                            break
+        finally:
+            # (games still being played are abandoned)
+            executor.shutdown(wait=False, cancel_futures=True)
+        return decision
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="referee.match",
+        description="play pairs of games between two Player classes until "
+            "a sequential probability ratio test decides whether A is "
+            "stronger than B.")
+    parser.add_argument('a_loc', metavar='A', action=PackageSpecAction,
+        help="location of player A's Player class (e.g. a new version; "
+            "as for python -m referee).")
+    parser.add_argument('b_loc', metavar='B', action=PackageSpecAction,
+        help="location of player B's Player class (e.g. the old version).")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help="games to play at once (default: one per CPU).")
+    parser.add_argument('-t', '--time', type=float, default=60.0,
+        help="limit on CPU time (float, seconds) for each player, per game "
+            "(default: 60; 0 for no limit).")
+    parser.add_argument('-s', '--space', type=float, default=0,
+        help="limit on memory space (float, MB) for each player.")
+    parser.add_argument('-n', '--pairs', type=int, default=None,
+        help="stop after this many pairs of games, even if undecided.")
+    parser.add_argument('-p', '--plies', type=int, default=OPENING_PLIES,
+        help="random MOVEs from the start to open each pair of games with "
+            f"(default: {OPENING_PLIES}).")
+    parser.add_argument('--elo0', type=float, default=0,
+        help="Elo difference of H0 (default: 0).")
+    parser.add_argument('--elo1', type=float, default=10,
+        help="Elo difference of H1 (default: 10).")
+    parser.add_argument('--alpha', type=float, default=0.05,
+        help="probability of accepting H1 if H0 is true (default: 0.05).")
+    parser.add_argument('--beta', type=float, default=0.05,
+        help="probability of accepting H0 if H1 is true (default: 0.05).")
+    parser.add_argument('-r', '--results', default="match.jsonl",
+        help="file to record finished pairs in, and to resume from "
+            "(default: match.jsonl).")
+    args = parser.parse_args()
+
+    sprt = SPRT(args.elo0, args.elo1, args.alpha, args.beta)
+    try:
+        match = Match(args.a_loc, args.b_loc, sprt, args.results,
+                      args.plies, time_limit=args.time,
+                      space_limit=args.space)
+    except ValueError as e:
+        print(f"error: {e}")
+        return 1
+    if sprt.pairs():
+        print(f"resuming: {match.status()}")
+    try:
+        decision = match.run(max(args.jobs, 1), args.pairs)
+    except KeyboardInterrupt:
+        print(f"\ninterrupted: run again with -r {args.results} to resume.")
+        return 1
+    if decision is None:
+        print("undecided.")
+    else:
+        elo = {"H0": args.elo0, "H1": args.elo1}[decision]
+        print(f"{decision} accepted: A is about {elo:+g} Elo against B.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
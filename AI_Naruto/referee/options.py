@@ -4,7 +4,8 @@ Provide a command-line argument parsing function using argparse
 
 --------------------------------------------------------------------------------
 usage: referee [-h] [-V] [-d [delay]] [-s [space_limit]] [-t [time_limit]]
-               [-D | -v [{0,1,2,3}]] [-l [LOGFILE]] [-c | -C] [-u | -a]
+               [-x] [-g policy] [-m meter] [-D | -v [{0,1,2,3}]] [-b]
+               [-r [fps]] [-T file] [-l [LOGFILE]] [-c | -C] [-u | -a]
                white black
 
 conducts a game of Expendibots between 2 Player classes.
@@ -40,6 +41,21 @@ optional arguments:
                         limit on memory space (float, MB) for each player.
   -t [time_limit], --time [time_limit]
                         limit on CPU time (float, seconds) for each player.
+  -x, --sandbox         run each player in a separate process (with its own
+                        time and space limits) instead of in the referee's
+                        process.
+  -g policy, --gc policy
+                        when to collect garbage (off the clock) before each
+                        call to a player. always: (default) before every call;
+                        every:N: before every Nth call; threshold:MB: when
+                        memory usage has grown by MB; freeze: before
+                        initialising each player, then freeze all objects.
+  -m meter, --memory meter
+                        how to measure each player's memory usage. statm:
+                        (default) resident memory, shared by both players
+                        (linux); rusage: peak resident memory only (unix);
+                        status: virtual memory (linux); tracemalloc: memory
+                        allocated by each player's package (slow).
   -D, --debug           switch to printing the debug board (with coordinates)
                         (equivalent to -v or -v3).
   -v [{0,1,2,3}], --verbosity [{0,1,2,3}]
@@ -48,6 +64,19 @@ optional arguments:
                         but no board display; 2: (default) commentary and board
                         display; 3: (equivalent to -D) larger board showing
                         coordinates.
+  -b, --buffered        write output from a background thread, so that the
+                        game never waits for it (output from players may then
+                        appear out of order with it; ignored when waiting for
+                        user input).
+  -r [fps], --redraw [fps]
+                        keep the board in place at the top of the terminal,
+                        redrawing only the squares which change, at most fps
+                        times per second (default 30; 0: every turn). Uses
+                        ANSI control sequences.
+  -T file, --telemetry file
+                        append structured records of each turn (time, space,
+                        available actions and any metrics reported by the
+                        players) to this file as JSON lines.
   -l [LOGFILE], --logfile [LOGFILE]
                         if you supply this flag the referee will create a log of
                         all game actions in a text file named LOGFILE (default:
@@ -65,6 +94,8 @@ optional arguments:
 import sys
 import argparse
 from referee.game import GAME_NAME, COLOURS, NUM_PLAYERS
+from referee.player import gc_policy, SPACE_METERS
+from referee.render import FPS_DEFAULT
 
 # Program information:
 PROGRAM = "referee"
@@ -92,10 +123,18 @@ SPACE_LIMIT_NOVALUE = 100.0 # MB (each)
 TIME_LIMIT_DEFAULT  = 0     # signifying no limit
 TIME_LIMIT_NOVALUE  = 60.0  # seconds (each)
 
+GC_POLICY_DEFAULT = "always" # strict accounting
+SPACE_METER_DEFAULT = "statm"
+
 VERBOSITY_LEVELS  = 4
 VERBOSITY_DEFAULT = 2 # normal level, normal board
 VERBOSITY_NOVALUE = 3 # highest level, debug board
 
+REDRAW_DEFAULT = None # signifying no redrawing in place
+REDRAW_NOVALUE = FPS_DEFAULT
+
+TELEMETRY_DEFAULT = None
+
 LOGFILE_DEFAULT = None
 LOGFILE_NOVALUE = "game.log"
 
@@ -158,6 +197,23 @@ def get_options():
         type=float, nargs="?",
         default=TIME_LIMIT_DEFAULT, const=TIME_LIMIT_NOVALUE,
         help="limit on CPU time (float, seconds) for each player.")
+    optionals.add_argument('-x', '--sandbox',
+        action="store_true",
+        help="run each player in a separate process (with its own time and "
+            "space limits) instead of in the referee's process.")
+    optionals.add_argument('-g', '--gc', metavar="policy",
+        type=gc_policy, default=GC_POLICY_DEFAULT,
+        help="when to collect garbage (off the clock) before each call to a "
+            "player. always: (default) before every call; every:N: before "
+            "every Nth call; threshold:MB: when memory usage has grown by MB; "
+            "freeze: before initialising each player, then freeze all "
+            "objects.")
+    optionals.add_argument('-m', '--memory', metavar="meter",
+        choices=SPACE_METERS, default=SPACE_METER_DEFAULT,
+        help="how to measure each player's memory usage. statm: (default) "
+            "resident memory, shared by both players (linux); rusage: peak "
+            "resident memory only (unix); status: virtual memory (linux); "
+            "tracemalloc: memory allocated by each player's package (slow).")
 
     verbosity_group = optionals.add_mutually_exclusive_group()
     verbosity_group.add_argument('-D', '--debug',
@@ -171,6 +227,24 @@ def get_options():
             "players). 0: no output except result; 1: commentary, but no"
             " board display; 2: (default) commentary and board display; "
             "3: (equivalent to -D) larger board showing coordinates.")
+    optionals.add_argument('-b', '--buffered',
+        action="store_true",
+        help="write output from a background thread, so that the game never "
+            "waits for it (output from players may then appear out of order "
+            "with it; ignored when waiting for user input).")
+    optionals.add_argument('-r', '--redraw', metavar="fps",
+        type=float, nargs='?',
+        default=REDRAW_DEFAULT, const=REDRAW_NOVALUE,
+        help="keep the board in place at the top of the terminal, redrawing "
+            "only the squares which change, at most fps times per second "
+            f"(default {REDRAW_NOVALUE:g}; 0: every turn). Uses ANSI control "
+            "sequences.")
+
+    optionals.add_argument('-T', '--telemetry', metavar="file",
+        type=str, default=TELEMETRY_DEFAULT,
+        help="append structured records of each turn (time, space, "
+            "available actions and any metrics reported by the players) to "
+            "this file as JSON lines.")
 
     optionals.add_argument('-l', '--logfile', 
         type=str, nargs='?',
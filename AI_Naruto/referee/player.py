@@ -5,8 +5,14 @@ being executed, etc.
 """
 
 import gc
+import os
 import time
 import importlib
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    resource = None # (not available on windows)
 
 from referee.game import NUM_PLAYERS
 
@@ -17,53 +23,70 @@ class PlayerWrapper:
     * `.init()` method constructs the Player instance (calling `.__init__()`)
     * `.action()` and `.update()` methods just delegate to the real Player's
       methods of the same name.
+    * `.metrics()` method returns the real Player's engine metrics, if it
+      provides any (see referee.telemetry).
+    * `.close()` method does nothing (there is no process to shut down, see
+      referee.sandbox), so both wrappers can be closed the same way.
     Each method enforces resource limits on the real Player's computation.
     """
     def __init__(self, name, player_loc, time_limit=None, space_limit=None,
-            logfn=None):
+            logfn=None, gc_policy="always"):
         self.log = logfn if logfn else (lambda *_, **__: None) # no-op
         self.name = name
         
         # create some context managers for resource limiting
-        self.timer = _CountdownTimer(time_limit, self.name)
-        if space_limit is not None: space_limit *= NUM_PLAYERS
-        self.space = _MemoryWatcher(space_limit)
+        self.timer = _CountdownTimer(time_limit, self.name,
+            _GarbageCollector(gc_policy))
         
         # import the Player class from given package
         player_pkg, player_cls = player_loc
-        self.log(f"importing {self.name}'s player class '{player_cls}' "
-            f"from package '{player_pkg}'")
+        self.log("importing %s's player class '%s' from package '%s'",
+            self.name, player_cls, player_pkg)
         self.Player = _load_player_class(player_pkg, player_cls)
 
+        # (and measure space used by code in the player's top-level package)
+        top_package = importlib.import_module(player_pkg.split('.')[0])
+        self.space = _MemoryWatcher(space_limit, self.name,
+            os.path.dirname(os.path.abspath(top_package.__file__)))
+
     def init(self, colour):
         self.colour = colour
         self.name += f' ({colour})'
         player_cls = str(self.Player).strip('<class >')
-        self.log(f"initialising {self.colour} player as a {player_cls}")
+        self.log("initialising %s player as a %s", self.colour, player_cls)
         with self.space, self.timer:
             # construct/initialise the player class
             self.player = self.Player(colour)
-        self.log(self.timer.status(), depth=1)
-        self.log(self.space.status(), depth=1)
+        self.timer.collector.initialised()
+        self.log(self.timer.status, depth=1)
+        self.log(self.space.status, depth=1)
 
     def action(self):
-        self.log(f"asking {self.name} for next action...")
+        self.log("asking %s for next action...", self.name)
         with self.space, self.timer:
             # ask the real player
             action = self.player.action()
-        self.log(f"{self.name} returned action: {action!r}", depth=1)
-        self.log(self.timer.status(), depth=1)
-        self.log(self.space.status(), depth=1)
+        self.log("%s returned action: %r", self.name, action, depth=1)
+        self.log(self.timer.status, depth=1)
+        self.log(self.space.status, depth=1)
         # give back the result
         return action
 
     def update(self, colour, action):
-        self.log(f"updating {self.name} with {colour}'s action {action}...")
+        self.log("updating %s with %s's action %s...", self.name, colour,
+            action)
         with self.space, self.timer:
             # forward to the real player
             self.player.update(colour, action)
-        self.log(self.timer.status(), depth=1)
-        self.log(self.space.status(), depth=1)
+        self.log(self.timer.status, depth=1)
+        self.log(self.space.status, depth=1)
+
+    def metrics(self):
+        metrics = getattr(self.player, "metrics", None)
+        return metrics() if metrics is not None else None
+
+    def close(self):
+        pass
 
 def _load_player_class(package_name, class_name):
     """
@@ -80,15 +103,85 @@ class ResourceLimitException(Exception):
     """For when players exceed specified time / space limits."""
 
 
+class _GarbageCollector:
+    """
+    Collects garbage (off the clock) before timed sections of code, according
+    to a policy, keeping track of the time spent doing so. Policies:
+
+    * 'always': collect before every section (strict accounting, but slow)
+    * 'every:N': collect before every Nth section
+    * 'threshold:MB': collect when memory usage has grown by MB since the
+      last collection (if memory usage can't be measured, always collect)
+    * 'freeze': collect before and freeze all objects (with gc.freeze, if
+      available) after initialising the player, then leave the rest to
+      Python's automatic collection
+    """
+    def __init__(self, policy="always"):
+        self.policy = policy
+        mode, _, arg = policy.partition(":")
+        self.mode = mode
+        self.every = int(arg) if mode == "every" else 1
+        self.threshold = float(arg) if mode == "threshold" else 0
+        self.calls = 0
+        self.last_usage = None
+        self.clock = 0
+
+    def collect(self):
+        """Maybe collect garbage (before a timed section)."""
+        start = time.process_time()
+        self.calls += 1
+        if self.mode == "threshold":
+            curr_usage = None
+            if _SPACE_METER is not None:
+                curr_usage = _SPACE_METER.usage()
+            if curr_usage is None or self.last_usage is None \
+                    or curr_usage - self.last_usage >= self.threshold:
+                gc.collect()
+                self.last_usage = curr_usage
+        elif self.mode == "freeze":
+            if self.calls == 1:
+                gc.collect()
+        elif self.calls % self.every == 0:
+            gc.collect()
+        self.clock += time.process_time() - start
+
+    def initialised(self):
+        """Register that the player has been initialised."""
+        if self.mode == "freeze" and hasattr(gc, "freeze"):
+            start = time.process_time()
+            gc.collect()
+            gc.freeze()
+            self.clock += time.process_time() - start
+
+def gc_policy(policy):
+    """
+    Validate a garbage collection policy string (see _GarbageCollector),
+    for use as an argparse type.
+    """
+    mode, _, arg = policy.partition(":")
+    try:
+        if mode in ("always", "freeze") and not arg:
+            return policy
+        if mode == "every" and int(arg) > 0:
+            return policy
+        if mode == "threshold" and float(arg) >= 0:
+            return policy
+    except ValueError:
+        pass
+    raise ValueError(f"invalid garbage collection policy: {policy!r}")
+
+
 class _CountdownTimer:
     """
     Reusable context manager for timing specific sections of code
 
     * measures CPU time, not wall-clock time
+    * collects garbage before each section (off the clock) according to a
+      policy (see _GarbageCollector), reporting time spent doing so separately
     * unless time_limit is 0, throws an exception upon exiting the context after
       the allocated time has passed
     """
-    def __init__(self, time_limit, name):
+    def __init__(self, time_limit, name, collector=None):
         """
         Create a new countdown timer with time limit `limit`, in seconds
         (0 for unlimited time)
@@ -96,25 +189,37 @@ class _CountdownTimer:
         self.name  = name
         self.limit = time_limit
         self.clock = 0
-        self._status = ""
-    def _set_status(self, status):
+        self.elapsed = 0
+        self.collector = collector if collector else _GarbageCollector()
+        self._status = ("",)
+    def _set_status(self, *status):
+        # (a format string and its arguments, only formatted if logged)
         self._status = status
     def status(self):
-        return self._status
+        status_format, *args = self._status
+        return status_format.format(*args)
     
     def __enter__(self):
         # clean up memory off the clock
-        gc.collect()
+        self.collector.collect()
         # then start timing
         self.start = time.process_time()
         return self # unused
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         # accumulate elapsed time since __enter__
-        elapsed = time.process_time() - self.start
+        self.charge(time.process_time() - self.start)
+
+    def charge(self, elapsed):
+        """
+        Accumulate `elapsed` seconds of CPU time (e.g. as measured by a
+        player running in another process)
+        """
         self.clock += elapsed
-        self._set_status(f"time:  +{elapsed:6.3f}s  (just elapsed)  "
-            f"{self.clock:7.3f}s  (game total)")
+        self.elapsed = elapsed
+        self._set_status("time:  +{:6.3f}s  (just elapsed)  "
+            "{:7.3f}s  (game total)  {:7.3f}s  (collecting garbage)",
+            elapsed, self.clock, self.collector.clock)
 
         # if we are limited, let's hope we aren't out of time!
         if self.limit is not None and self.limit > 0 and self.clock > self.limit:
@@ -122,43 +227,203 @@ class _CountdownTimer:
 
 class _MemoryWatcher:
     """
-    Context manager for clearing memory before and measuring memory usage
-    after using a specific section of code.
+    Context manager for measuring memory usage before and after using a
+    specific section of code.
 
-    * works by parsing procfs; only available on linux.
+    * measures using the space meter chosen with set_space_line()
+    * reports the change in usage over each section, and current and peak
+      usage: shared by all players in this process, unless measured for each
+      player (in 'tracemalloc' mode, or by a player in another process)
     * unless the limit is set to 0, throws an exception upon exiting the
       context if the memory limit has been breached
     """
-    def __init__(self, space_limit):
+    def __init__(self, space_limit, name=None, package=None):
+        """
+        Create a new memory watcher with limit `space_limit`, in MB (0 for
+        unlimited space), for the named player. `package` is the directory of
+        the player's package, if the player is running in this process (and
+        its usage is recorded by this watcher), or None if its usage will be
+        recorded from elsewhere.
+        """
         self.limit = space_limit
-        self._status = ""
-    def _set_status(self, status):
+        self.name = name
+        self.package = package
+        self.curr_usage = 0
+        self.peak_usage = 0
+        self._status = ("",)
+    def _set_status(self, *status):
+        # (a format string and its arguments, only formatted if logged)
         self._status = status
     def status(self):
-        return self._status
+        status_format, *args = self._status
+        return status_format.format(*args)
+
+    def _meter(self):
+        if self.package is not None and _SPACE_METER.per_package:
+            return _SPACE_METER.for_package(self.package)
+        return _SPACE_METER
+    def _shared(self):
+        return self.package is not None and not _SPACE_METER.per_package
     
     def __enter__(self):
+        if _SPACE_METER is not None:
+            self.before = self._meter().start()
         return self # unused
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
-        Check up on the current and peak space usage of the process, printing
-        stats and ensuring that peak usage is not exceeding limits
+        Check up on the current and peak space usage, printing stats and
+        ensuring that peak usage is not exceeding limits
         """
-        if _SPACE_ENABLED:
-            curr_usage, peak_usage = _get_space_usage()
-    
-            # adjust measurements to reflect usage of players and referee, not
-            # the Python interpreter itself
-            curr_usage -= _DEFAULT_MEM_USAGE
-            peak_usage -= _DEFAULT_MEM_USAGE
+        if _SPACE_METER is not None:
+            curr_usage, peak_usage = self._meter().stop()
+            self.record(curr_usage, peak_usage, curr_usage - self.before)
+
+    def record(self, curr_usage, peak_usage, change=None):
+        """
+        Report current and peak space usage (in MB, e.g. as measured by a
+        player running in another process), and the change in usage since
+        the last report (unless given), ensuring that peak usage is not
+        exceeding limits
+        """
+        if change is None:
+            change = curr_usage - self.curr_usage
+        self.curr_usage = curr_usage
+        self.peak_usage = max(self.peak_usage, peak_usage)
+        shared = " (shared)" if self._shared() else ""
+        self._set_status("space: {:+7.3f}MB (just allocated) "
+            "{:7.3f}MB (current usage) {:7.3f}MB (max usage){}",
+            change, curr_usage, self.peak_usage, shared)
+
+        # if we are limited, let's hope we are not out of space!
+        if self.limit is not None and self.limit > 0:
+            if self._shared():
+                if self.peak_usage > self.limit * NUM_PLAYERS:
+                    raise ResourceLimitException("players exceeded shared "
+                        "space limit")
+            elif self.peak_usage > self.limit:
+                raise ResourceLimitException(f"{self.name} exceeded "
+                    "available space")
+
+
+# Space meters: ways of measuring memory usage of this process (in MB, since
+# the meter was created). Each has methods `usage()` (current usage),
+# `start()` (called before a section of code; returns current usage) and
+# `stop()` (called after; returns current and peak usage).
+
+class _StatmMeter:
+    """
+    Measures resident memory (RSS), reading /proc/self/statm through a cached
+    file descriptor (linux only), with the peak from getrusage.
+    """
+    per_package = False
+    def __init__(self):
+        self.fd = os.open("/proc/self/statm", os.O_RDONLY)
+        self.page_mb = resource.getpagesize() / 1024 / 1024
+        self.base = 0
+        self.base = self.usage()
+        self.base_peak = _get_peak_rss()
+        self.peak = 0
+    def usage(self):
+        pages = int(os.pread(self.fd, 64, 0).split()[1])
+        return pages * self.page_mb - self.base
+    def start(self):
+        return self.usage()
+    def stop(self):
+        curr_usage = self.usage()
+        self.peak = max(self.peak, curr_usage, _get_peak_rss() - self.base_peak)
+        return curr_usage, self.peak
+    def reset_peak(self):
+        self.base_peak = max(self.base_peak, _get_peak_rss())
+        self.peak = 0
+
+class _RusageMeter:
+    """
+    Measures peak resident memory using getrusage (unix only). Current usage
+    is not available, so this reports the peak as current usage too.
+    """
+    per_package = False
+    def __init__(self):
+        self.base = _get_peak_rss()
+    def usage(self):
+        return _get_peak_rss() - self.base
+    def start(self):
+        return self.usage()
+    def stop(self):
+        usage = self.usage()
+        return usage, usage
+    def reset_peak(self):
+        self.base = max(self.base, _get_peak_rss())
+
+class _StatusMeter:
+    """
+    Measures virtual memory size (VmSize and VmPeak), parsing
+    /proc/self/status (linux only).
+    """
+    per_package = False
+    def __init__(self):
+        self.base, _ = _get_space_usage()
+    def usage(self):
+        curr_usage, _ = _get_space_usage()
+        return curr_usage - self.base
+    def start(self):
+        return self.usage()
+    def stop(self):
+        curr_usage, peak_usage = _get_space_usage()
+        return curr_usage - self.base, peak_usage - self.base
+
+class _TracemallocMeter:
+    """
+    Measures memory allocated by Python code using tracemalloc, attributing
+    each allocation to the player packages in its traceback (so that each
+    player's usage is measured separately). Slow: for diagnostics.
+    """
+    per_package = True
+    def __init__(self):
+        tracemalloc.start(_TRACEMALLOC_FRAMES)
+        self.packages = {}
+    def usage(self):
+        return tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    def for_package(self, package):
+        if package not in self.packages:
+            self.packages[package] = _PackageMeter(package)
+        return self.packages[package]
+
+class _PackageMeter:
+    """Measures memory allocated by code in a package (see above)."""
+    def __init__(self, package):
+        self.filter = tracemalloc.Filter(True,
+            os.path.join(package, "*"), all_frames=True)
+        self.curr_usage = 0
+        self.peak = 0
+    def start(self):
+        # (usage hasn't changed since the last section, apart from garbage
+        # collection, so don't take another snapshot)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self.traced = tracemalloc.get_traced_memory()[0]
+        return self.curr_usage
+    def stop(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([self.filter])
+        size = sum(trace.size for trace in snapshot.traces)
+        # at most, this package allocated everything at the peak of the
+        # section that was not allocated before it
+        peak_size = tracemalloc.get_traced_memory()[1] - self.traced
+        peak_usage = self.curr_usage + max(peak_size, 0) / 1024 / 1024
+        self.curr_usage = size / 1024 / 1024
+        self.peak = max(self.peak, self.curr_usage, peak_usage)
+        return self.curr_usage, self.peak
 
-            self._set_status(f"space: {curr_usage:7.3f}MB (current usage) "
-                f"{peak_usage:7.3f}MB (max usage) (shared)")
+SPACE_METERS = {
+    "statm": _StatmMeter,
+    "rusage": _RusageMeter,
+    "status": _StatusMeter,
+    "tracemalloc": _TracemallocMeter,
+}
+_TRACEMALLOC_FRAMES = 64
 
-            # if we are limited, let's hope we are not out of space!
-            if self.limit is not None and self.limit > 0 and peak_usage > self.limit:
-                raise ResourceLimitException("players exceeded shared space "
-                    "limit")
+def _get_peak_rss():
+    """Find the peak resident memory of the current process, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB
 
 def _get_space_usage():
     """
@@ -174,21 +439,20 @@ def _get_space_usage():
                 peak_usage = int(line.split()[1]) / 1024 # kB -> MB
     return curr_usage, peak_usage
 
-_DEFAULT_MEM_USAGE = 0
-_SPACE_ENABLED = False
-def set_space_line():
+_SPACE_METER = None
+def set_space_line(meter="statm"):
     """
     by default, the python interpreter uses a significant amount of space
-    measure this first to later subtract from all measurements
+    measure this first to later subtract from all measurements (using the
+    named space meter, see SPACE_METERS)
     """
-    global _SPACE_ENABLED, _DEFAULT_MEM_USAGE
+    global _SPACE_METER
     
     try:
-        _DEFAULT_MEM_USAGE, _ = _get_space_usage()
-        _SPACE_ENABLED = True
-    except:
+        _SPACE_METER = SPACE_METERS[meter]()
+    except Exception:
         # this also gives us a chance to detect if our space-measuring method 
         # will work on this platform, and notify the user if not.
-        print("* NOTE: unable to measure memory usage on this platform "
-            "(try dimefox)")
-        _SPACE_ENABLED = False
+        print(f"* NOTE: unable to measure memory usage with {meter!r} on "
+            "this platform (try dimefox)")
+        _SPACE_METER = None
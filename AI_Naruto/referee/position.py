@@ -0,0 +1,127 @@
+"""
+A compact text notation for positions of the game (like chess's FEN), for
+setting up games from arbitrary positions (see Game.from_position), suites
+of positions for benchmarks and analysis, and keys for caching results.
+
+A position is three fields separated by single spaces:
+
+    <board> <colour to move> <turns>
+
+The board lists the rows from the top (y = 7) down to y = 0, separated by
+'/', and each row from x = 0 to 7: a stack is one letter, upper case for
+white and lower case for black, giving its height (A/a for 1, B/b for 2, up
+to L/l for 12), and a run of empty squares is its length (a digit 1 to 8).
+The colour to move is 'w' or 'b', and turns is the number of turns played so
+far (both players' turns: white moves when it is even). For example, the
+start of a game is:
+
+    aa1aa1aa/aa1aa1aa/8/8/8/8/AA1AA1AA/AA1AA1AA w 0
+
+format_position gives the one canonical string for a position (with runs
+of empty squares merged), so strings can be compared and used as keys.
+
+This notation is read by AI_Naruto.player.State.from_position too, with a
+copy of this parser (the player can't import the referee) which accepts
+exactly the same strings: tests/test_position.py checks that they agree.
+"""
+
+COLOURS = "white", "black"
+MAX_HEIGHT = 12
+
+START = "aa1aa1aa/aa1aa1aa/8/8/8/8/AA1AA1AA/AA1AA1AA w 0"
+
+# character -> (colour, height) of a stack, or the number of empty squares
+_PARSE = {}
+# (colour index, height) -> character
+_FORMAT = {}
+for _n in range(1, MAX_HEIGHT + 1):
+    _PARSE[chr(ord('A') + _n - 1)] = ("white", _n)
+    _PARSE[chr(ord('a') + _n - 1)] = ("black", _n)
+    _FORMAT[0, _n] = chr(ord('A') + _n - 1)
+    _FORMAT[1, _n] = chr(ord('a') + _n - 1)
+for _k in range(1, 9):
+    _PARSE[str(_k)] = _k
+_TO_MOVE = {"w": "white", "b": "black"}
+_EMPTY_BOARD = "/".join(["." * 8] * 8)
+_EMPTY_RUNS = [("." * k, str(k)) for k in range(8, 0, -1)]
+
+# rows parsed before (the same rows come up again and again: empty, the start
+# rows, ...), as tuples of (x, colour, height) for each stack
+ROW_CACHE_SIZE = 1 << 14
+_ROWS = {}
+
+
+class PositionError(ValueError):
+    """For a string which is not a valid position."""
+
+
+def parse_position(position):
+    """
+    Parse a position string: return (white, black, colour, turns), where
+    white and black map squares (x, y) to the heights of each colour's
+    stacks, colour is the colour to move, and turns is the number of turns
+    played. Raise a PositionError if the string is not a valid position.
+    """
+    if not isinstance(position, str):
+        raise PositionError(f"expected a position string: {position!r}")
+    try:
+        board, to_move, turns = position.split(" ")
+        colour = _TO_MOVE[to_move]
+        turns = int(turns)
+    except (ValueError, KeyError):
+        raise PositionError(f"expected '<board> <w|b> <turns>': {position!r}")
+    if turns < 0 or COLOURS[turns % 2] != colour:
+        raise PositionError(f"{colour} can't be to move after {turns} turns")
+    rows = board.split("/")
+    if len(rows) != 8:
+        raise PositionError(f"expected 8 rows of 8 squares: {board!r}")
+    white, black = {}, {}
+    stacks = {"white": white, "black": black}
+    y = 7
+    for row in rows:
+        items = _ROWS.get(row)
+        if items is None:
+            items = _parse_row(row)
+        for x, stack_colour, n in items:
+            stacks[stack_colour][x, y] = n
+        y -= 1
+    for c, s in stacks.items():
+        if sum(s.values()) > MAX_HEIGHT:
+            raise PositionError(f"more than {MAX_HEIGHT} {c} tokens")
+    return white, black, colour, turns
+
+def _parse_row(row):
+    """The stacks in a row, as (x, colour, height), remembered in _ROWS."""
+    stacks = []
+    x = 0
+    for char in row:
+        item = _PARSE.get(char)
+        if item is None or x >= 8:
+            break
+        if item.__class__ is int:
+            x += item
+        else:
+            stacks.append((x, *item))
+            x += 1
+    else:
+        if x == 8:
+            if len(_ROWS) >= ROW_CACHE_SIZE:
+                _ROWS.clear()
+            items = _ROWS[row] = tuple(stacks)
+            return items
+    raise PositionError(f"expected a row of 8 squares: {row!r}")
+
+def format_position(white, black, colour, turns):
+    """The position string for stacks `white` and `black` (dictionaries
+    from squares to heights), with `colour` to move after `turns` turns."""
+    # one character per square (in the order written, '/' after each row),
+    # then each run of empty squares replaced by its length, longest first
+    cells = list(_EMPTY_BOARD)
+    for (x, y), n in white.items():
+        cells[x + 9*(7 - y)] = _FORMAT[0, n]
+    for (x, y), n in black.items():
+        cells[x + 9*(7 - y)] = _FORMAT[1, n]
+    board = "".join(cells)
+    for run, length in _EMPTY_RUNS:
+        board = board.replace(run, length)
+    return f"{board} {colour[0]} {turns}"
@@ -0,0 +1,109 @@
+"""
+Provide a renderer for drawing boards in place at the top of an ANSI
+terminal: after the first frame, only the cells which have changed are
+redrawn (using cursor movements), and the rest of the output scrolls past
+below the board. This keeps watching live games cheap, e.g. over slow links.
+
+A board is drawn from a template (a format string, like those used by
+referee.game and AI_Naruto.util.print_board) with a '{}' placeholder for a
+message (alone on its line) and a '{:}' placeholder for each cell (3
+characters wide, not counting ANSI codes).
+"""
+
+import re
+import sys
+import time
+import shutil
+
+FPS_DEFAULT = 30 # frames per second, at most
+
+# ANSI control sequences
+_CLEAR = "\033[H\033[2J"    # move home and clear the screen
+_MOVE = "\033[{};{}H"       # move to (row, column), counting from 1
+_CLEAR_LINE = "\033[K"      # clear to the end of the line
+_SAVE, _RESTORE = "\0337", "\0338" # save/restore the cursor position
+_SCROLL = "\033[{};{}r"     # set the scrolling region (rows)
+_RESET_SCROLL = "\033[r"
+
+
+class DiffRenderer:
+    """
+    Draws boards in place, redrawing only what changed since the last frame,
+    and at most `fps` frames per second (frames requested sooner are skipped,
+    except the last, which is drawn when the renderer is closed).
+    """
+    def __init__(self, file=sys.stdout, fps=FPS_DEFAULT):
+        self.file = file
+        self.interval = 1 / fps if fps else 0
+        self.last_time = -self.interval
+        self.template = None # last frame drawn
+        self.message = None
+        self.cells = None
+        self.pending = None # latest frame skipped
+
+    def render(self, template, message, cells):
+        """
+        Draw a board: `template` formatted with `message` and `cells` (a list
+        of 3-character strings, in the order of the template's placeholders).
+        """
+        now = time.perf_counter()
+        if now - self.last_time < self.interval:
+            self.pending = (template, message, list(cells))
+            return
+        self.last_time = now
+        self.pending = None
+        self._draw(template, str(message), list(cells))
+
+    def close(self):
+        """Draw any skipped last frame and give back the whole terminal."""
+        if self.pending is not None:
+            self._draw(*self.pending)
+            self.pending = None
+        if self.template is not None:
+            print(_RESET_SCROLL, end="", file=self.file, flush=True)
+            self.template = None
+
+    def _draw(self, template, message, cells):
+        if template is not self.template:
+            # first frame (or a new template): draw everything, and keep
+            # the rest of the output scrolling below
+            self.layout = _layout(template)
+            rows = template.count("\n") + 1
+            height = shutil.get_terminal_size().lines
+            frame = [_CLEAR, template.format(message, *cells), "\n",
+                _SCROLL.format(rows + 2, height), _MOVE.format(rows + 2, 1)]
+        else:
+            frame = [_SAVE]
+            header_row, header_line, positions = self.layout
+            if message != self.message and header_row is not None:
+                frame += [_MOVE.format(header_row + 1, 1),
+                    header_line.format(message), _CLEAR_LINE]
+            for (row, col), cell, old_cell in zip(positions, cells,
+                    self.cells):
+                if cell != old_cell:
+                    frame += [_MOVE.format(row + 1, col + 1), cell]
+            frame.append(_RESTORE)
+        self.template, self.message, self.cells = template, message, cells
+        print(*frame, sep="", end="", file=self.file, flush=True)
+
+
+_PLACEHOLDER = re.compile(r"\{:?\}")
+
+def _layout(template):
+    """
+    Find the row of the message in a board template (and that line of the
+    template), and the (row, column) of each cell, counting from 0.
+    """
+    header_row = header_line = None
+    positions = []
+    for row, line in enumerate(template.split("\n")):
+        col = end = 0
+        for match in _PLACEHOLDER.finditer(line):
+            col += match.start() - end
+            end = match.end()
+            if match.group() == "{}":
+                header_row, header_line = row, line
+            else:
+                positions.append((row, col))
+                col += 3
+    return header_row, header_line, positions
@@ -0,0 +1,188 @@
+"""
+Verify logged games without their players: parse the game logs written by
+the referee (its -l option), apply each recorded action to a fresh Game (set
+up at the position the game started from: the start, unless the log records
+another), checking that it was legal with Game.is_legal, in constant time,
+and check that the replayed game ends with the recorded result (or, for a
+game which ended with an illegal action, that the recorded action was
+illegal).
+
+Log files are checked in parallel, by a pool of worker processes, and any
+game which doesn't replay as recorded is reported. Run with:
+
+usage: python -m referee.replay [-h] [-j JOBS] [-q] logfile [logfile ...]
+
+The exit status is 1 if any game failed to verify.
+"""
+
+import re
+import ast
+import sys
+import time
+import argparse
+import multiprocessing
+from collections import namedtuple
+
+from referee.game import Game, COLOURS, IllegalActionException
+from referee.position import START, PositionError
+
+# lines of a game log (see Game._log)
+_SQUARE = r"\((\d+), (\d+)\)"
+_MOVE = re.compile(r"\[(white|black)\] - MOVE (\d+) from "
+                   + _SQUARE + " to " + _SQUARE + r"\.$")
+_BOOM = re.compile(r"\[(white|black)\] - BOOM at " + _SQUARE + r"\.$")
+_START = "[game ] - "
+_POSITION = "[game ] - Position: "
+_RESULT = "[over ] - "
+_ILLEGAL = re.compile(r"\[error\] - illegal action detected "
+                      r"\((white|black)\): (.*)\.$")
+
+# a game from a log: the position it started from (see referee.position),
+# its actions, as (colour, action) pairs, its result (or None, if the log
+# stops before the end), and the illegal action (colour, action) which ended
+# it, if any
+GameRecord = namedtuple("GameRecord",
+                        ["position", "actions", "result", "illegal"])
+
+
+def read_games(path):
+    """The games in a game log (usually one, but logs may be appended to
+    each other) as GameRecords."""
+    games = []
+    position = START
+    actions = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            match = _MOVE.match(line)
+            if match:
+                colour, n, xa, ya, xb, yb = match.groups()
+                actions.append((colour, ("MOVE", int(n), (int(xa), int(ya)),
+                                         (int(xb), int(yb)))))
+                continue
+            match = _BOOM.match(line)
+            if match:
+                colour, x, y = match.groups()
+                actions.append((colour, ("BOOM", (int(x), int(y)))))
+                continue
+            if line.startswith(_POSITION):
+                position = line[len(_POSITION):]
+            elif line.startswith(_START):
+                if actions:
+                    games.append(GameRecord(position, actions, None, None))
+                position = START
+                actions = []
+            elif line.startswith(_RESULT):
+                games.append(GameRecord(position, actions,
+                                        line[len(_RESULT):], None))
+                position = START
+                actions = []
+            else:
+                match = _ILLEGAL.match(line)
+                if match:
+                    colour, action = match.groups()
+                    try:
+                        action = ast.literal_eval(action)
+                    except (ValueError, SyntaxError):
+                        pass # (not a literal: it can't have been legal)
+                    games.append(GameRecord(position, actions, None,
+                                            (colour, action)))
+                    position = START
+                    actions = []
+    if actions:
+        games.append(GameRecord(position, actions, None, None))
+    return games
+
+def verify(record):
+    """
+    Replay a GameRecord, returning None if it replays as recorded, or a
+    message describing the first difference.
+    """
+    try:
+        game = Game.from_position(record.position)
+    except PositionError as e:
+        return f"invalid position: {e}"
+    for turn, (colour, action) in enumerate(record.actions):
+        if game.over():
+            return f"turn {turn + 1}: game already over ({game.end()})"
+        if colour != COLOURS[game.nturns % 2]:
+            return f"turn {turn + 1}: {colour} played out of turn"
+        try:
+            game.update(colour, action)
+        except IllegalActionException:
+            return f"turn {turn + 1}: illegal action {action!r} by {colour}"
+    if record.illegal is not None:
+        colour, action = record.illegal
+        if game.over():
+            return f"game over ({game.end()}) before the illegal action"
+        if colour != COLOURS[game.nturns % 2]:
+            return f"illegal action recorded for {colour} out of turn"
+        if game.is_legal(colour, action):
+            return f"recorded illegal action {action!r} is legal"
+        return None
+    if record.result is None:
+        return "log ends before the game does"
+    if not game.over():
+        return f"recorded result {record.result!r}, but the game is not over"
+    result = game.end()
+    if result != record.result:
+        return f"recorded result {record.result!r}, replayed {result!r}"
+    return None
+
+def verify_file(path):
+    """Verify every game in a log file: return (path, number of games,
+    number of actions, [(game number, message) for each failure])."""
+    try:
+        games = read_games(path)
+    except (OSError, UnicodeDecodeError) as e:
+        return path, 0, 0, [(0, f"unreadable: {e}")]
+    failures = []
+    for number, record in enumerate(games, 1):
+        message = verify(record)
+        if message is not None:
+            failures.append((number, message))
+    return path, len(games), sum(len(g.actions) for g in games), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="referee.replay",
+        description="check that logged games replay as recorded, without "
+            "their players.")
+    parser.add_argument('logfiles', nargs='+', metavar='logfile',
+        help="game logs (as written by the referee's -l option).")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help="worker processes (default: one per CPU; 1 for none).")
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help="only report the totals.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    jobs = args.jobs or multiprocessing.cpu_count()
+    if jobs == 1:
+        results = map(verify_file, args.logfiles)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs)
+        chunksize = max(len(args.logfiles) // (4 * jobs), 1)
+        results = pool.imap_unordered(verify_file, args.logfiles, chunksize)
+    n_games = n_actions = n_failed = 0
+    try:
+        for path, games, actions, failures in results:
+            n_games += games
+            n_actions += actions
+            n_failed += len(failures)
+            if not args.quiet:
+                for number, message in failures:
+                    print(f"{path}: game {number}: {message}")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - start
+    print(f"verified {n_games - n_failed} of {n_games} games "
+          f"({n_actions} actions) from {len(args.logfiles)} files "
+          f"in {elapsed:.3f}s ({n_games / elapsed:.0f} games/s)")
+    return 1 if n_failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
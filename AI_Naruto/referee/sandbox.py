@@ -0,0 +1,305 @@
+"""
+Provide a wrapper for Player classes which runs each player in a subprocess
+of its own ('sandbox' mode), rather than importing it into the referee's
+process. Each player then has its own interpreter, garbage collector and
+memory, so time and space can be measured (and limited, using `resource`
+rlimits) exactly, for each player separately, and both players can use
+their own cores.
+
+The referee and the player process talk over a pair of pipes, one line per
+message. The referee sends:
+
+    I <colour>              construct the player (calling `.__init__()`)
+    A                       ask for the player's next action
+    U <colour> <action>     update the player with an action
+    S                       ask for the player's engine metrics, if any
+
+and the player process replies to each message with one of:
+
+    OK <time> <gc> <space> <peak> [<result>]    (an action after A, or
+                                                 metrics as JSON after S)
+    MEM <message>                   (if the player ran out of space)
+    ERR <message>                   (if the player raised an error)
+
+where <time> is the CPU time taken by the player (seconds), <gc> is the CPU
+time spent collecting garbage before the call (off the clock), <space> and
+<peak> are the current and peak memory usage of the player (MB), and
+actions are written compactly as `M n xa ya xb yb` or `B x y`. Metrics are
+collected off the clock (see referee.telemetry).
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import importlib
+import traceback
+import subprocess
+try:
+    import resource
+except ImportError:
+    resource = None # (not available on windows: the sandbox needs unix)
+
+from referee.player import _CountdownTimer, _MemoryWatcher, \
+    _GarbageCollector, _StatmMeter, _RusageMeter, ResourceLimitException
+
+CLOSE_TIMEOUT = 1.0 # seconds for a player process to exit when closed
+
+
+class SandboxPlayerWrapper:
+    """
+    Wraps a real Player class running in a subprocess, providing the same
+    interface as `referee.player.PlayerWrapper`:
+    * Wrapper constructor starts the subprocess, which imports the Player
+      class by name.
+    * `.init()` method constructs the Player instance (calling `.__init__()`)
+    * `.action()` and `.update()` methods just delegate to the real Player's
+      methods of the same name.
+    * `.metrics()` method returns the real Player's engine metrics, if it
+      provides any (see referee.telemetry).
+    * `.close()` shuts the subprocess down.
+    Each method enforces resource limits on the real Player's computation.
+    """
+    def __init__(self, name, player_loc, time_limit=None, space_limit=None,
+            logfn=None, gc_policy="always"):
+        self.log = logfn if logfn else (lambda *_, **__: None) # no-op
+        self.name = name
+        _check_resource()
+
+        # keep track of resource usage reported by the subprocess
+        self.timer = _CountdownTimer(time_limit, self.name)
+        self.space = _MemoryWatcher(space_limit, self.name)
+
+        # start the subprocess, and have it import the Player class
+        player_pkg, player_cls = player_loc
+        self.log("starting %s's process to import player class '%s' "
+            "from package '%s'", self.name, player_cls, player_pkg)
+        to_player, self._to_player = os.pipe()
+        self._from_player, from_player = os.pipe()
+        self.process = subprocess.Popen([sys.executable, "-m", __name__,
+                player_pkg, player_cls, str(to_player), str(from_player),
+                str(time_limit or 0), str(space_limit or 0), gc_policy],
+            pass_fds=(to_player, from_player))
+        os.close(to_player)
+        os.close(from_player)
+        self._out = os.fdopen(self._to_player, 'w', 1)
+        self._in  = os.fdopen(self._from_player, 'r')
+        self._request("") # wait for the import to finish
+
+    def init(self, colour):
+        self.colour = colour
+        self.name += f' ({colour})'
+        self.log("initialising %s player in process %d", self.colour,
+            self.process.pid)
+        self._request(f"I {colour}")
+        self.log(self.timer.status, depth=1)
+        self.log(self.space.status, depth=1)
+
+    def action(self):
+        self.log("asking %s for next action...", self.name)
+        action = decode_action(self._request("A"))
+        self.log("%s returned action: %r", self.name, action, depth=1)
+        self.log(self.timer.status, depth=1)
+        self.log(self.space.status, depth=1)
+        return action
+
+    def update(self, colour, action):
+        self.log("updating %s with %s's action %s...", self.name, colour,
+            action)
+        self._request(f"U {colour} {encode_action(action)}")
+        self.log(self.timer.status, depth=1)
+        self.log(self.space.status, depth=1)
+
+    def metrics(self):
+        return json.loads(self._request("S"))
+
+    def close(self):
+        """
+        Shut down the player's process (by closing its pipes), killing it if
+        it doesn't exit soon after (e.g. if it is still computing an action,
+        when the game ended abnormally).
+        """
+        for f in (self._out, self._in):
+            try:
+                f.close()
+            except OSError:
+                pass # (e.g. a broken pipe, if the process already died)
+        if self.process.poll() is None:
+            try:
+                self.process.wait(timeout=CLOSE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def _request(self, message):
+        """
+        Send a message to the player process (unless empty), wait for its
+        reply, charge the reported resource usage, and return the rest of the
+        reply (e.g. an encoded action).
+        """
+        try:
+            if message:
+                print(message, file=self._out)
+            reply = self._in.readline()
+        except BrokenPipeError:
+            reply = ""
+        if not reply:
+            # the process died: maybe by exceeding its resource limits
+            returncode = self.process.wait()
+            if returncode == -getattr(signal, "SIGXCPU", 0):
+                raise ResourceLimitException(f"{self.name} exceeded "
+                    "available time")
+            raise SandboxException(f"{self.name}'s process exited "
+                f"unexpectedly (exit code {returncode})")
+        return handle_reply(reply, self.name, self.timer, self.space)
+
+
+def handle_reply(reply, name, timer, space):
+    """
+    Check a reply from a player process, charging the reported resource usage
+    to `timer` and `space`, and return the rest of the reply (e.g. an encoded
+    action). Raise an exception if the player has failed.
+    """
+    status, *fields = reply.rstrip("\n").split(" ", 5)
+    if status == "MEM":
+        raise ResourceLimitException(f"{name} exceeded available space")
+    if status == "ERR":
+        raise SandboxException(f"{name} raised an error: " + " ".join(fields))
+    elapsed, collected, curr_usage, peak_usage, *result = fields
+    timer.collector.clock += float(collected)
+    timer.charge(float(elapsed))
+    space.record(float(curr_usage), float(peak_usage))
+    return result[0] if result else ""
+
+
+class SandboxException(Exception):
+    """For when a player's process fails (other than by resource limits)."""
+
+
+def encode_action(action):
+    """
+    Encode an action compactly for the pipe protocol. An action which isn't
+    well-formed is passed through as its repr (the referee will reject it).
+    """
+    try:
+        if action[0] == "MOVE":
+            _, n, (xa, ya), (xb, yb) = action
+            encoded = f"M {n:d} {xa:d} {ya:d} {xb:d} {yb:d}"
+        else:
+            _, (x, y) = action
+            encoded = f"B {x:d} {y:d}"
+        if decode_action(encoded) == action:
+            return encoded
+    except (TypeError, ValueError, IndexError, KeyError):
+        pass
+    return "? " + repr(action)
+
+def decode_action(encoded):
+    """Decode an action encoded by `encode_action`."""
+    atype, _, args = encoded.partition(" ")
+    if atype == "M":
+        n, xa, ya, xb, yb = map(int, args.split())
+        return ("MOVE", n, (xa, ya), (xb, yb))
+    if atype == "B":
+        x, y = map(int, args.split())
+        return ("BOOM", (x, y))
+    return args # (not well-formed)
+
+
+# PLAYER PROCESS
+
+def main(player_pkg, player_cls, infd, outfd, time_limit, space_limit,
+        gc_policy):
+    """
+    Serve requests from the referee for a player, until the referee closes
+    the pipe.
+    """
+    inp = os.fdopen(int(infd), 'r')
+    out = os.fdopen(int(outfd), 'w', 1)
+    Player = getattr(importlib.import_module(player_pkg), player_cls)
+    serve(Player, inp, out, float(time_limit), float(space_limit), gc_policy)
+
+def serve(Player, inp, out, time_limit=0, space_limit=0, gc_policy="always"):
+    """
+    Serve requests for players of class `Player`, read from file `inp`, with
+    replies written to file `out`, until `inp` is closed. Garbage is collected
+    before each request according to `gc_policy` (see _GarbageCollector).
+    """
+    reply = lambda *fields: print(*fields, file=out, flush=True)
+
+    _check_resource()
+    # measure from here, after all library imports should be finished, and
+    # limit resources (generously: the referee enforces the exact limits,
+    # these are for players which would never return)
+    try:
+        meter = _StatmMeter()
+    except OSError:
+        meter = _RusageMeter()
+    if time_limit > 0:
+        cpu_limit = int(time.process_time() + 2 * time_limit) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+    if space_limit > 0:
+        vm_limit = int((_get_vm() + 2 * space_limit) * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (vm_limit, vm_limit))
+    reply("OK", 0, 0, 0, 0)
+
+    player = None
+    collector = _GarbageCollector(gc_policy)
+    curr_space = peak_space = 0
+    for message in inp:
+        request, *args = message.rstrip("\n").split(" ", 2)
+        if request == "S":
+            metrics = getattr(player, "metrics", None)
+            metrics = metrics() if metrics is not None else None
+            reply("OK", 0, 0, f"{curr_space:.3f}", f"{peak_space:.3f}",
+                json.dumps(metrics))
+            continue
+        if request == "I":
+            # a new game: forget the previous player and its peak usage
+            player = None
+            meter.reset_peak()
+            collector = _GarbageCollector(gc_policy)
+        # clean up memory off the clock, then start timing
+        collected = collector.clock
+        collector.collect()
+        start = time.process_time()
+        try:
+            result = ()
+            if request == "I":
+                player = Player(args[0])
+            elif request == "A":
+                result = (encode_action(player.action()),)
+            elif request == "U":
+                player.update(args[0], decode_action(args[1]))
+        except MemoryError:
+            player = None
+            reply("MEM", "out of memory")
+            continue
+        except Exception as e:
+            traceback.print_exc()
+            reply("ERR", f"{type(e).__name__}: {e}".replace("\n", " "))
+            continue
+        elapsed = time.process_time() - start
+        if request == "I":
+            collector.initialised()
+        collected = collector.clock - collected
+        curr_space, peak_space = meter.stop()
+        reply("OK", f"{elapsed:.6f}", f"{collected:.6f}", f"{curr_space:.3f}",
+            f"{peak_space:.3f}", *result)
+
+def _check_resource():
+    """Fail clearly if the `resource` module (measuring and limiting the
+    player process's time and space) is missing."""
+    if resource is None:
+        raise SandboxException("sandbox mode needs the 'resource' module, "
+            "which is not available on this platform (unix only)")
+
+def _get_vm():
+    """Find the current virtual memory size of this process (linux only), in MB"""
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[0])
+    return pages * resource.getpagesize() / 1024 / 1024
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,277 @@
+"""
+Host many concurrent games in one long-lived referee process, for playing
+large numbers of games (rather than running `python -m referee` per game).
+
+Players run as clients (see referee.client) which connect to the server over
+a local (unix) socket and introduce themselves with a line:
+
+    HELLO <name>
+
+after which they speak the protocol of sandboxed players (see
+referee.sandbox). The server pairs up waiting players into games, plays all
+of the games concurrently, awaiting each reply with a deadline based on the
+player's remaining time, and writes the result of each game as a line of
+JSON as soon as the game ends. After a game, both players go back to waiting
+for their next game (so two clients will play repeatedly, swapping colours).
+
+usage: python -m referee.server [-h] [-g GAMES] [-t TIME] [-s SPACE]
+                                [-r RESULTS] [-T TELEMETRY] socket
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import functools
+import itertools
+
+from referee.game import Game, play_turn, COLOURS, IllegalActionException
+from referee.player import _CountdownTimer, _MemoryWatcher, \
+    ResourceLimitException
+from referee.sandbox import handle_reply, encode_action, decode_action, \
+    SandboxException
+from referee.telemetry import TelemetryWriter
+
+# a player must reply within its remaining CPU time times this factor, plus
+# this many seconds (replies take longer than the CPU time they report when
+# many players are sharing the machine's cores)
+DEADLINE_FACTOR = 2.0
+DEADLINE_GRACE  = 1.0
+
+
+class RemotePlayer:
+    """
+    A player connected to the server. For each game it plays, this provides
+    the interface of a Player wrapper (`.init()`, `.action()` and `.update()`
+    methods), except that the methods are coroutines.
+    """
+    def __init__(self, client, reader, writer, time_limit=None,
+            space_limit=None):
+        self.client = client
+        self.name = client
+        self.reader = reader
+        self.writer = writer
+        self.time_limit = time_limit
+        self.space_limit = space_limit
+        self.closed = False
+        self.new_game()
+
+    def new_game(self):
+        """Reset resource usage, ready to play a new game."""
+        self.timer = _CountdownTimer(self.time_limit, self.client)
+        self.space = _MemoryWatcher(self.space_limit, self.client)
+
+    async def init(self, colour):
+        self.colour = colour
+        self.name = f"{self.client} ({colour})"
+        self.new_game()
+        await self._request(f"I {colour}")
+
+    async def action(self):
+        reply = await self._request("A")
+        try:
+            return decode_action(reply)
+        except ValueError:
+            raise self._malformed(reply)
+
+    async def update(self, colour, action):
+        await self._request(f"U {colour} {encode_action(action)}")
+
+    async def metrics(self):
+        reply = await self._request("S")
+        try:
+            return json.loads(reply)
+        except ValueError:
+            raise self._malformed(reply)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+    async def _request(self, message):
+        """
+        Send a message to the player (unless empty), await its reply (until
+        its deadline), charge the reported resource usage, and return the
+        rest of the reply (e.g. an encoded action).
+        """
+        timeout = None
+        if self.timer.limit:
+            remaining = max(self.timer.limit - self.timer.clock, 0)
+            timeout = remaining * DEADLINE_FACTOR + DEADLINE_GRACE
+        try:
+            if message:
+                self.writer.write(message.encode() + b"\n")
+                await self.writer.drain()
+            reply = await asyncio.wait_for(self.reader.readline(), timeout)
+        except asyncio.TimeoutError:
+            # the player may still be thinking: it can't play on
+            self.close()
+            raise ResourceLimitException(f"{self.name} exceeded available "
+                "time")
+        except ConnectionError:
+            reply = b""
+        if not reply:
+            self.close()
+            raise SandboxException(f"{self.name} disconnected")
+        try:
+            return handle_reply(reply.decode(), self.name, self.timer,
+                                self.space)
+        except ValueError: # (including UnicodeDecodeError)
+            raise self._malformed(reply)
+
+    def _malformed(self, reply):
+        """Disconnect the player for a reply which can't be read, and return
+        the exception to raise."""
+        self.close()
+        return SandboxException(f"{self.name} sent a malformed reply: "
+                                f"{reply!r}")
+
+
+class GameServer:
+    """
+    Accept player connections on a unix socket, pair them up and play games
+    between them concurrently, writing results to `results` (a file), and
+    per-turn records to `telemetry` (a TelemetryWriter), if not None.
+    """
+    def __init__(self, path, time_limit=None, space_limit=None,
+            max_games=None, results=sys.stdout, telemetry=None):
+        self.path = path
+        self.time_limit = time_limit
+        self.space_limit = space_limit
+        self.max_games = max_games
+        self.results = results
+        self.telemetry = telemetry
+        self.game_ids = itertools.count(1)
+        self.games = set()
+
+    async def serve(self):
+        """Serve games until `max_games` have been played (or forever)."""
+        self.waiting = asyncio.Queue()
+        server = await asyncio.start_unix_server(self.connect, self.path)
+        try:
+            await self.pair_players()
+            await asyncio.gather(*self.games)
+        finally:
+            server.close()
+            await server.wait_closed()
+            while not self.waiting.empty():
+                self.waiting.get_nowait().close()
+            os.unlink(self.path)
+
+    async def connect(self, reader, writer):
+        """Handle a new connection: a player ready to play games."""
+        hello = (await reader.readline()).decode(errors="replace")
+        hello = hello.rstrip("\n")
+        if not hello.startswith("HELLO "):
+            writer.close()
+            return
+        player = RemotePlayer(hello[6:], reader, writer,
+            time_limit=self.time_limit, space_limit=self.space_limit)
+        try:
+            await player._request("") # wait for it to be ready
+        except (SandboxException, ResourceLimitException):
+            return
+        await self.waiting.put(player)
+
+    async def pair_players(self):
+        """Start a game for every two waiting players."""
+        for game_id in self.game_ids:
+            if self.max_games is not None and game_id > self.max_games:
+                return
+            white = await self._next_player()
+            black = await self._next_player()
+            game = asyncio.ensure_future(self.play(game_id, white, black))
+            self.games.add(game)
+            game.add_done_callback(self.games.discard)
+
+    async def _next_player(self):
+        player = await self.waiting.get()
+        while player.closed:
+            player = await self.waiting.get()
+        return player
+
+    async def play(self, game_id, white, black):
+        """
+        Play a game, then write its result and requeue the players. If the
+        game fails any other way (or is cancelled), disconnect both players
+        rather than leave them waiting.
+        """
+        players = [white, black]
+        game = Game()
+        curr_player = None
+        telemetry = None
+        if self.telemetry is not None:
+            telemetry = functools.partial(self.telemetry.record, game=game_id)
+        finished = False
+        try:
+            try:
+                for player, colour in zip(players, COLOURS):
+                    curr_player = player
+                    await player.init(colour)
+                curr_player, next_player = players
+                while not game.over():
+                    await play_turn(game, curr_player, players,
+                        telemetry=telemetry)
+                    curr_player, next_player = next_player, curr_player
+                result = game.end()
+            except IllegalActionException:
+                result = f"error: invalid action by {curr_player.name}"
+            except (ResourceLimitException, SandboxException) as e:
+                result = f"error: {e}"
+            record = {
+                "game": game_id,
+                "white": white.client,
+                "black": black.client,
+                "result": result,
+                "turns": game.nturns,
+                "score": game.score,
+                "time": {c: round(p.timer.clock, 6)
+                    for c, p in zip(COLOURS, players)},
+            }
+            print(json.dumps(record), file=self.results, flush=True)
+            finished = True
+        finally:
+            for player in reversed(players): # (swap colours for a rematch)
+                if not finished:
+                    player.close()
+                elif not player.closed:
+                    self.waiting.put_nowait(player)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="referee.server",
+        description="host many concurrent games between connecting players.")
+    parser.add_argument('socket',
+        help="path of the unix socket to accept player connections on.")
+    parser.add_argument('-g', '--games', type=int, default=None,
+        help="stop after this many games (default: run forever).")
+    parser.add_argument('-t', '--time', type=float, default=0,
+        help="limit on CPU time (float, seconds) for each player, per game.")
+    parser.add_argument('-s', '--space', type=float, default=0,
+        help="limit on memory space (float, MB) for each player.")
+    parser.add_argument('-r', '--results', type=argparse.FileType('w'),
+        default=sys.stdout,
+        help="write game results (JSON lines) to this file (default: "
+            "standard output).")
+    parser.add_argument('-T', '--telemetry', default=None,
+        help="append per-turn telemetry records (JSON lines) to this file.")
+    args = parser.parse_args()
+
+    telemetry = None
+    if args.telemetry is not None:
+        telemetry = TelemetryWriter(args.telemetry)
+    server = GameServer(args.socket, time_limit=args.time,
+        space_limit=args.space, max_games=args.games, results=args.results,
+        telemetry=telemetry)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Provide a structured telemetry stream: records (dictionaries) describing each
+turn of each game, written as JSON Lines (one JSON object per line), for
+charting players' resource usage and search performance across many games.
+
+The referee writes a record for each turn with the current player's CPU time
+and memory usage and the number of actions available to them, and a record
+for the result of each game. A Player class can add engine metrics to its
+turn records by providing a method:
+
+    metrics()   called after each of the player's `.action()` calls (off the
+                clock), returning a dictionary of JSON-serialisable values
+                (e.g. nodes searched, depth reached)
+
+Records are serialised and written by a background thread, through a large
+buffer, so writing them costs the game little more than putting them in a
+queue.
+"""
+
+import json
+import queue
+import threading
+
+BUFFER_SIZE = 1 << 16   # bytes of output to buffer before writing
+QUEUE_SIZE  = 1 << 12   # records to queue before blocking the game
+
+
+class TelemetryWriter:
+    """
+    Write telemetry records as JSON Lines to a file (appending, so that the
+    records of many runs accumulate), from a background thread.
+    """
+    def __init__(self, path, **fields):
+        """
+        Open `path` for appending records. Any keyword arguments are fields
+        to include in every record (e.g. to identify this run).
+        """
+        self.fields = fields
+        self.file = open(path, 'a', buffering=BUFFER_SIZE)
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def record(self, **fields):
+        """
+        Queue a record with these fields for writing. The values must not be
+        modified afterwards (they are serialised later, by the writer thread).
+        """
+        self.queue.put(fields)
+
+    def close(self):
+        """Write all queued records, then close the file."""
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write(self):
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        while True:
+            fields = self.queue.get()
+            if fields is None:
+                break
+            self.file.write(encode({**self.fields, **fields}) + "\n")
+            # flush whenever we catch up, so the file can be followed live
+            if self.queue.empty():
+                self.file.flush()
@@ -0,0 +1,103 @@
+"""
+Check AI_Naruto.batch against the player's own State, one state at a time:
+the same legal actions and the same evaluations (also of the leaves batched
+by AI_Naruto.selfplay). Skipped without NumPy (which the player doesn't
+need, see requirements-optional.txt). Run from the directory containing
+referee with:
+
+    python -m unittest discover tests
+"""
+
+import random
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from AI_Naruto.player import State, Board, WHITE_INITIAL_SQUARES, \
+    BLACK_INITIAL_SQUARES, evaluate_state, load_weights
+
+GAMES = 40
+MAX_TURNS = 60
+WEIGHTS = [tuple(load_weights()), (16, 16, 2.56, -5.28), (7, -3, -2, 4)]
+
+
+def random_states(seed="AI_Naruto"):
+    """(state, color to move) for the states of random games, including some
+    BOOMs, and up to the end of the game."""
+    rng = random.Random(seed)
+    states = []
+    for _ in range(GAMES):
+        state = State(Board(None),
+                      {qr: 1 for qr in WHITE_INITIAL_SQUARES},
+                      {qr: 1 for qr in BLACK_INITIAL_SQUARES})
+        for turn in range(MAX_TURNS):
+            color = ("white", "black")[turn % 2]
+            states.append((State(Board(None), state.white_tokens,
+                                 state.black_tokens), color))
+            actions = state.get_legal_actions(color)
+            if not actions:
+                break
+            state.apply(rng.choice(actions))
+    return states
+
+
+@unittest.skipIf(np is None, "needs NumPy")
+class BatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from AI_Naruto import batch
+        cls.batch = batch
+        cls.states = random_states()
+        cls.heights = batch.encode([state for state, _ in cls.states])
+        cls.signs = np.array([batch.SIGNS[color] for _, color in cls.states])
+
+    def test_legal_actions(self):
+        actions = self.batch.legal_actions(self.heights, self.signs)
+        for i, (state, color) in enumerate(self.states):
+            expected = state.get_legal_actions(color)
+            got = self.batch.actions(actions, i)
+            with self.subTest(state=i):
+                moves = [a for a in got if a[0] == "MOVE"]
+                self.assertEqual(len(moves), len(set(moves)))
+                self.assertEqual(set(moves),
+                                 {a for a in expected if a[0] == "MOVE"})
+                # a BOOM for every stack (the state gives one per blast
+                # component, on one of its stacks)
+                stacks = state.white_tokens if color == "white" else \
+                    state.black_tokens
+                booms = [a[1] for a in got if a[0] == "BOOM"]
+                self.assertEqual(sorted(booms), sorted(stacks))
+                for action in expected:
+                    if action[0] == "BOOM":
+                        self.assertIn(action[1], stacks)
+
+    def test_evaluate(self):
+        for weights in WEIGHTS:
+            values = self.batch.evaluate(self.heights, self.signs, weights)
+            for i, (state, color) in enumerate(self.states):
+                with self.subTest(weights=weights, state=i):
+                    self.assertEqual(int(values[i]),
+                                     evaluate_state(state, color, weights))
+
+    def test_selfplay_leaves(self):
+        # the leaves of the last ply, applied and evaluated in a batch
+        from AI_Naruto.selfplay import Evaluator, NumpyEvaluator
+        batched, leaves = [], []
+        for state, color in self.states[::10]:
+            batched.append(NumpyEvaluator().children(state, color, leaves))
+        values = NumpyEvaluator().evaluate(leaves)
+        for i, (state, color) in enumerate(self.states[::10]):
+            expected = []
+            children = Evaluator().children(state, color, expected)
+            with self.subTest(state=i):
+                self.assertEqual(
+                    {action: values[leaf] for action, leaf in batched[i]},
+                    {action: expected[leaf] for action, leaf in children})
+
+
+if __name__ == '__main__':
+    unittest.main()
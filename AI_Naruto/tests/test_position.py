@@ -0,0 +1,90 @@
+"""
+Check that the player's copy of the position parser (AI_Naruto.player,
+which can't import the referee) accepts exactly the same strings as
+referee.position, and reads them the same way. Run from the directory
+containing referee with:
+
+    python -m unittest discover tests
+"""
+
+import random
+import unittest
+
+from AI_Naruto import player
+from referee import position
+from referee.game import Game, COLOURS
+
+GAMES = 20
+MAX_TURNS = 80
+MUTATIONS = 20
+# characters to mutate positions with: every valid one, and some which aren't
+CHARS = "ABLMalm012789/ wb-x"
+
+
+def random_positions(seed="referee.position"):
+    """Position strings from random games (valid), and mutations of them
+    (mostly not)."""
+    rng = random.Random(seed)
+    positions = [position.START]
+    for _ in range(GAMES):
+        game = Game()
+        for _ in range(MAX_TURNS):
+            if game.over():
+                break
+            colour = COLOURS[game.nturns % 2]
+            game.update(colour, rng.choice(sorted(
+                game._available_actions(colour))))
+            positions.append(game.position())
+    mutants = []
+    for string in positions:
+        for _ in range(MUTATIONS):
+            chars = list(string)
+            i = rng.randrange(len(chars))
+            kind = rng.randrange(3)
+            if kind == 0:
+                chars[i] = rng.choice(CHARS)
+            elif kind == 1:
+                chars.insert(i, rng.choice(CHARS))
+            else:
+                del chars[i]
+            mutants.append("".join(chars))
+    return positions + mutants
+
+
+def parse(parser, string):
+    """The parsed position, or the type of error raised."""
+    try:
+        return parser(string)
+    except Exception as e:
+        return type(e)
+
+
+class PositionTest(unittest.TestCase):
+
+    def test_same_positions(self):
+        for string in random_positions():
+            with self.subTest(position=string):
+                expected = parse(position.parse_position, string)
+                result = parse(player.parse_position, string)
+                if expected is position.PositionError:
+                    self.assertIs(result, player.PositionError)
+                else:
+                    self.assertEqual(result, expected)
+
+    def test_invalid_positions(self):
+        for string in (None, 0, b"8/8/8/8/8/8/8/8 w 0", ["8"] * 8,
+                       "8/8/8/8/8/8/8/8 b 0", "8/8/8/8/8/8/8/8 w -2",
+                       "8/8/8/8/8/8/8/8 w 1", "8/8/8/8/8/8/8 w 0",
+                       "8/8/8/8/8/8/8/08 w 0", "8/8/8/8/8/8/8/9 w 0",
+                       "8/8/8/8/8/8/8/45 w 0", "8/8/8/8/8/8/8/1A6 w 0 ",
+                       "L/8/8/8/8/8/8/8 w 0", "LA6/8/8/8/8/8/8/8 w 0",
+                       "l7/a7/8/8/8/8/8/8 w 0"):
+            with self.subTest(position=string):
+                self.assertRaises(position.PositionError,
+                                  position.parse_position, string)
+                self.assertRaises(player.PositionError,
+                                  player.parse_position, string)
+
+
+if __name__ == '__main__':
+    unittest.main()